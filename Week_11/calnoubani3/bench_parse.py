@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+from magnumopus.sam import SAM, _SKIPPED_FLAGS
+from magnumopus.store import ReadStore
+
+EXAMPLE_SAM = Path(__file__).parent / "ERR11767307_1_vs_16S.sam"
+
+
+def parse_args():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description="Benchmark SAM parsing throughput on a scaled-up example SAM")
+    parser.add_argument('-s', '--sam', default=str(EXAMPLE_SAM), help='SAM file to scale up')
+    parser.add_argument('-x', '--scale', type=int, default=200, help='Number of copies of the records to parse')
+    parser.add_argument('-n', '--repeat', type=int, default=3, help='Runs per parser, the best is reported')
+    return parser.parse_args()
+
+
+def write_scaled_sam(sam_path: str, scale: int, out_file) -> int:
+    """Write the header and scale copies of the records of a SAM, returning the record count"""
+    with open(sam_path) as f:
+        lines = f.readlines()
+    header = [line for line in lines if line.startswith('@')]
+    records = [line for line in lines if not line.startswith('@')]
+    out_file.writelines(header)
+    for _ in range(scale):
+        out_file.writelines(records)
+    out_file.flush()
+    return len(records) * scale
+
+
+def split_every_line(sam_path: str) -> ReadStore:
+    """Parse by splitting every record before filtering and appending records one at
+    a time, as from_sam used to, for comparison"""
+    store = ReadStore()
+    with open(sam_path) as f:
+        for line in f:
+            if line.startswith('@'):
+                continue
+            fields = line.strip().split("\t")
+            if not int(fields[1]) & _SKIPPED_FLAGS:
+                store.append(fields)
+    return store
+
+
+def best_time(func, sam_path: str, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(sam_path)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    args = parse_args()
+    with tempfile.NamedTemporaryFile("w", suffix=".sam") as scaled:
+        n_records = write_scaled_sam(args.sam, args.scale, scaled)
+        n_kept = len(SAM.from_sam(scaled.name).reads)
+        print(f"{n_records} records ({n_kept} primary mapped), {Path(scaled.name).stat().st_size / 1e6:.1f} MB")
+        print("parser\tseconds\trecords/s")
+        for name, func in [("split + append each", split_every_line), ("SAM.from_sam", SAM.from_sam)]:
+            seconds = best_time(func, scaled.name, args.repeat)
+            print(f"{name}\t{seconds:.2f}\t{n_records / seconds:,.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+
+import struct
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator
+
+from .store import ReadStore
+
+# BGZF blocks are gzip members carrying their compressed size in a "BC" extra field
+_BGZF_HEADER = struct.Struct("<4BI2BH2BHH")
+_BGZF_FOOTER = struct.Struct("<II")
+_BGZF_EOF = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+_MAX_BLOCK_DATA = 0xff00
+
+_BAM_RECORD = struct.Struct("<iiBBHHHiiii")
+_BAM_FLAG = struct.Struct("<H")
+# CIGAR ops consuming the reference (M, D, N, = and X)
+_SPAN_OPS = {0, 2, 3, 7, 8}
+_SEQ_CODES = "=ACMGRSVTWYHKDBN"
+# 4-bit packed sequence byte -> two bases
+_SEQ_PAIRS = [_SEQ_CODES[byte >> 4] + _SEQ_CODES[byte & 15] for byte in range(256)]
+_SEQ_CODE = {base: i for i, base in enumerate(_SEQ_CODES)}
+# phred scores to and from printable quality characters
+_PHRED_TO_QUAL = bytes((q + 33) & 0xff for q in range(256))
+_QUAL_TO_PHRED = bytes((c - 33) & 0xff for c in range(256))
+
+_TAG_TYPES = {"c": "<b", "C": "<B", "s": "<h", "S": "<H", "i": "<i", "I": "<I", "f": "<f"}
+_SCALAR_TAGS = {tag_type: struct.Struct(fmt) for tag_type, fmt in _TAG_TYPES.items()}
+# smallest BAM integer type for a SAM 'i' value
+_INT_TYPES = [("c", -2**7, 2**7), ("C", 0, 2**8), ("s", -2**15, 2**15), ("S", 0, 2**16),
+              ("i", -2**31, 2**31), ("I", 0, 2**32)]
+
+
+def _read_block(f) -> tuple[int, bytes]:
+    """Read one raw BGZF block, returning its file offset and compressed bytes (b'' at end)"""
+    offset = f.tell()
+    header = f.read(_BGZF_HEADER.size)
+    if not header:
+        return offset, b""
+    id1, id2, _, flg, _, _, _, xlen, si1, si2, _, bsize = _BGZF_HEADER.unpack(header)
+    if (id1, id2, flg, si1, si2) != (31, 139, 4, 66, 67) or xlen != 6:
+        raise ValueError(f"Not a BGZF block at offset {offset}")
+    return offset, header + f.read(bsize + 1 - _BGZF_HEADER.size)
+
+
+def _inflate(block: bytes) -> bytes:
+    """Decompress a raw BGZF block, checking its CRC and size"""
+    data = zlib.decompress(block[_BGZF_HEADER.size:-_BGZF_FOOTER.size], -15)
+    crc, size = _BGZF_FOOTER.unpack(block[-_BGZF_FOOTER.size:])
+    if zlib.crc32(data) != crc or len(data) != size:
+        raise ValueError("Corrupt BGZF block")
+    return data
+
+
+def is_bgzf(path: str) -> bool:
+    """Return whether a file starts with a BGZF block"""
+    with open(path, "rb") as f:
+        header = f.read(_BGZF_HEADER.size)
+    return len(header) == _BGZF_HEADER.size and header[:4] == b"\x1f\x8b\x08\x04" and header[12:14] == b"BC"
+
+
+def _deflate(data: bytes, level: int) -> bytes:
+    """Compress data into one BGZF block"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    cdata = compressor.compress(data) + compressor.flush()
+    bsize = _BGZF_HEADER.size + len(cdata) + _BGZF_FOOTER.size - 1
+    header = _BGZF_HEADER.pack(31, 139, 8, 4, 0, 0, 255, 6, 66, 67, 2, bsize)
+    return header + cdata + _BGZF_FOOTER.pack(zlib.crc32(data), len(data))
+
+
+class BgzfReader:
+    """Read a BGZF file, decompressing blocks ahead of use in a thread pool
+
+    zlib releases the GIL, so blocks inflate in parallel while records are parsed.
+    Positions are BGZF virtual offsets: block file offset << 16 | offset in block.
+    """
+    def __init__(self, path: str, threads: int = 4):
+        self._file = open(path, "rb")
+        self._threads = max(1, threads)
+        self._executor = ThreadPoolExecutor(max_workers=self._threads)
+        self._pending: deque = deque()
+        self._block_offset = 0
+        self._data = b""
+        self._pos = 0
+        self._eof = False
+
+    def __enter__(self) -> 'BgzfReader':
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._executor.shutdown(cancel_futures=True)
+        self._file.close()
+
+    def _fill(self):
+        """Keep a few blocks per thread queued for decompression"""
+        while not self._eof and len(self._pending) < self._threads * 4:
+            offset, block = _read_block(self._file)
+            if not block:
+                self._eof = True
+                break
+            self._pending.append((offset, self._executor.submit(_inflate, block)))
+
+    def _next_block(self) -> bool:
+        """Move to the next non-empty block, returning False at end of file"""
+        while True:
+            self._fill()
+            if not self._pending:
+                return False
+            offset, future = self._pending.popleft()
+            self._block_offset, self._data, self._pos = offset, future.result(), 0
+            if self._data:
+                return True
+
+    def seek(self, virtual_offset: int):
+        """Move to a virtual offset"""
+        for _, future in self._pending:
+            future.cancel()
+        self._pending.clear()
+        self._eof = False
+        self._file.seek(virtual_offset >> 16)
+        self._data, self._pos = b"", 0
+        if self._next_block():
+            self._pos = virtual_offset & 0xffff
+
+    def tell(self) -> int:
+        """Return virtual offset of the next byte to be read"""
+        if self._pos >= len(self._data):
+            self._next_block()
+        return self._block_offset << 16 | self._pos
+
+    def read(self, size: int) -> bytes:
+        """Read up to size bytes, fewer only at end of file"""
+        chunks = []
+        while size > 0:
+            if self._pos >= len(self._data) and not self._next_block():
+                break
+            chunk = self._data[self._pos:self._pos + size]
+            self._pos += len(chunk)
+            size -= len(chunk)
+            chunks.append(chunk)
+        return b"".join(chunks)
+
+
+class BgzfWriter:
+    """Write a BGZF file, compressing full blocks in a thread pool"""
+    def __init__(self, path: str, threads: int = 4, level: int = 6):
+        self._file = open(path, "wb")
+        self._threads = max(1, threads)
+        self._level = level
+        self._executor = ThreadPoolExecutor(max_workers=self._threads)
+        self._pending: deque = deque()
+        self._buffer = bytearray()
+
+    def __enter__(self) -> 'BgzfWriter':
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, data: bytes):
+        self._buffer += data
+        while len(self._buffer) >= _MAX_BLOCK_DATA:
+            self._submit(bytes(self._buffer[:_MAX_BLOCK_DATA]))
+            del self._buffer[:_MAX_BLOCK_DATA]
+
+    def _submit(self, data: bytes):
+        self._pending.append(self._executor.submit(_deflate, data, self._level))
+        # write finished blocks in order, bounding how many are held in memory
+        while self._pending and (self._pending[0].done() or len(self._pending) > self._threads * 4):
+            self._file.write(self._pending.popleft().result())
+
+    def close(self):
+        if self._file.closed:
+            return
+        if self._buffer:
+            self._submit(bytes(self._buffer))
+            self._buffer.clear()
+        while self._pending:
+            self._file.write(self._pending.popleft().result())
+        self._file.write(_BGZF_EOF)
+        self._executor.shutdown()
+        self._file.close()
+
+
+def read_bam_header(bgzf: BgzfReader) -> tuple[str, list[tuple[str, int]]]:
+    """Return header text and (name, length) of each reference"""
+    if bgzf.read(4) != b"BAM\1":
+        raise ValueError("Not a BAM file")
+    (l_text,) = struct.unpack("<i", bgzf.read(4))
+    text = bgzf.read(l_text).rstrip(b"\0").decode()
+    (n_ref,) = struct.unpack("<i", bgzf.read(4))
+    refs = []
+    for _ in range(n_ref):
+        (l_name,) = struct.unpack("<i", bgzf.read(4))
+        name = bgzf.read(l_name).rstrip(b"\0").decode()
+        (l_ref,) = struct.unpack("<i", bgzf.read(4))
+        refs.append((name, l_ref))
+    return text, refs
+
+
+def _decode_tags(data: bytes) -> str:
+    """Convert binary BAM tags to tab-joined SAM text tags"""
+    tags = []
+    i = 0
+    while i < len(data):
+        tag, tag_type = data[i:i + 2].decode(), chr(data[i + 2])
+        i += 3
+        if tag_type in _SCALAR_TAGS:
+            scalar = _SCALAR_TAGS[tag_type]
+            (value,) = scalar.unpack_from(data, i)
+            tags.append(f"{tag}:f:{value:g}" if tag_type == "f" else f"{tag}:i:{value}")
+            i += scalar.size
+        elif tag_type == "A":
+            tags.append(f"{tag}:A:{chr(data[i])}")
+            i += 1
+        elif tag_type in "ZH":
+            end = data.index(0, i)
+            tags.append(f"{tag}:{tag_type}:{data[i:end].decode()}")
+            i = end + 1
+        elif tag_type == "B":
+            sub_type = chr(data[i])
+            (count,) = struct.unpack_from("<i", data, i + 1)
+            fmt = _TAG_TYPES[sub_type]
+            values = struct.unpack_from(f"<{count}{fmt[1]}", data, i + 5)
+            tags.append(f"{tag}:B:{sub_type}" + "".join(f",{value:g}" if sub_type == "f" else f",{value}" for value in values))
+            i += 5 + count * struct.calcsize(fmt)
+        else:
+            raise ValueError(f"Unknown BAM tag type {tag_type!r}")
+    return "\t".join(tags)
+
+
+def _encode_tags(tags: list[str]) -> bytes:
+    """Convert SAM text tags to binary BAM tags"""
+    data = bytearray()
+    for tag in tags:
+        name, tag_type, value = tag.split(":", 2)
+        if tag_type == "i":
+            value = int(value)
+            int_type = next(code for code, lo, hi in _INT_TYPES if lo <= value < hi)
+            data += name.encode() + int_type.encode() + struct.pack(_TAG_TYPES[int_type], value)
+        elif tag_type == "f":
+            data += name.encode() + b"f" + struct.pack("<f", float(value))
+        elif tag_type == "A":
+            data += name.encode() + b"A" + value.encode()
+        elif tag_type in "ZH":
+            data += name.encode() + tag_type.encode() + value.encode() + b"\0"
+        elif tag_type == "B":
+            sub_type, *values = value.split(",")
+            convert = float if sub_type == "f" else int
+            data += name.encode() + b"B" + sub_type.encode() + struct.pack("<i", len(values))
+            data += struct.pack(f"<{len(values)}{_TAG_TYPES[sub_type][1]}", *map(convert, values))
+        else:
+            raise ValueError(f"Unknown SAM tag type in {tag}")
+    return bytes(data)
+
+
+def iter_bam_records(bgzf: BgzfReader) -> Iterator[tuple[int, bytes]]:
+    """Yield (virtual offset, raw record) for each remaining BAM record"""
+    while True:
+        offset = bgzf.tell()
+        size = bgzf.read(4)
+        if len(size) < 4:
+            return
+        yield offset, bgzf.read(struct.unpack("<i", size)[0])
+
+
+def record_position(record: bytes) -> tuple[int, int, int, int]:
+    """Return (ref_id, 1-based pos, flag, reference span) of a raw BAM record"""
+    ref_id, pos, l_read_name, _, _, n_cigar, flag = _BAM_RECORD.unpack_from(record)[:7]
+    cigar = struct.unpack_from(f"<{n_cigar}I", record, _BAM_RECORD.size + l_read_name)
+    return ref_id, pos + 1, flag, sum(code >> 4 for code in cigar if code & 15 in _SPAN_OPS)
+
+
+def decode_record(record: bytes, ref_names: list[str], store: ReadStore) -> int:
+    """Append a raw BAM record to store, returning its index"""
+    (ref_id, pos, l_read_name, mapq, _, n_cigar, flag, l_seq,
+     next_ref_id, next_pos, tlen) = _BAM_RECORD.unpack_from(record)
+
+    i = _BAM_RECORD.size
+    qname = record[i:i + l_read_name - 1].decode()
+    i += l_read_name
+    cigar_codes = struct.unpack_from(f"<{n_cigar}I", record, i)
+    i += 4 * n_cigar
+    seq = "".join(map(_SEQ_PAIRS.__getitem__, record[i:i + (l_seq + 1) // 2]))[:l_seq] or "*"
+    i += (l_seq + 1) // 2
+    qual = record[i:i + l_seq]
+    qual = "*" if not l_seq or qual[0] == 0xff else qual.translate(_PHRED_TO_QUAL).decode()
+    i += l_seq
+
+    rname = ref_names[ref_id] if ref_id >= 0 else "*"
+    if next_ref_id < 0:
+        rnext = "*"
+    elif next_ref_id == ref_id:
+        rnext = "="
+    else:
+        rnext = ref_names[next_ref_id]
+    return store.append_record(qname, flag, rname, pos + 1, mapq, cigar_codes, rnext,
+                               next_pos + 1, tlen, seq, qual, _decode_tags(record[i:]))
+
+
+def read_bam_records(bgzf: BgzfReader, ref_names: list[str], store: ReadStore, skip_flags: int = 0):
+    """Append each remaining BAM record to store, except those with any of skip_flags set"""
+    for _, record in iter_bam_records(bgzf):
+        if not _BAM_FLAG.unpack_from(record, 14)[0] & skip_flags:
+            decode_record(record, ref_names, store)
+
+
+def reg2bin(beg: int, end: int) -> int:
+    """Return the BAM bin of a 0-based, end-exclusive region"""
+    end -= 1
+    for shift, offset in ((14, 4681), (17, 585), (20, 73), (23, 9), (26, 1)):
+        if beg >> shift == end >> shift:
+            return offset + (beg >> shift)
+    return 0
+
+
+def encode_record(store: ReadStore, i: int, ref_ids: dict[str, int]) -> bytes:
+    """Return BAM encoding of record i of a store, including its block_size prefix"""
+    fields = store.fields(i)
+    qname, rname, rnext, seq, qual = fields[0], fields[2], fields[6], fields[9], fields[10]
+    ref_id = ref_ids.get(rname, -1)
+    if rnext == "=":
+        next_ref_id = ref_id
+    else:
+        next_ref_id = ref_ids.get(rnext, -1)
+
+    pos = store.pos[i] - 1
+    end = pos + (store.mapped_len[i] or 1)
+    cigar = store.cigar[store.cigar_offsets[i]:store.cigar_offsets[i + 1]]
+    if seq == "*":
+        seq = ""
+    packed = bytes(_SEQ_CODE.get(seq[j], 15) << 4 | (_SEQ_CODE.get(seq[j + 1], 15) if j + 1 < len(seq) else 0)
+                   for j in range(0, len(seq), 2))
+    if qual == "*":
+        qual_bytes = b"\xff" * len(seq)
+    else:
+        qual_bytes = qual.encode().translate(_QUAL_TO_PHRED)
+
+    record = _BAM_RECORD.pack(ref_id, pos, len(qname) + 1, store.mapq[i], reg2bin(pos, end), len(cigar),
+                              store.flag[i], len(seq), next_ref_id, store.pnext[i] - 1, store.tlen[i])
+    record += qname.encode() + b"\0" + struct.pack(f"<{len(cigar)}I", *cigar) + packed + qual_bytes + _encode_tags(fields[11:])
+    return struct.pack("<i", len(record)) + record
+
+
+def write_bam(path: str, store: ReadStore, refs: list[tuple[str, int]], threads: int = 4, level: int = 6):
+    """Write the records of a store to a BAM file with the given (name, length) references"""
+    ref_ids = {name: i for i, (name, _) in enumerate(refs)}
+    text = "".join(f"@SQ\tSN:{name}\tLN:{length}\n" for name, length in refs).encode()
+    with BgzfWriter(path, threads, level) as bgzf:
+        header = b"BAM\1" + struct.pack("<i", len(text)) + text + struct.pack("<i", len(refs))
+        for name, length in refs:
+            header += struct.pack("<i", len(name) + 1) + name.encode() + b"\0" + struct.pack("<i", length)
+        bgzf.write(header)
+        for i in range(len(store)):
+            bgzf.write(encode_record(store, i, ref_ids))
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import re
+
+from .bam import BgzfReader, decode_record, is_bgzf, iter_bam_records, read_bam_header, record_position
+from .store import ReadStore
+
+INDEX_SUFFIX = ".lidx"
+# 16 kb windows, as in the BAI linear index
+WINDOW_SHIFT = 14
+
+# CIGAR ops consuming the reference (M, D, N, = and X)
+_SPAN_RE = re.compile(rb"(\d+)[MDN=X]")
+
+
+def _sam_positions(path: str):
+    """Yield (byte offset, reference, 1-based pos, flag, reference span) of each SAM record"""
+    with open(path, "rb") as f:
+        offset = 0
+        for line in f:
+            if not line.startswith(b"@"):
+                _, flag, rname, pos, _, cigar = line.split(b"\t", 6)[:6]
+                flag = int(flag)
+                span = 1 if flag & 4 else sum(int(n) for n in _SPAN_RE.findall(cigar)) or 1
+                yield offset, rname.decode(), int(pos), flag, span
+            offset += len(line)
+
+
+def _bam_positions(path: str):
+    """Yield (virtual offset, reference, 1-based pos, flag, reference span) of each BAM record"""
+    with BgzfReader(path) as bgzf:
+        _, refs = read_bam_header(bgzf)
+        for offset, record in iter_bam_records(bgzf):
+            ref_id, pos, flag, span = record_position(record)
+            yield offset, refs[ref_id][0] if ref_id >= 0 else "*", pos, flag, span or 1
+
+
+class LinearIndex:
+    """Sidecar linear index of a coordinate-sorted SAM or BAM file
+
+    For each reference, offsets[w] is the offset of the first record overlapping
+    window w (positions w << WINDOW_SHIFT onwards, 0-based), so a region query can
+    seek straight to it. Offsets are byte offsets for SAM and virtual offsets for BAM.
+    """
+    def __init__(self, offsets: dict[str, list[int]], source_size: int = 0, source_mtime: int = 0):
+        self.offsets: dict[str, list[int]] = offsets
+        self.source_size: int = source_size
+        self.source_mtime: int = source_mtime
+
+    @classmethod
+    def build(cls, path: str) -> 'LinearIndex':
+        """Index a coordinate-sorted SAM or BAM file"""
+        positions = _bam_positions(path) if is_bgzf(path) else _sam_positions(path)
+        offsets: dict[str, list[int]] = {}
+        windows = None
+        last_ref, last_pos = None, 0
+        for offset, rname, pos, flag, span in positions:
+            if rname == "*":
+                break  # unplaced unmapped reads are sorted to the end
+            if rname != last_ref:
+                if rname in offsets:
+                    raise ValueError(f"{path} is not coordinate sorted, {rname} reads are not contiguous")
+                windows = offsets[rname] = []
+                last_ref, last_pos = rname, 0
+            if pos < last_pos:
+                raise ValueError(f"{path} is not coordinate sorted at {rname}:{pos}")
+            last_pos = pos
+
+            # records arrive in file order, so the first to reach a window has its lowest offset
+            first, last = (pos - 1) >> WINDOW_SHIFT, (pos + span - 2) >> WINDOW_SHIFT
+            if last >= len(windows):
+                windows.extend([None] * (last + 1 - len(windows)))
+            for w in range(first, last + 1):
+                if windows[w] is None:
+                    windows[w] = offset
+
+        # Windows no read overlaps take the next window's offset; no earlier record can
+        # overlap a later window since offsets never decrease along a sorted reference
+        for windows in offsets.values():
+            for w in range(len(windows) - 2, -1, -1):
+                if windows[w] is None:
+                    windows[w] = windows[w + 1]
+
+        stat = os.stat(path)
+        return cls(offsets, stat.st_size, stat.st_mtime_ns)
+
+    @classmethod
+    def load(cls, index_file: str) -> 'LinearIndex':
+        with open(index_file) as f:
+            data = json.load(f)
+        if data.get("window_shift") != WINDOW_SHIFT:
+            raise ValueError(f"{index_file} uses a different window size")
+        return cls(data["offsets"], data["source_size"], data["source_mtime"])
+
+    def save(self, index_file: str):
+        with open(index_file, "w") as f:
+            json.dump({"source_size": self.source_size, "source_mtime": self.source_mtime,
+                       "window_shift": WINDOW_SHIFT, "offsets": self.offsets}, f)
+
+    @classmethod
+    def for_file(cls, path: str) -> 'LinearIndex':
+        """Load the sidecar index of a file, building (and saving) it if missing or stale"""
+        index_file = str(path) + INDEX_SUFFIX
+        stat = os.stat(path)
+        try:
+            index = cls.load(index_file)
+            if (index.source_size, index.source_mtime) == (stat.st_size, stat.st_mtime_ns):
+                return index
+        except (OSError, ValueError, KeyError):
+            pass
+
+        index = cls.build(path)
+        try:
+            index.save(index_file)
+        except OSError:
+            pass  # read-only location, the index is still usable in memory
+        return index
+
+    def first_offset(self, seq_name: str, pos: int) -> int|None:
+        """Return offset to start reading at for records overlapping pos onwards, None if there are none"""
+        windows = self.offsets.get(seq_name, [])
+        w = max(0, (pos - 1) >> WINDOW_SHIFT)
+        if w >= len(windows):
+            return None  # no read reaches this far
+        return windows[w]
+
+
+def fetch_records(path: str, index: LinearIndex, seq_name: str, start: int, end: int, skip_flags: int = 0) -> ReadStore:
+    """Return a store of records overlapping positions start to end (1-based, inclusive),
+    in file order, reading only from the first indexed window of the region"""
+    store = ReadStore()
+    offset = index.first_offset(seq_name, start)
+    if offset is None:
+        return store
+
+    if is_bgzf(path):
+        with BgzfReader(path) as bgzf:
+            _, refs = read_bam_header(bgzf)
+            ref_names = [name for name, _ in refs]
+            bgzf.seek(offset)
+            for _, record in iter_bam_records(bgzf):
+                ref_id, pos, flag, _ = record_position(record)
+                if ref_id < 0 or ref_names[ref_id] != seq_name or pos > end:
+                    break
+                if not flag & skip_flags:
+                    decode_record(record, ref_names, store)
+    else:
+        with open(path, "rb") as f:
+            f.seek(offset)
+            for line in f:
+                fields = line.decode().strip().split("\t")
+                if fields[2] != seq_name or int(fields[3]) > end:
+                    break
+                if not int(fields[1]) & skip_flags:
+                    store.append(fields)
+
+    # drop reads ending before the region
+    return store.take(i for i in range(len(store)) if store.pos[i] + store.mapped_len[i] > start)
@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+
+import pickle
+from array import array
+from collections import Counter
+from math import log10
+from operator import add
+from typing import Iterable
+
+PILEUP_SYMBOLS = "ACGTN-"
+_N_SYMBOLS = len(PILEUP_SYMBOLS)
+# highest quality written to FASTQ ('~')
+MAX_PHRED = 93
+# Phred cost of a mismatch beyond its base quality: an error is one of 3 other bases
+_MISMATCH_PHRED = 10 * log10(3)
+
+# A (row, symbol, quality) observation is packed into one int so a whole block of
+# bases can be counted with a single Counter.update: ((row * 6 + symbol) << 7) | qual_byte
+_ROW_STEP = _N_SYMBOLS << 7
+_SYMBOL_KEY = [PILEUP_SYMBOLS.index(chr(c)) << 7 if chr(c) in "ACGT" else 4 << 7 for c in range(256)]
+# soft-masked (lowercase) bases count as their uppercase base, anything but ACGT as N
+_BASE_TABLE = str.maketrans({chr(c): chr(c).upper() if chr(c).upper() in "ACGT" else "N" for c in range(256)})
+_DELETION_SYMBOL = PILEUP_SYMBOLS.index("-")
+_DELETION_KEY = _DELETION_SYMBOL << 7 | 33
+
+
+def normalise_bases(seq: str) -> str:
+    """Return seq as pileups count it: uppercase, with anything but ACGT as N"""
+    return seq.translate(_BASE_TABLE)
+
+
+def _majority_base(base_counts: dict[str, int]) -> str:
+    """Return majority base call from counts, 'N' for ties or no base >50%, '' if empty"""
+    if not base_counts:
+        return ''
+
+    # Get counts and total
+    max_count = max(base_counts.values())
+    total = sum(base_counts.values())
+
+    # Count how many bases have the max count
+    bases_with_max = sum(1 for count in base_counts.values() if count == max_count)
+
+    # Return 'N' if:
+    # - Multiple bases have the same count (tie)
+    # - No base has >50% representation
+    if bases_with_max > 1 or max_count/total <= 0.5:
+        return 'N'
+
+    # Get the base with max count
+    for base, count in base_counts.items():
+        if count == max_count:
+            return base
+
+    return 'N'  # Fallback case
+
+
+def _posterior_call(*weights: float) -> tuple[int, int]:
+    """Return (index of best allele, Phred quality of the call) from allele weights
+
+    With a flat prior, an allele's posterior is proportional to 10^(weight/10), so the
+    call's error probability is the share of the other alleles. Ties give index -1.
+    """
+    best = max(weights)
+    if weights.count(best) > 1:
+        return -1, 0
+    others = sum(10 ** ((weight - best) / 10) for weight in weights) - 1
+    if others <= 0:
+        return weights.index(best), MAX_PHRED
+    return weights.index(best), min(MAX_PHRED, round(10 * log10((1 + others) / others)))
+
+
+class Pileup:
+    """Base counts and summed base qualities for each position of a reference window
+
+    counts and quals are flat row-major (positions x PILEUP_SYMBOLS) arrays, with
+    non-ACGT bases counted as N and deletions as '-'. Reads with an insertion after
+    a base are also recorded in insertions as {row: {base + inserted: [count, qual_sum,
+    anchor_qual_sum]}}, where each observation contributes the lowest quality of its
+    bases to qual_sum and the quality of the base before the insertion to anchor_qual_sum.
+
+    Reads with MAPQ below min_mapq are skipped, and bases (or insertions) with
+    quality below min_base_qual are not counted. read_count is the number of reads
+    counted.
+    """
+    def __init__(self, start: int, end: int, min_base_qual: int = 0, min_mapq: int = 0):
+        self.start: int = start
+        self.end: int = max(start, end)
+        self.min_base_qual: int = min_base_qual
+        self.min_mapq: int = min_mapq
+        self.counts: array = array("l", [0]) * (len(self) * _N_SYMBOLS)
+        self.quals: array = array("l", [0]) * (len(self) * _N_SYMBOLS)
+        self.insertions: dict[int, dict[str, list[int]]] = {}
+        self.read_count: int = 0
+
+        # Cached majority calls per row and rows changed since they were made
+        self._calls: list[str] = None
+        self._dirty: set[int] = set()
+
+    def __len__(self) -> int:
+        return self.end - self.start
+
+    def expand(self, start: int, end: int):
+        """Grow the window to cover positions start to end (exclusive), keeping counts"""
+        if not len(self):
+            self.start = self.end = start
+        before = max(0, self.start - start)
+        after = max(0, end - self.end)
+        if not before and not after:
+            return
+        for name in ("counts", "quals"):
+            column = array("l", [0]) * (before * _N_SYMBOLS)
+            column += getattr(self, name)
+            column += array("l", [0]) * (after * _N_SYMBOLS)
+            setattr(self, name, column)
+        self.insertions = {row + before: entry for row, entry in self.insertions.items()}
+        if self._calls is not None:
+            self._calls = ['N'] * before + self._calls + ['N'] * after
+        self._dirty = {row + before for row in self._dirty}
+        self.start -= before
+        self.end += after
+
+    def add_reads(self, reads: Iterable['Read']):
+        """Add the aligned bases of reads falling inside the window"""
+        keys = Counter()
+        for read in reads:
+            if read.mapq < self.min_mapq:
+                continue
+            self.read_count += 1
+            seq = normalise_bases(read.seq)
+            seq_bytes = seq.encode()
+            qual = read.qual.encode()
+            if qual == b"*":
+                qual = b"!" * len(seq_bytes)
+
+            prev_end = None
+            for ref_pos, read_idx, length, ins_len in read.aligned_blocks():
+                # gap since the previous block is a deletion
+                if prev_end is not None:
+                    lo, hi = max(prev_end, self.start), min(ref_pos, self.end)
+                    if lo < hi:
+                        keys.update(range((lo - self.start) * _ROW_STEP + _DELETION_KEY,
+                                          (hi - self.start) * _ROW_STEP, _ROW_STEP))
+                prev_end = ref_pos + length
+
+                # bulk count this block's bases, clipped to the window
+                lo, hi = max(ref_pos, self.start), min(ref_pos + length, self.end)
+                if lo < hi:
+                    first = read_idx + lo - ref_pos
+                    last = first + hi - lo
+                    rows = range((lo - self.start) * _ROW_STEP, (hi - self.start) * _ROW_STEP, _ROW_STEP)
+                    symbols = map(_SYMBOL_KEY.__getitem__, seq_bytes[first:last])
+                    keys.update(map(add, map(add, rows, symbols), qual[first:last]))
+
+                if ins_len and self.start <= ref_pos + length - 1 < self.end:
+                    # an insertion failing the quality filter still counts as its anchor
+                    # base, which has already been filtered on its own quality
+                    anchor = read_idx + length - 1
+                    ins_qual = min(qual[anchor:anchor + ins_len + 1]) - 33
+                    if ins_qual >= self.min_base_qual:
+                        self._dirty.add(ref_pos + length - 1 - self.start)
+                        entry = self.insertions.setdefault(ref_pos + length - 1 - self.start, {})
+                        entry = entry.setdefault(seq[anchor:anchor + ins_len + 1], [0, 0, 0])
+                        entry[0] += 1
+                        entry[1] += ins_qual
+                        entry[2] += qual[anchor] - 33
+
+        # fold observations into the count and quality matrices, dropping low quality
+        # bases (deletions have no quality of their own and are always kept)
+        counts, quals, dirty = self.counts, self.quals, self._dirty
+        min_key = self.min_base_qual + 33
+        for key, n in keys.items():
+            if key & 127 < min_key and (key >> 7) % _N_SYMBOLS != _DELETION_SYMBOL:
+                continue
+            cell = key >> 7
+            counts[cell] += n
+            quals[cell] += ((key & 127) - 33) * n
+            dirty.add(cell // _N_SYMBOLS)
+
+    def merge(self, other: 'Pileup'):
+        """Add another pileup's counts, qualities and insertions to this one"""
+        if (self.min_base_qual, self.min_mapq) != (other.min_base_qual, other.min_mapq):
+            raise ValueError("can't merge pileups with different quality filters")
+        self.read_count += other.read_count
+        if not len(other):
+            return
+        self.expand(other.start, other.end)
+        shift = other.start - self.start
+        first, last = shift * _N_SYMBOLS, (shift + len(other)) * _N_SYMBOLS
+        self.counts[first:last] = array("l", map(add, self.counts[first:last], other.counts))
+        self.quals[first:last] = array("l", map(add, self.quals[first:last], other.quals))
+        for row, entry in other.insertions.items():
+            merged = self.insertions.setdefault(row + shift, {})
+            for bases, values in entry.items():
+                merged[bases] = list(map(add, merged.get(bases, [0, 0, 0]), values))
+        self._dirty.update(range(shift, shift + len(other)))
+
+    def save(self, path: str):
+        """Write the pileup to a file, to be topped up with more reads later"""
+        with open(path, "wb") as f:
+            pickle.dump(self, f)
+
+    @classmethod
+    def load(cls, path: str) -> 'Pileup':
+        """Read a pileup written by save"""
+        with open(path, "rb") as f:
+            pileup = pickle.load(f)
+        if not isinstance(pileup, cls):
+            raise ValueError(f"{path} does not hold a pileup")
+        return pileup
+
+    def row(self, pos: int) -> tuple[int]:
+        """Return counts of each of PILEUP_SYMBOLS at a reference position"""
+        row = pos - self.start
+        return tuple(self.counts[row * _N_SYMBOLS:(row + 1) * _N_SYMBOLS])
+
+    def base_counts(self, pos: int) -> dict[str, int]:
+        """Return counts of bases (with any inserted bases appended) at a reference position"""
+        row = pos - self.start
+        base_counts = {}
+        for i, count in enumerate(self.counts[row * _N_SYMBOLS:row * _N_SYMBOLS + 5]):
+            if count:
+                base_counts[PILEUP_SYMBOLS[i]] = count
+
+        # reads with an insertion after this base are counted under base + inserted bases
+        for bases, (count, _, _) in self.insertions.get(row, {}).items():
+            symbol = bases[0] if bases[0] in "ACGT" else "N"
+            base_counts[symbol] -= count
+            if not base_counts[symbol]:
+                del base_counts[symbol]
+            base_counts[bases] = count
+        return base_counts
+
+    def depth(self) -> array:
+        """Return number of aligned bases (excluding deletions) at each position"""
+        counts = self.counts
+        return array("l", [sum(counts[i:i + 5]) for i in range(0, len(counts), _N_SYMBOLS)])
+
+    def breadth(self) -> int:
+        """Return number of positions with at least one aligned base"""
+        return sum(1 for depth in self.depth() if depth)
+
+    def _majority_call(self, row: int) -> str:
+        """Return majority call at a row, 'N' for ties, no base >50% or no coverage"""
+        if row in self.insertions:
+            return _majority_base(self.base_counts(self.start + row)) or 'N'
+
+        row_counts = self.counts[row * _N_SYMBOLS:row * _N_SYMBOLS + 5]
+        max_count = max(row_counts)
+        if not max_count or row_counts.count(max_count) > 1 or max_count * 2 <= sum(row_counts):
+            return 'N'
+        return PILEUP_SYMBOLS[row_counts.index(max_count)]
+
+    def consensus(self, start: int = None, end: int = None) -> str:
+        """Return majority consensus over the window, 'N' for ties, no base >50% or no coverage
+
+        If start and end are given, only positions start to end (exclusive) are
+        returned, with 'N' outside the window. Calls are kept between calls, so after
+        add_reads only the positions the new reads touched are called again.
+        """
+        if self._calls is None:
+            self._calls = [self._majority_call(row) for row in range(len(self))]
+        else:
+            for row in self._dirty:
+                self._calls[row] = self._majority_call(row)
+        self._dirty.clear()
+        if start is None:
+            return "".join(self._calls)
+
+        lo, hi = max(start, self.start), min(end, self.end)
+        if lo >= hi:
+            return "N" * max(0, end - start)
+        return "N" * (lo - start) + "".join(self._calls[lo - self.start:hi - self.start]) + "N" * (end - hi)
+
+    def _allele_weights(self, row: int) -> dict[str, float]:
+        """Return weights of base (and base + inserted) alleles at a row with insertions"""
+        offset = row * _N_SYMBOLS
+        weights = {base: self.quals[offset + i] + _MISMATCH_PHRED * self.counts[offset + i] for i, base in enumerate("ACGT")}
+        for bases, (count, qual_sum, anchor_qual_sum) in self.insertions[row].items():
+            if bases[0] in weights:
+                weights[bases[0]] -= anchor_qual_sum + _MISMATCH_PHRED * count
+                weights[bases] = qual_sum + _MISMATCH_PHRED * count
+        return weights
+
+    def weighted_consensus(self) -> tuple[str, str]:
+        """Return quality-weighted consensus and its FASTQ quality string
+
+        Each allele is weighted by its summed base qualities plus a mismatch cost per
+        read, i.e. the Phred-scaled likelihood of the reads under the other alleles.
+        The call is the allele with the highest posterior and its quality is the Phred
+        scaled probability that the call is wrong. Ties and uncovered positions are 'N'.
+        Non-ACGT bases and deletions do not vote.
+        """
+        counts, quals = self.counts, self.quals
+        # allele weights for every row at once, one column per base
+        columns = [map(add, quals[i::_N_SYMBOLS], map(_MISMATCH_PHRED.__mul__, counts[i::_N_SYMBOLS]))
+                   for i in range(4)]
+        calls = list(map(_posterior_call, *columns))
+
+        bases, phreds = [], []
+        for row, (best, phred) in enumerate(calls):
+            if row in self.insertions:
+                weights = self._allele_weights(row)
+                best, phred = _posterior_call(*weights.values())
+                call = list(weights)[best] if best >= 0 else 'N'
+            elif best >= 0:
+                call = "ACGT"[best]
+            else:
+                call, phred = 'N', 0
+            bases.append(call)
+            phreds.append(chr(phred + 33) * len(call))
+        return "".join(bases), "".join(phreds)
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+
+import mmap
+import os
+
+
+class ReferenceFasta:
+    """Random access to the sequences of a FASTA file through a memory map
+
+    The file is scanned once for each record's sequence offset, length and line
+    geometry (as in a samtools .fai index), and fetch slices bases straight out of
+    the mapping, so only the pages a query touches are read from disk.
+    """
+    def __init__(self, path: str):
+        self.path: str = str(path)
+        self._file = open(path, "rb")
+        # mmap can't map an empty file
+        if not os.fstat(self._file.fileno()).st_size:
+            self._file.close()
+            raise ValueError(f"{self.path} is empty")
+        self._map: mmap.mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        # name -> (sequence offset, length, bases per line, bytes per line)
+        self.index: dict[str, tuple[int, int, int, int]] = self._build_index()
+
+    def __enter__(self) -> 'ReferenceFasta':
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.index
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+    def _build_index(self) -> dict[str, tuple[int, int, int, int]]:
+        index = {}
+        data = self._map
+        pos = data.find(b">")
+        while pos != -1:
+            header_end = data.find(b"\n", pos)
+            if header_end == -1:
+                header_end = len(data)
+            name = data[pos + 1:header_end].split()[0].decode()
+            offset = header_end + 1
+            next_record = data.find(b"\n>", header_end)
+            end = len(data) if next_record == -1 else next_record + 1
+
+            lines = data[offset:end].splitlines(keepends=True)
+            length = sum(len(line.rstrip(b"\r\n")) for line in lines)
+            line_bases = len(lines[0].rstrip(b"\r\n")) if lines else 0
+            line_bytes = len(lines[0]) if lines else 0
+            # every line but the last must be full for offsets to be computed
+            if any(len(line) != line_bytes for line in lines[:-1]) or (lines and len(lines[-1].rstrip(b"\r\n")) > line_bases):
+                raise ValueError(f"{self.path} has lines of different lengths in {name}")
+            index[name] = (offset, length, line_bases, line_bytes)
+            pos = next_record + 1 if next_record != -1 else -1
+        return index
+
+    def _record(self, name: str) -> tuple[int, int, int, int]:
+        if name not in self.index:
+            raise ValueError(f"{name} not found in {self.path}")
+        return self.index[name]
+
+    def length(self, name: str) -> int:
+        return self._record(name)[1]
+
+    def fetch(self, name: str, start: int, end: int) -> str:
+        """Return uppercase bases of a sequence from start to end (1-based, inclusive)"""
+        offset, length, line_bases, line_bytes = self._record(name)
+        start, end = max(start, 1), min(end, length)
+        if start > end:
+            return ""
+        first = offset + (start - 1) // line_bases * line_bytes + (start - 1) % line_bases
+        last = offset + (end - 1) // line_bases * line_bytes + (end - 1) % line_bases
+        bases = self._map[first:last + 1]
+        if line_bytes != line_bases:
+            bases = bases.replace(b"\n", b"").replace(b"\r", b"")
+        return bases.decode().upper()
@@ -1,246 +1,948 @@
-#!/usr/bin/env python3
-
-import re
-
-class Read:
-    def __init__(self, sam_line: str):
-        (qname, flag, rname, pos, mapq, cigar, rnext, pnext, tlen, seq, qual, *tags) = sam_line.strip().split("\t")
-
-        # store basic properties of the read
-        self.qname: str = qname
-        self.flag: int = int(flag)
-        self.rname: str = rname
-        self.pos: str = int(pos)
-        self.mapq: str = int(mapq)
-        self.cigar: str = cigar
-        self.rnext: str = rnext
-        self.pnext: str = int(pnext)
-        self.tlen: str = int(tlen)
-        self.seq: str = seq
-        self.qual: str = qual
-        self.tags: list[str] = tags
-
-        # score mapping properties based on flag
-        self.is_mapped: bool = not bool(self.flag & 4) 
-        self.is_forward: bool = not bool(self.flag & 16)
-        self.is_reverse: bool = bool(self.flag & 16)
-        self.is_primary: bool = not (bool(self.flag & 256) or bool(self.flag & 2048)) 
-
-        # add data for mapped reads only
-        self.cigar_bits: tuple[tuple[int, str]] = None
-        self.mapped_len: int = None
-        
-        if self.is_mapped:
-            self.cigar_bits = tuple([(int(n), cig) for n, cig in re.findall(r"(\d+)([A-Z])", self.cigar)])
-            self.mapped_len = sum([n for n, cig in self.cigar_bits if cig in {"M", "D"}])
-
-    def read_idx_at_pos(self, pos: int) -> list[None|int]:
-        if not self.is_mapped:
-            return []
-        
-        # adjust by read start
-        pos -= self.pos
-        if pos < 0: # If read mapped to the right of requested location
-            return []
-
-        # Check if the requested position is right of our read
-        if pos >= self.mapped_len:
-            return []
-        
-        cigar_bits = re.findall(r"(\d+)([A-Z])", self.cigar)
-        # pad position based on cigar
-        pad = 0
-        mapped_count = 0
-        for n, (size, cig_type) in enumerate(cigar_bits):
-            size = int(size)
-            if cig_type in {"S", "H", "I"}:
-                pad += size
-                continue
-            if mapped_count + size >= pos+1:
-                if cig_type == "M":
-                    # pad remaining
-                    pad += (pos-mapped_count)
-                    break
-                if cig_type == "D":
-                    return []
-            else:
-                if cig_type == "M":
-                    mapped_count += size
-                    pad += size
-                if cig_type == "D":
-                    mapped_count += size
-
-        # Check if next bases are insertion
-        if mapped_count + size == pos+1:
-            if n+1 != len(cigar_bits):
-                size, cig_type = cigar_bits[n+1]
-                size = int(size)
-                if cig_type == "I":
-                    return [i for i in range(pad, pad+size+1)]
-
-        return [pad]
-
-    def mapped_seq(self) -> str:
-        if not self.is_mapped:
-            return ""
-
-        idx = 0 
-        bases = [] 
-        for n, cig in self.cigar_bits:
-            if cig == "S":
-                idx += n
-            elif cig == "D":
-                bases += ["-"]*n
-            elif cig in {"M", "I"}:
-                bases += [self.seq[i] for i in range(idx, idx+n)]
-                idx += n
-
-        return "".join(bases)
-
-    def base_at_pos(self, pos: int) -> str:
-        idx = self.read_idx_at_pos(pos)
-        return "".join([self.seq[i] for i in idx])
-
-    def qual_at_pos(self, pos: int) -> str:
-        idx = self.read_idx_at_pos(pos)
-        return "".join([self.qual[i] for i in idx])
-
-class SAM:
-    """Class to store and process SAM format alignments"""
-    def __init__(self):
-        self.reads: list[Read] = []
-        self.references: set[str] = set()
-        
-    @classmethod
-    def from_sam(cls, sam_file: str) -> 'SAM':
-        """Create SAM instance from SAM file, storing only primary mappings"""
-        sam = cls()
-        
-        with open(sam_file) as f:
-            for line in f:
-                if line.startswith('@'):  # Header line
-                    if line.startswith('@SQ'):  # Reference sequence
-                        fields = line.strip().split('\t')
-                        for field in fields:
-                            if field.startswith('SN:'):
-                                sam.references.add(field[3:])
-                    continue
-                    
-                # Create Read object for non-header lines
-                read = Read(line)
-                
-                # Only store primary mappings that are mapped
-                if read.is_primary and read.is_mapped:
-                    sam.reads.append(read)
-                    
-        return sam
-    
-    def reads_at_pos(self, seq_name: str, pos: int) -> list[Read]:
-        """Return list of reads that map to given position"""
-        return [read for read in self.reads 
-                if read.rname == seq_name and read.base_at_pos(pos)]
-    
-    def pileup_at_pos(self, seq_name: str, pos: int) -> tuple[list[str], list[str]]:
-        """Return tuple of lists containing base calls and quality scores at position"""
-        bases = []
-        quals = []
-        
-        for read in self.reads_at_pos(seq_name, pos):
-            base = read.base_at_pos(pos)
-            qual = read.qual_at_pos(pos)
-            if base:
-                bases.append(base)
-                quals.append(qual)
-                
-        return bases, quals
-    
-    def consensus_at_pos(self, seq_name: str, pos: int) -> str:
-        """Return majority base call at position, 'N' for any ties"""
-        bases, _ = self.pileup_at_pos(seq_name, pos)
-        if not bases:
-            return ''
-            
-        # Count occurrences of each base/insertion
-        base_counts = {}
-        for base in bases:
-            base_counts[base] = base_counts.get(base, 0) + 1
-            
-        if not base_counts:
-            return 'N'
-            
-        # Get counts and total
-        max_count = max(base_counts.values())
-        total = len(bases)
-        
-        # Count how many bases have the max count
-        bases_with_max = sum(1 for count in base_counts.values() if count == max_count)
-        
-        # Return 'N' if:
-        # - Multiple bases have the same count (tie)
-        # - No base has >50% representation
-        if bases_with_max > 1 or max_count/total <= 0.5:
-            return 'N'
-            
-        # Get the base with max count
-        for base, count in base_counts.items():
-            if count == max_count:
-                return base
-                
-        return 'N'  # Fallback case
-            
-    
-    def consensus(self, seq_name: str) -> str:
-        """Return consensus sequence for given reference"""
-        if seq_name not in self.references:
-            return ''
-            
-        # Find range of positions covered by reads
-        min_pos = float('inf')
-        max_pos = 0
-        for read in self.reads:
-            if read.rname == seq_name:
-                min_pos = min(min_pos, read.pos)
-                max_pos = max(max_pos, read.pos + read.mapped_len)
-                
-        if min_pos == float('inf'):
-            return ''
-            
-        # Build consensus sequence
-        consensus_seq = []
-        for pos in range(min_pos, max_pos):  
-            base = self.consensus_at_pos(seq_name, pos)
-            consensus_seq.append(base if base else 'N')
-            
-        return ''.join(consensus_seq)
-    
-    def best_consensus(self) -> str:
-        """Return consensus sequence for reference with best mapping coverage"""
-        # Count covered positions for each reference
-        coverage = {}
-        for ref in self.references:
-            covered_positions = 0
-            min_pos = float('inf')
-            max_pos = 0
-            
-            # Find range of positions
-            for read in self.reads:
-                if read.rname == ref:
-                    min_pos = min(min_pos, read.pos)
-                    max_pos = max(max_pos, read.pos + read.mapped_len)
-            
-            if min_pos == float('inf'):
-                continue
-                
-            # Count positions with >0 reads
-            for pos in range(min_pos, max_pos + 1):
-                if self.reads_at_pos(ref, pos):
-                    covered_positions += 1
-                    
-            coverage[ref] = covered_positions
-            
-        if not coverage:
-            return ''
-            
-        # Find reference with most positions covered
-        best_ref = max(coverage.items(), key=lambda x: x[1])[0]
+#!/usr/bin/env python3
+
+import operator
+import pickle
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Callable, Iterable, Iterator
+from collections.abc import Sequence
+from concurrent.futures import ProcessPoolExecutor
+from itertools import accumulate, compress, groupby, islice, takewhile
+
+from .bam import BgzfReader, is_bgzf, read_bam_header, read_bam_records, write_bam
+from .index import LinearIndex, fetch_records
+from .pileup import Pileup, _majority_base, normalise_bases
+from .reference import ReferenceFasta
+from .store import ReadStore
+from .tags import TagColumn, parse_condition, parse_tags
+from .variants import Variant, call_variants, md_reference
+
+class _ReadData:
+    """Data derived from one record, filled in as needed and cached in its store"""
+    __slots__ = ("seq", "qual", "offsets", "insertions", "mapped_seq")
+
+    def __init__(self):
+        self.seq: str = None
+        self.qual: str = None
+        # reference offset -> read index (-1 in deletions), and insertion runs
+        self.offsets: array = None
+        self.insertions: dict[int, int] = None
+        self.mapped_seq: str = None
+
+
+class Read:
+    """A single SAM record, viewed from columnar storage in a ReadStore"""
+    __slots__ = ("_store", "_i")
+
+    def __init__(self, sam_line: str):
+        # a standalone read gets its own single record store
+        self._store: ReadStore = ReadStore(cache_size=1)
+        self._i: int = self._store.append(sam_line.strip().split("\t"))
+
+    @classmethod
+    def _view(cls, store: ReadStore, i: int) -> 'Read':
+        """Create a Read over record i of an existing store without copying it"""
+        read = cls.__new__(cls)
+        read._store = store
+        read._i = i
+        return read
+
+    def _data(self) -> _ReadData:
+        """Return this record's derived data from the store's LRU cache, shared by all views"""
+        data = self._store.derived.get(self._i)
+        if data is None:
+            data = _ReadData()
+            self._store.derived.put(self._i, data)
+        return data
+
+    # basic properties of the read
+    @property
+    def qname(self) -> str:
+        return self._store.qname[self._i]
+
+    @property
+    def flag(self) -> int:
+        return self._store.flag[self._i]
+
+    @property
+    def rname(self) -> str:
+        return self._store.names[self._store.rname[self._i]]
+
+    @property
+    def pos(self) -> int:
+        return self._store.pos[self._i]
+
+    @property
+    def mapq(self) -> int:
+        return self._store.mapq[self._i]
+
+    @property
+    def cigar(self) -> str:
+        return self._store.cigar_str(self._i)
+
+    @property
+    def rnext(self) -> str:
+        return self._store.names[self._store.rnext[self._i]]
+
+    @property
+    def pnext(self) -> int:
+        return self._store.pnext[self._i]
+
+    @property
+    def tlen(self) -> int:
+        return self._store.tlen[self._i]
+
+    @property
+    def seq(self) -> str:
+        return self._store.seq_str(self._i)
+
+    @property
+    def qual(self) -> str:
+        return self._store.qual[self._i]
+
+    @property
+    def tags(self) -> list[str]:
+        tags = self._store.tags[self._i]
+        return tags.split("\t") if tags else []
+
+    def tag(self, name: str, default=None) -> int|float|str|array:
+        """Return typed value of an optional tag, e.g. read.tag('NM') -> int"""
+        return parse_tags(self._store.tags[self._i]).get(name, default)
+
+    # mapping properties based on flag
+    @property
+    def is_mapped(self) -> bool:
+        return not bool(self.flag & 4)
+
+    @property
+    def is_forward(self) -> bool:
+        return not bool(self.flag & 16)
+
+    @property
+    def is_reverse(self) -> bool:
+        return bool(self.flag & 16)
+
+    @property
+    def is_primary(self) -> bool:
+        return not (bool(self.flag & 256) or bool(self.flag & 2048))
+
+    # data for mapped reads only
+    @property
+    def cigar_bits(self) -> tuple[tuple[int, str]]:
+        if not self.is_mapped:
+            return None
+        return self._store.cigar_ops(self._i)
+
+    @property
+    def mapped_len(self) -> int:
+        if not self.is_mapped:
+            return None
+        return self._store.mapped_len[self._i]
+
+    def __str__(self) -> str:
+        return "\t".join(self._store.fields(self._i))
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, Read):
+            return NotImplemented
+        if self._store is other._store and self._i == other._i:
+            return True
+        return self._store.fields(self._i) == other._store.fields(other._i)
+
+    def __hash__(self) -> int:
+        return hash((self.qname, self.flag, self.rname, self.pos))
+
+    def read_idx_at_pos(self, pos: int) -> list[None|int]:
+        span = self._idx_span(pos)
+        if span is None:
+            return []
+        return list(range(*span))
+
+    def _idx_span(self, pos: int) -> tuple[int, int]|None:
+        """Return (first, end) read indices of the bases aligned at pos, including any
+        insertion that follows, or None if the read has no base there"""
+        if not self.is_mapped:
+            return None
+        
+        # adjust by read start
+        pos -= self.pos
+        if pos < 0: # If read mapped to the right of requested location
+            return None
+
+        # Check if the requested position is right of our read
+        if pos >= self._store.mapped_len[self._i]:
+            return None
+        
+        offsets, insertions = self._offset_table()
+        idx = offsets[pos]
+        if idx < 0: # Position falls in a deletion
+            return None
+
+        # Check if next bases are insertion
+        return idx, idx + insertions.get(pos, 0) + 1
+
+    def _offset_table(self) -> tuple[array, dict[int, int]]:
+        """Return read index for each reference offset (-1 in deletions) and insertion runs
+
+        Built once from cigar_bits on first use. Insertion runs map the reference offset
+        of the base preceding an insertion to the insertion length.
+        """
+        data = self._data()
+        if data.offsets is None:
+            read_pos = self.pos
+            offsets = array("l", [-1]) * self.mapped_len
+            insertions = {}
+            for ref_pos, read_idx, length, ins_len in self.aligned_blocks():
+                start = ref_pos - read_pos
+                offsets[start:start+length] = array("l", range(read_idx, read_idx+length))
+                if ins_len:
+                    insertions[start+length-1] = ins_len
+            data.offsets = offsets
+            data.insertions = insertions
+
+        return data.offsets, data.insertions
+
+    def aligned_blocks(self) -> tuple[tuple[int, int, int, int]]:
+        """Return (ref_pos, read_idx, length, ins_len) for each M block of the CIGAR
+
+        ins_len is the size of an insertion directly following the block (0 if none),
+        matching the bases read_idx_at_pos reports for the last position of the block.
+        """
+        if not self.is_mapped:
+            return ()
+
+        cigar_bits = self.cigar_bits
+        blocks = []
+        ref_pos = self.pos
+        read_idx = 0
+        for n, (size, cig_type) in enumerate(cigar_bits):
+            if cig_type in {"S", "H", "I"}:
+                read_idx += size
+            elif cig_type == "D":
+                ref_pos += size
+            elif cig_type == "M":
+                ins_len = 0
+                if n+1 != len(cigar_bits) and cigar_bits[n+1][1] == "I":
+                    ins_len = cigar_bits[n+1][0]
+                blocks.append((ref_pos, read_idx, size, ins_len))
+                ref_pos += size
+                read_idx += size
+
+        return tuple(blocks)
+
+    def mapped_seq(self) -> str:
+        if not self.is_mapped:
+            return ""
+
+        data = self._data()
+        if data.mapped_seq is None:
+            seq = self._cached_seq(data)
+            idx = 0
+            pieces = []
+            for n, cig in self.cigar_bits:
+                if cig == "S":
+                    idx += n
+                elif cig == "D":
+                    pieces.append("-" * n)
+                elif cig in {"M", "I"}:
+                    pieces.append(seq[idx:idx+n])
+                    idx += n
+            data.mapped_seq = "".join(pieces)
+
+        return data.mapped_seq
+
+    def _cached_seq(self, data: _ReadData) -> str:
+        if data.seq is None:
+            data.seq = self.seq
+        return data.seq
+
+    def base_at_pos(self, pos: int) -> str:
+        span = self._idx_span(pos)
+        if span is None:
+            return ""
+        return self._cached_seq(self._data())[span[0]:span[1]]
+
+    def qual_at_pos(self, pos: int) -> str:
+        span = self._idx_span(pos)
+        if span is None:
+            return ""
+        data = self._data()
+        if data.qual is None:
+            data.qual = self.qual
+        return data.qual[span[0]:span[1]]
+
+def _sweep_pileup(reads: Iterable[Read], start: int = None, end: int = None) -> Iterator[tuple[int, dict[str, int]]]:
+    """Yield (pos, base_counts) for every position spanned by position-sorted reads
+
+    Each read's CIGAR is walked once and its bases are added to a window of pending
+    positions, which are emitted as soon as the next read starts to their right.
+    Positions with no aligned bases inside the span yield an empty dict. If a start
+    and end are given, only positions in [start, end) are counted and yielded.
+    """
+    windowed = start is not None
+    pending: dict[int, dict[str, int]] = {}
+    cursor = start
+    last_pos = None
+    span_end = None
+
+    for read in reads:
+        if last_pos is not None and read.pos < last_pos:
+            raise ValueError(f"Reads must be sorted by position, got {read.pos} after {last_pos}")
+        last_pos = read.pos
+        if cursor is None:
+            cursor = span_end = read.pos
+
+        # Positions left of this read can no longer change
+        stop = min(read.pos, end) if windowed else read.pos
+        while cursor < stop:
+            yield cursor, pending.pop(cursor, {})
+            cursor += 1
+        if not windowed:
+            span_end = max(span_end, read.pos + read.mapped_len)
+
+        seq = normalise_bases(read.seq)
+        for ref_pos, read_idx, length, ins_len in read.aligned_blocks():
+            first, last = 0, length
+            if windowed:
+                first, last = max(first, start - ref_pos), min(last, end - ref_pos)
+            for offset in range(first, last):
+                base = seq[read_idx + offset]
+                if ins_len and offset == length - 1:
+                    # Last base before an insertion carries the inserted bases
+                    base = seq[read_idx + offset:read_idx + offset + ins_len + 1]
+                counts = pending.setdefault(ref_pos + offset, {})
+                counts[base] = counts.get(base, 0) + 1
+
+    if windowed:
+        span_end = end
+    if cursor is None:
+        return
+
+    while cursor < span_end:
+        yield cursor, pending.pop(cursor, {})
+        cursor += 1
+
+
+# unmapped, secondary and supplementary records are not stored
+_SKIPPED_FLAGS = 4 | 256 | 2048
+# records parsed together by from_stream
+_PARSE_BATCH = 4096
+
+
+def _primary_records(lines: Iterable[str], references: set[str], ref_lengths: dict[str, int] = None) -> Iterator[str]:
+    """Yield lines of primary mapped records, adding @SQ names to references
+    and their lengths to ref_lengths
+
+    Only FLAG is parsed to filter records, so skipped ones are never split.
+    """
+    for line in lines:
+        if line.startswith('@'):  # Header line
+            if line.startswith('@SQ'):  # Reference sequence
+                fields = line.strip().split('\t')
+                name = length = None
+                for field in fields:
+                    if field.startswith('SN:'):
+                        name = field[3:]
+                        references.add(name)
+                    elif field.startswith('LN:'):
+                        length = int(field[3:])
+                if ref_lengths is not None and name is not None and length is not None:
+                    ref_lengths[name] = length
+            continue
+
+        flag_start = line.index("\t") + 1
+        if not int(line[flag_start:line.index("\t", flag_start)]) & _SKIPPED_FLAGS:
+            yield line
+
+
+def _consensus(reads: list[Read], start: int = None, end: int = None) -> str:
+    """Return consensus of position-sorted reads from a single reference, optionally
+    only over positions [start, end)"""
+    if not reads and start is None:
+        return ''
+    return ''.join(_majority_base(base_counts) or 'N' for _, base_counts in _sweep_pileup(reads, start, end))
+
+
+def _tile_consensus_job(job: tuple[ReadStore, int, int]) -> str:
+    """Compute consensus over one tile from a store of the position-sorted reads overlapping it"""
+    store, start, end = job
+    return _consensus(ReadList(store)[:], start, end)
+
+
+def _coverage(reads: list[Read], ref_length: int = 0) -> array:
+    """Return depth at each position (index 0 being position 1) from reads of a single reference"""
+    if not reads:
+        return array("l")
+
+    # Difference array: +1 where an aligned block starts, -1 after it ends
+    end = max(read.pos + read.mapped_len for read in reads)
+    length = max(ref_length, end - 1)
+    diff = array("l", [0]) * (length + 1)
+    for read in reads:
+        for ref_pos, _, block_len, _ in read.aligned_blocks():
+            diff[ref_pos - 1] += 1
+            diff[ref_pos - 1 + block_len] -= 1
+
+    depth = array("l", accumulate(diff))
+    del depth[length:]
+    return depth
+
+
+def _consensus_job(job: tuple[ReadStore, int]) -> dict:
+    """Compute consensus and coverage for a store of one reference's position-sorted reads"""
+    store, ref_length = job
+    reads = ReadList(store)[:]
+    depth = _coverage(reads, ref_length)
+    return {
+        'consensus': _consensus(reads),
+        'reads': len(reads),
+        'breadth': len(depth) - depth.count(0),
+        'mean_depth': sum(depth) / len(depth) if depth else 0.0,
+    }
+
+
+def _pileup_coverage(pileup: Pileup, ref_length: int = 0) -> array:
+    """Return depth at each position (index 0 being position 1) from a reference's pileup"""
+    if not len(pileup):
+        return array("l")
+    depth = array("l", [0]) * max(ref_length, pileup.end - 1)
+    depth[pileup.start - 1:pileup.end - 1] = pileup.depth()
+    return depth
+
+
+def _pileup_summary(pileup: Pileup, ref_length: int) -> dict:
+    """Return consensus and coverage of a reference from its pileup, as _consensus_job does"""
+    depth = _pileup_coverage(pileup, ref_length)
+    return {
+        'consensus': pileup.consensus(),
+        'reads': pileup.read_count,
+        'breadth': len(depth) - depth.count(0),
+        'mean_depth': sum(depth) / len(depth) if depth else 0.0,
+    }
+
+
+class ReadList(Sequence):
+    """List-like access to the records of a ReadStore as Read views"""
+    def __init__(self, store: ReadStore):
+        self._store = store
+
+    def __len__(self) -> int:
+        return len(self._store)
+
+    def __getitem__(self, i: int|slice) -> Read|list[Read]:
+        if isinstance(i, slice):
+            return [Read._view(self._store, j) for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("read index out of range")
+        return Read._view(self._store, i)
+
+    def __iter__(self) -> Iterator[Read]:
+        for i in range(len(self._store)):
+            yield Read._view(self._store, i)
+
+    def append(self, read: Read):
+        """Copy a read into the underlying store"""
+        self.extend((read,))
+
+    def extend(self, reads: Iterable[Read]):
+        """Copy reads into the underlying store"""
+        for read in reads:
+            self._store.append(read._store.fields(read._i))
+
+
+class _SAMReads(ReadList):
+    """Reads of a SAM; reads appended here are added through the SAM so its live pileups count them"""
+    def __init__(self, sam: 'SAM'):
+        super().__init__(sam._store)
+        self._sam = sam
+
+    def extend(self, reads: Iterable[Read]):
+        """Copy reads into the SAM, whatever their flags, updating live pileups"""
+        self._sam._add_reads(reads, skip_flags=0)
+
+
+class SAM:
+    """Class to store and process SAM format alignments"""
+    def __init__(self):
+        self._store: ReadStore = ReadStore()
+        self.references: set[str] = set()
+        self.ref_lengths: dict[str, int] = {}
+
+        # Per-reference interval index, built lazily on first positional query
+        self._index: dict[str, tuple[list[int], list[int], int]] = {}
+        self._indexed_reads: int = -1
+
+        # Coordinate-sorted file and its linear index, when opened with open_indexed
+        self._indexed_file: tuple[str, LinearIndex] = None
+
+        # Live per-reference pileups, kept up to date as reads are added, and the
+        # references whose pileups count reads that are not stored (from_pileups)
+        self._pileups: dict[str, Pileup] = {}
+        self._pileup_only: set[str] = set()
+
+        # Typed optional tag values by tag name, parsed on first use
+        self._tag_columns: dict[str, TagColumn] = {}
+
+    @property
+    def reads(self) -> ReadList:
+        """Stored reads as Read views; add to them with append/extend, select with filter_reads"""
+        return _SAMReads(self)
+
+    @classmethod
+    def from_sam(cls, sam_file: str) -> 'SAM':
+        """Create SAM instance from SAM file, storing only primary mappings"""
+        with open(sam_file) as f:
+            return cls.from_stream(f)
+
+    @classmethod
+    def from_stream(cls, lines: Iterable[str]) -> 'SAM':
+        """Create SAM instance from SAM lines as they arrive, e.g. an aligner's stdout"""
+        sam = cls()
+        records = _primary_records(lines, sam.references, sam.ref_lengths)
+        # parse in batches so each column is extended in bulk
+        while batch := list(islice(records, _PARSE_BATCH)):
+            sam._store.extend_lines(batch)
+                    
+        return sam
+
+    @classmethod
+    def from_bam(cls, bam_file: str, threads: int = 4) -> 'SAM':
+        """Create SAM instance from BAM file, storing only primary mappings
+
+        BGZF blocks are decompressed by a pool of threads while records are decoded.
+        """
+        sam = cls()
+        with BgzfReader(bam_file, threads) as bgzf:
+            _, refs = read_bam_header(bgzf)
+            for name, length in refs:
+                sam.references.add(name)
+                sam.ref_lengths[name] = length
+            ref_names = [name for name, _ in refs]
+            read_bam_records(bgzf, ref_names, sam._store, _SKIPPED_FLAGS)
+        return sam
+
+    @classmethod
+    def open_indexed(cls, path: str) -> 'SAM':
+        """Open a coordinate-sorted SAM or BAM file for region queries with fetch
+
+        Only the header is read; reads are loaded per region through a sidecar
+        linear index (path + '.lidx'), which is built on first use or if stale.
+        """
+        sam = cls()
+        if is_bgzf(path):
+            with BgzfReader(path, threads=1) as bgzf:
+                _, refs = read_bam_header(bgzf)
+            for name, length in refs:
+                sam.references.add(name)
+                sam.ref_lengths[name] = length
+        else:
+            with open(path) as f:
+                header = takewhile(lambda line: line.startswith('@'), f)
+                for _ in _primary_records(header, sam.references, sam.ref_lengths):
+                    pass
+        sam._indexed_file = (path, LinearIndex.for_file(path))
+        return sam
+
+    @classmethod
+    def from_pileups(cls, pileup_file: str) -> 'SAM':
+        """Create SAM instance holding no reads but the live pileups saved by save_pileups
+
+        Reads added later (add_reads or merge) are counted on top of the saved
+        pileups, so consensus, coverage and best_reference cover every run without
+        re-parsing earlier ones. Queries needing the reads themselves (reads_at_pos,
+        fetch, filtered pileups) raise ValueError for these references.
+        """
+        with open(pileup_file, "rb") as f:
+            saved = pickle.load(f)
+        sam = cls()
+        sam.ref_lengths.update(saved["ref_lengths"])
+        sam.references.update(saved["ref_lengths"], saved["pileups"])
+        sam._pileups = saved["pileups"]
+        sam._pileup_only.update(saved["pileups"])
+        return sam
+
+    def save_pileups(self, pileup_file: str):
+        """Write every reference's live pileup, building any not yet built, for from_pileups"""
+        for ref in self.references:
+            self.pileup(ref)
+        with open(pileup_file, "wb") as f:
+            pickle.dump({"ref_lengths": self.ref_lengths, "pileups": self._pileups}, f)
+
+    def add_reads(self, reads: Iterable[Read]):
+        """Add primary mapped reads, updating live pileups only where the reads align"""
+        self._add_reads(reads)
+
+    def _add_reads(self, reads: Iterable[Read], skip_pileups: set[str] = frozenset(),
+                   skip_flags: int = _SKIPPED_FLAGS):
+        new_reads: dict[str, list[Read]] = {}
+        for read in reads:
+            if read.flag & skip_flags:
+                continue
+            i = self._store.append(read._store.fields(read._i))
+            if not read.is_mapped:
+                continue
+            self.references.add(read.rname)
+            if read.rname in self._pileups and read.rname not in skip_pileups:
+                new_reads.setdefault(read.rname, []).append(Read._view(self._store, i))
+
+        for ref, reads in new_reads.items():
+            pileup = self._pileups[ref]
+            pileup.expand(min(read.pos for read in reads), max(read.pos + read.mapped_len for read in reads))
+            pileup.add_reads(reads)
+
+    def merge(self, other: 'SAM'):
+        """Add another SAM's references, reads and live pileups to this one"""
+        self.references |= other.references
+        for ref, length in other.ref_lengths.items():
+            self.ref_lengths.setdefault(ref, length)
+
+        # other's live pileups already count its reads, so merge them instead
+        for ref, pileup in other._pileups.items():
+            self.pileup(ref).merge(pileup)
+        self._pileup_only |= other._pileup_only
+        self._add_reads(other.reads, skip_pileups=set(other._pileups))
+
+    def filter_reads(self, keep: Callable[[Read], bool]) -> 'SAM':
+        """Return a new SAM with the same references holding the reads for which keep(read) is true,
+        e.g. sam.filter_reads(lambda read: read.mapq >= 30)"""
+        sam = type(self)()
+        sam.references |= self.references
+        sam.ref_lengths.update(self.ref_lengths)
+        sam._store = self._store.take(i for i, read in enumerate(self.reads) if keep(read))
+        return sam
+
+    def to_bam(self, bam_file: str, threads: int = 4, level: int = 6):
+        """Write stored reads to a BAM file, compressing BGZF blocks in a pool of threads"""
+        names = list(self.ref_lengths)
+        names += sorted(self.references.difference(names))
+        names += sorted({self._store.names[ref] for ref in self._store.rname}.difference(names, ["*"]))
+        refs = [(name, self.ref_lengths.get(name, 0)) for name in names]
+        write_bam(bam_file, self._store, refs, threads, level)
+
+    @staticmethod
+    def iter_sam(sam_file: str) -> Iterator[Read]:
+        """Yield primary mapped reads from a SAM file one at a time without storing them"""
+        with open(sam_file) as f:
+            for line in _primary_records(f, set()):
+                store = ReadStore()
+                yield Read._view(store, store.append_line(line))
+
+    @classmethod
+    def stream_pileup(cls, sam_file: str, seq_name: str = None) -> Iterator[tuple[str, int, dict[str, int]]]:
+        """Yield (reference, pos, base_counts) from a coordinate-sorted SAM file
+
+        Only reads overlapping positions not yet emitted are held in memory, so memory
+        use is bounded by coverage depth rather than file size.
+        """
+        seen = set()
+        for rname, reads in groupby(cls.iter_sam(sam_file), key=lambda read: read.rname):
+            if rname in seen:
+                raise ValueError(f"SAM file is not coordinate sorted, {rname} reads are not contiguous")
+            seen.add(rname)
+            if seq_name is not None and rname != seq_name:
+                continue
+            for pos, base_counts in _sweep_pileup(reads):
+                yield rname, pos, base_counts
+
+    @classmethod
+    def stream_consensus(cls, sam_file: str, seq_name: str = None) -> Iterator[tuple[str, str]]:
+        """Yield (reference, consensus) for each reference in a coordinate-sorted SAM file"""
+        pileup = cls.stream_pileup(sam_file, seq_name)
+        for rname, positions in groupby(pileup, key=lambda entry: entry[0]):
+            yield rname, ''.join(_majority_base(base_counts) or 'N' for _, _, base_counts in positions)
+    
+    def _build_index(self):
+        """Index reads by reference as start positions sorted alongside read indices"""
+        store = self._store
+        by_ref: dict[int, list[tuple[int, int]]] = {}
+        max_span: dict[int, int] = {}
+        for i in range(len(store)):
+            if store.flag[i] & 4:
+                continue
+            ref = store.rname[i]
+            by_ref.setdefault(ref, []).append((store.pos[i], i))
+            max_span[ref] = max(max_span.get(ref, 0), store.mapped_len[i])
+
+        self._index = {}
+        for ref, entries in by_ref.items():
+            entries.sort()
+            starts = [start for start, _ in entries]
+            order = [i for _, i in entries]
+            self._index[store.names[ref]] = (starts, order, max_span[ref])
+        self._indexed_reads = len(self.reads)
+
+    def _reference_index(self, seq_name: str) -> tuple[list[int], list[int], int]:
+        """Return (sorted starts, read indices, longest mapped span) for a reference"""
+        # Rebuild if reads were added since the index was last built
+        if self._indexed_reads != len(self.reads):
+            self._build_index()
+        return self._index.get(seq_name, ([], [], 0))
+
+    def _check_stored(self, seq_name: str):
+        """Raise ValueError if some of a reference's reads were only loaded as counts"""
+        if seq_name in self._pileup_only:
+            raise ValueError(f"{seq_name} reads from saved pileups are not stored, only their counts")
+
+    def _sorted_reads(self, seq_name: str) -> list[Read]:
+        """Return reads mapped to reference sorted by position"""
+        _, order, _ = self._reference_index(seq_name)
+        return [self.reads[i] for i in order]
+
+    def reads_at_pos(self, seq_name: str, pos: int) -> list[Read]:
+        """Return list of reads that map to given position"""
+        self._check_stored(seq_name)
+        starts, order, max_span = self._reference_index(seq_name)
+
+        # Only reads starting within one read span to the left can overlap pos
+        lo = bisect_left(starts, pos - max_span + 1)
+        hi = bisect_right(starts, pos)
+        hits = sorted(order[n] for n in range(lo, hi) if self.reads[order[n]].base_at_pos(pos))
+        return [self.reads[i] for i in hits]
+    
+    def fetch(self, seq_name: str, start: int, end: int) -> list[Read]:
+        """Return primary mapped reads overlapping positions start to end (inclusive),
+        sorted by position
+
+        For a SAM opened with open_indexed, only the indexed part of the file covering
+        the region is read.
+        """
+        if self._indexed_file is not None:
+            path, index = self._indexed_file
+            return ReadList(fetch_records(path, index, seq_name, start, end, _SKIPPED_FLAGS))[:]
+
+        self._check_stored(seq_name)
+        starts, order, max_span = self._reference_index(seq_name)
+        lo = bisect_left(starts, start - max_span + 1)
+        hi = bisect_right(starts, end)
+        store = self._store
+        return [self.reads[i] for i in order[lo:hi] if store.pos[i] + store.mapped_len[i] > start]
+
+    def tag_column(self, name: str) -> TagColumn:
+        """Return typed values of a tag for every stored read, None where a read lacks it"""
+        column = self._tag_columns.get(name)
+        if column is None:
+            column = self._tag_columns[name] = TagColumn(name)
+        column.update(self._store)  # parses only reads added since the last call
+        return column
+
+    def tag_filter(self, *conditions: str) -> list[Read]:
+        """Return reads meeting every tag condition, e.g. tag_filter('NM <= 2 and AS >= 100')
+
+        Conditions compare a tag with <, <=, ==, !=, >= or >; reads lacking a tag fail its conditions.
+        """
+        keep = bytearray(b"\x01") * len(self._store)
+        for condition in (part for condition in conditions for part in condition.split(" and ")):
+            name, op, value = parse_condition(condition)
+            keep = bytearray(map(operator.and_, keep, self.tag_column(name).mask(op, value)))
+        return [self.reads[i] for i in compress(range(len(keep)), keep)]
+
+    def region_consensus(self, seq_name: str, start: int, end: int) -> str:
+        """Return consensus over positions start to end (inclusive), 'N' where uncovered"""
+        if seq_name in self._pileups:
+            return self._pileups[seq_name].consensus(start, end + 1)
+        return _consensus(self.fetch(seq_name, start, end), start, end + 1)
+
+    def pileup_at_pos(self, seq_name: str, pos: int) -> tuple[list[str], list[str]]:
+        """Return tuple of lists containing base calls and quality scores at position"""
+        bases = []
+        quals = []
+        
+        for read in self.reads_at_pos(seq_name, pos):
+            base = read.base_at_pos(pos)
+            qual = read.qual_at_pos(pos)
+            if base:
+                bases.append(base)
+                quals.append(qual)
+                
+        return bases, quals
+    
+    def consensus_at_pos(self, seq_name: str, pos: int) -> str:
+        """Return majority base call at position, 'N' for any ties"""
+        pileup = self._pileups.get(seq_name)
+        if pileup is not None:
+            return _majority_base(pileup.base_counts(pos)) if pileup.start <= pos < pileup.end else ''
+
+        bases, _ = self.pileup_at_pos(seq_name, pos)
+        if not bases:
+            return ''
+            
+        # Count occurrences of each base/insertion
+        base_counts = {}
+        for base in map(normalise_bases, bases):
+            base_counts[base] = base_counts.get(base, 0) + 1
+            
+        return _majority_base(base_counts)
+    
+    def consensus(self, seq_name: str, workers: int = 1, tile_size: int = 100_000) -> str:
+        """Return consensus sequence for given reference
+
+        With more than one worker, references spanning more than tile_size positions
+        are split into tiles computed in parallel processes and joined in order.
+        """
+        if seq_name not in self.references:
+            return ''
+        if seq_name in self._pileups:
+            # Only positions touched since the last call are called again
+            return self._pileups[seq_name].consensus()
+            
+        starts, order, max_span = self._reference_index(seq_name)
+        if not order:
+            return ''
+        span_start = starts[0]
+        span_end = max(self._store.pos[i] + self._store.mapped_len[i] for i in order)
+        if workers <= 1 or span_end - span_start <= tile_size:
+            # Sweep over reads in position order, walking each CIGAR once
+            return _consensus(self._sorted_reads(seq_name))
+
+        # Each tile gets the reads overlapping it; bases (and insertions anchored to
+        # bases) outside the tile are left to the neighbouring tile
+        jobs = []
+        for tile_start in range(span_start, span_end, tile_size):
+            tile_end = min(tile_start + tile_size, span_end)
+            lo = bisect_left(starts, tile_start - max_span + 1)
+            hi = bisect_left(starts, tile_end)
+            overlapping = [i for i in order[lo:hi] if self._store.pos[i] + self._store.mapped_len[i] > tile_start]
+            jobs.append((self._store.take(overlapping), tile_start, tile_end))
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            return ''.join(executor.map(_tile_consensus_job, jobs))
+
+    def consensus_all(self, workers: int = 1) -> dict[str, dict]:
+        """Return consensus and coverage of every reference, computed in parallel processes
+
+        Each reference's reads are copied into their own ReadStore, so workers receive
+        a few column buffers rather than pickled Read objects. References with a live
+        pileup are summarised from it instead. Values are dicts with 'consensus',
+        'reads', 'breadth' and 'mean_depth' keys.
+        """
+        jobs = {}
+        live = {}
+        for ref in sorted(self.references):
+            if self._pileups.get(ref):
+                live[ref] = _pileup_summary(self._pileups[ref], self.ref_lengths.get(ref, 0))
+                continue
+            _, order, _ = self._reference_index(ref)
+            if order:
+                jobs[ref] = (self._store.take(order), self.ref_lengths.get(ref, 0))
+
+        if workers > 1 and len(jobs) > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = dict(zip(jobs, executor.map(_consensus_job, jobs.values())))
+        else:
+            results = {ref: _consensus_job(job) for ref, job in jobs.items()}
+        results.update(live)
+
+        empty = {'consensus': '', 'reads': 0, 'breadth': 0, 'mean_depth': 0.0}
+        return {ref: results.get(ref, empty) for ref in sorted(self.references)}
+    
+    def pileup_matrix(self, seq_name: str, min_base_qual: int = 0, min_mapq: int = 0) -> Pileup:
+        """Return base count and quality matrices over the span of reads mapped to reference,
+        skipping reads below min_mapq and bases below min_base_qual"""
+        self._check_stored(seq_name)
+        reads = self._sorted_reads(seq_name)
+        if not reads:
+            return Pileup(0, 0)
+
+        start = reads[0].pos
+        end = max(read.pos + read.mapped_len for read in reads)
+        pileup = Pileup(start, end, min_base_qual, min_mapq)
+        pileup.add_reads(reads)
+        return pileup
+
+    def pileup(self, seq_name: str) -> Pileup:
+        """Return the live pileup of a reference, building it from the stored reads on first use
+
+        Once built, add_reads and merge keep it up to date and consensus is derived
+        from it, recalling only positions that changed.
+        """
+        if seq_name not in self._pileups:
+            self._pileups[seq_name] = self.pileup_matrix(seq_name)
+            self.references.add(seq_name)
+        return self._pileups[seq_name]
+
+    def weighted_consensus(self, seq_name: str, min_base_qual: int = 0, min_mapq: int = 0) -> tuple[str, str]:
+        """Return quality-weighted consensus for given reference and its FASTQ quality string
+
+        Alleles are voted on by summed base quality rather than read count; see
+        Pileup.weighted_consensus. Without filters, the live pileup is used if built.
+        """
+        if seq_name not in self.references:
+            return '', ''
+        if seq_name in self._pileups and not (min_base_qual or min_mapq):
+            return self._pileups[seq_name].weighted_consensus()
+        return self.pileup_matrix(seq_name, min_base_qual, min_mapq).weighted_consensus()
+    
+    def variants(self, seq_name: str, reference: str|ReferenceFasta = None, min_depth: int = 1,
+                 min_af: float = 0.2, min_base_qual: int = 0, min_mapq: int = 0) -> Iterator[Variant]:
+        """Yield SNVs and indels against the reference, in position order
+
+        Reference bases are sliced from a memory-mapped FASTA (a path or an open
+        ReferenceFasta), or rebuilt from the reads' MD tags if no reference is given
+        (ValueError if no read has one, or the reads came from saved pileups). Alleles are counted from the live pileup if
+        one is built and no filters are set, otherwise from a pileup of the stored
+        reads; see call_variants for the thresholds.
+        """
+        if seq_name not in self.references:
+            return
+        if seq_name in self._pileups and not (min_base_qual or min_mapq):
+            pileup = self._pileups[seq_name]
+        else:
+            pileup = self.pileup_matrix(seq_name, min_base_qual, min_mapq)
+        if not len(pileup):
+            return
+
+        # reference bases from the base before the window, for deletions to anchor on,
+        # with 'N' before position 1 or past the end of the sequence
+        start, end = pileup.start - 1, pileup.end
+        first = max(1, start)
+        if reference is None:
+            if seq_name in self._pileup_only:
+                raise ValueError(f"{seq_name} reads from saved pileups are not stored, a reference FASTA is needed")
+            ref_seq = md_reference(self._sorted_reads(seq_name), first, end)
+        elif isinstance(reference, ReferenceFasta):
+            ref_seq = reference.fetch(seq_name, first, end - 1)
+        else:
+            with ReferenceFasta(reference) as fasta:
+                ref_seq = fasta.fetch(seq_name, first, end - 1)
+        ref_seq = ("N" * (first - start) + ref_seq).ljust(end - start, "N")
+
+        yield from call_variants(pileup, seq_name, ref_seq, min_depth, min_af)
+
+    def coverage(self, seq_name: str) -> array:
+        """Return read depth at each position of reference, index 0 being position 1
+
+        Covers the reference length from the header, or up to the last aligned base
+        if it is unknown. Deleted positions are not counted as covered. Taken from the
+        live pileup if one is built.
+        """
+        if seq_name in self._pileups:
+            return _pileup_coverage(self._pileups[seq_name], self.ref_lengths.get(seq_name, 0))
+        return _coverage(self._sorted_reads(seq_name), self.ref_lengths.get(seq_name, 0))
+
+    def breadth(self, seq_name: str) -> int:
+        """Return number of reference positions covered by at least one aligned base"""
+        depth = self.coverage(seq_name)
+        return len(depth) - depth.count(0)
+
+    def best_reference(self) -> str|None:
+        """Return reference with best mapping coverage, None if no reads are mapped"""
+        # Count covered positions for each reference
+        coverage = {}
+        for ref in self.references:
+            if self._pileups.get(ref) or self._reference_index(ref)[1]:
+                coverage[ref] = self.breadth(ref)
+            
+        if not coverage:
+            return None
+            
+        # Find reference with most positions covered
+        return max(coverage.items(), key=lambda x: x[1])[0]
+
+    def best_consensus(self) -> str:
+        """Return consensus sequence for reference with best mapping coverage"""
+        best_ref = self.best_reference()
+        if best_ref is None:
+            return ''
         return self.consensus(best_ref)
\ No newline at end of file
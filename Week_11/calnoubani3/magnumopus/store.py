@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+
+import re
+from array import array
+from collections import OrderedDict
+from functools import lru_cache
+from itertools import accumulate, chain, islice
+from typing import Iterable, Sequence
+
+CIGAR_OPS = "MIDNSHP=X"
+# reads whose derived data (decoded sequence, index tables, ...) each store keeps
+DERIVED_CACHE_SIZE = 4096
+_CIGAR_RE = re.compile(r"(\d+)([MIDNSHP=X])")
+# ops counted in mapped_len, as in Read (M and D)
+_REF_OPS = {CIGAR_OPS.index("M"), CIGAR_OPS.index("D")}
+
+# 2-bit base codes; anything else is stored as an exception to the packed sequence
+_TO_DIGITS = str.maketrans("ACGT", "0123")
+_ACGT = str.maketrans("", "", "ACGT")
+_UNPACK = ["".join("ACGT"[(byte >> shift) & 3] for shift in (6, 4, 2, 0)) for byte in range(256)]
+
+
+@lru_cache(maxsize=4096)
+def parse_cigar(cigar: str) -> tuple[tuple[int], int]:
+    """Return BAM-style (length << 4 | op) codes of a CIGAR string and its mapped length
+
+    Cached, since a run's reads share few distinct CIGARs (most are e.g. '151M').
+    """
+    codes = tuple(int(n) << 4 | CIGAR_OPS.index(op) for n, op in _CIGAR_RE.findall(cigar))
+    return codes, sum(code >> 4 for code in codes if code & 15 in _REF_OPS)
+
+
+def pack_seq(seq: str) -> tuple[bytes, tuple[tuple[int, str]]]:
+    """Pack a sequence into 2 bits per base, returning bytes and (offset, char) for non-ACGT"""
+    exceptions = ()
+    if seq.translate(_ACGT):
+        exceptions = tuple((i, base) for i, base in enumerate(seq) if base not in "ACGT")
+        seq = "".join("A" if base not in "ACGT" else base for base in seq)
+    if not seq:
+        return b"", exceptions
+
+    # base 4 digits parse directly into an int holding 2 bits per base
+    return int(seq.translate(_TO_DIGITS), 4).to_bytes((len(seq)+3)//4, "big"), exceptions
+
+
+def pack_seqs(seqs: Sequence[str]) -> tuple[bytes, list[int], list[tuple[tuple[int, str]]]]:
+    """Pack many sequences at once, returning their concatenated packed bytes, the
+    packed size of each and each one's non-ACGT exceptions, as pack_seq would"""
+    exceptions = [()] * len(seqs)
+    if "".join(seqs).translate(_ACGT):
+        seqs = list(seqs)
+        for i, seq in enumerate(seqs):
+            if seq.translate(_ACGT):
+                exceptions[i] = tuple((j, base) for j, base in enumerate(seq) if base not in "ACGT")
+                seqs[i] = "".join("A" if base not in "ACGT" else base for base in seq)
+
+    # padding each sequence to whole bytes with leading A (0) bases lets one int
+    # conversion pack them all
+    joined = "".join("A" * (-len(seq) % 4) + seq for seq in seqs)
+    if not joined:
+        return b"", [0] * len(seqs), exceptions
+    packed = int(joined.translate(_TO_DIGITS), 4).to_bytes(len(joined) // 4, "big")
+    return packed, [(len(seq) + 3) // 4 for seq in seqs], exceptions
+
+
+def unpack_seq(packed: bytes, length: int, exceptions: tuple[tuple[int, str]] = ()) -> str:
+    """Unpack a 2-bit packed sequence of given length, restoring non-ACGT characters"""
+    seq = "".join(map(_UNPACK.__getitem__, packed))
+    seq = seq[len(seq)-length:] # drop padding bases at the start of the first byte
+    if exceptions:
+        bases = list(seq)
+        for i, base in exceptions:
+            bases[i] = base
+        seq = "".join(bases)
+    return seq
+
+
+class StringColumn:
+    """Variable length strings stored in a single buffer with offsets"""
+    def __init__(self):
+        self.data: bytearray = bytearray()
+        self.offsets: array = array("Q", [0])
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        return self.data[self.offsets[i]:self.offsets[i+1]].decode()
+
+    def append(self, value: str):
+        self.data += value.encode()
+        self.offsets.append(len(self.data))
+
+    def extend(self, values: Iterable[str]):
+        encoded = [value.encode() for value in values]
+        self.offsets.extend(islice(accumulate(map(len, encoded), initial=len(self.data)), 1, None))
+        self.data += b"".join(encoded)
+
+    def raw(self, i: int) -> bytes:
+        return self.data[self.offsets[i]:self.offsets[i+1]]
+
+    def append_raw(self, value: bytes):
+        self.data += value
+        self.offsets.append(len(self.data))
+
+
+class LRUCache:
+    """Mapping that keeps only the maxsize most recently used entries"""
+    def __init__(self, maxsize: int):
+        self.maxsize: int = maxsize
+        self._entries: OrderedDict = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        if key not in self._entries:
+            return default
+        self._entries.move_to_end(key)
+        return self._entries[key]
+
+    def put(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+
+class ReadStore:
+    """Columnar storage of SAM records
+
+    Integer fields are kept in typed arrays, reference names are interned, CIGARs are
+    stored as BAM-style (length << 4 | op) integers, sequences are 2-bit packed and
+    quality strings are kept as one byte per base.
+
+    Records never change once appended, so data derived from them is cached in
+    derived, keyed by record index, with the least recently used evicted first.
+    """
+    def __init__(self, cache_size: int = DERIVED_CACHE_SIZE):
+        self.names: list[str] = []
+        self._name_ids: dict[str, int] = {}
+
+        self.qname: StringColumn = StringColumn()
+        self.flag: array = array("H")
+        self.rname: array = array("l")
+        self.pos: array = array("l")
+        self.mapq: array = array("B")
+        self.rnext: array = array("l")
+        self.pnext: array = array("l")
+        self.tlen: array = array("l")
+        self.mapped_len: array = array("l")
+
+        self.cigar: array = array("L")
+        self.cigar_offsets: array = array("Q", [0])
+
+        self.seq: bytearray = bytearray()
+        self.seq_offsets: array = array("Q", [0])
+        self.seq_len: array = array("L")
+        self.seq_exceptions: dict[int, tuple[tuple[int, str]]] = {}
+
+        self.qual: StringColumn = StringColumn()
+        self.tags: StringColumn = StringColumn()
+
+        self.derived: LRUCache = LRUCache(cache_size)
+
+    def __len__(self) -> int:
+        return len(self.flag)
+
+    def name_id(self, name: str) -> int:
+        """Return interned id for a reference name"""
+        if name not in self._name_ids:
+            self._name_ids[name] = len(self.names)
+            self.names.append(name)
+        return self._name_ids[name]
+
+    def append(self, fields: list[str]) -> int:
+        """Append a record from its SAM columns, returning its index"""
+        (qname, flag, rname, pos, mapq, cigar, rnext, pnext, tlen, seq, qual, *tags) = fields
+        cigar_codes, mapped_len = parse_cigar(cigar)
+        return self.append_record(qname, int(flag), rname, int(pos), int(mapq), cigar_codes,
+                                  rnext, int(pnext), int(tlen), seq, qual, "\t".join(tags), mapped_len)
+
+    def append_line(self, line: str) -> int:
+        """Append a record from a SAM line, returning its index
+
+        Optional tags are split off as one string and only split when accessed.
+        """
+        fields = line.strip().split("\t", 11)
+        cigar_codes, mapped_len = parse_cigar(fields[5])
+        return self.append_record(fields[0], int(fields[1]), fields[2], int(fields[3]), int(fields[4]), cigar_codes,
+                                  fields[6], int(fields[7]), int(fields[8]), fields[9], fields[10],
+                                  fields[11] if len(fields) > 11 else "", mapped_len)
+
+    def extend_lines(self, lines: Iterable[str]):
+        """Append records from many SAM lines at once, filling each column in bulk
+
+        Equivalent to append_line on each line, but columns are extended with one
+        call each instead of a dozen appends per record.
+        """
+        rows = [line.strip().split("\t", 11) for line in lines]
+        if not rows:
+            return
+        for row in rows:
+            if len(row) < 11:
+                raise ValueError(f"SAM record has {len(row)} columns, expected at least 11: {row[0]}")
+            if len(row) == 11:
+                row.append("")
+        (qnames, flags, rnames, positions, mapqs, cigars, rnexts, pnexts, tlens, seqs, quals, tags) = zip(*rows)
+        first = len(self.flag)
+
+        self.qname.extend(qnames)
+        self.flag.extend(map(int, flags))
+        self.rname.extend(map(self.name_id, rnames))
+        self.pos.extend(map(int, positions))
+        self.mapq.extend(map(int, mapqs))
+        self.rnext.extend(map(self.name_id, rnexts))
+        self.pnext.extend(map(int, pnexts))
+        self.tlen.extend(map(int, tlens))
+
+        codes, mapped_lens = zip(*map(parse_cigar, cigars))
+        self.cigar_offsets.extend(islice(accumulate(map(len, codes), initial=len(self.cigar)), 1, None))
+        self.cigar.extend(chain.from_iterable(codes))
+        self.mapped_len.extend(mapped_lens)
+
+        packed, sizes, exceptions = pack_seqs(seqs)
+        self.seq_offsets.extend(islice(accumulate(sizes, initial=len(self.seq)), 1, None))
+        self.seq += packed
+        self.seq_len.extend(map(len, seqs))
+        for i, seq_exceptions in enumerate(exceptions, first):
+            if seq_exceptions:
+                self.seq_exceptions[i] = seq_exceptions
+
+        self.qual.extend(quals)
+        self.tags.extend(tags)
+
+    def append_record(self, qname: str, flag: int, rname: str, pos: int, mapq: int, cigar_codes: Iterable[int],
+                      rnext: str, pnext: int, tlen: int, seq: str, qual: str, tags: str, mapped_len: int = None) -> int:
+        """Append a record from decoded values, with BAM-style CIGAR codes and tab-joined tags
+
+        mapped_len is worked out from the CIGAR if not given.
+        """
+        i = len(self.flag)
+
+        self.qname.append(qname)
+        self.flag.append(flag)
+        self.rname.append(self.name_id(rname))
+        self.pos.append(pos)
+        self.mapq.append(mapq)
+        self.rnext.append(self.name_id(rnext))
+        self.pnext.append(pnext)
+        self.tlen.append(tlen)
+
+        self.cigar.extend(cigar_codes)
+        if mapped_len is None:
+            mapped_len = sum(code >> 4 for code in self.cigar[self.cigar_offsets[-1]:] if code & 15 in _REF_OPS)
+        self.mapped_len.append(mapped_len)
+        self.cigar_offsets.append(len(self.cigar))
+
+        packed, exceptions = pack_seq(seq)
+        self.seq += packed
+        self.seq_offsets.append(len(self.seq))
+        self.seq_len.append(len(seq))
+        if exceptions:
+            self.seq_exceptions[i] = exceptions
+
+        self.qual.append(qual)
+        self.tags.append(tags)
+
+        return i
+
+    def take(self, indices: Iterable[int]) -> 'ReadStore':
+        """Return a new store holding copies of the given records, in the given order
+
+        Columns are copied directly, so no Read objects are created and the result
+        pickles as a handful of buffers.
+        """
+        store = ReadStore(self.derived.maxsize)
+        for i in indices:
+            j = len(store)
+            store.qname.append_raw(self.qname.raw(i))
+            store.flag.append(self.flag[i])
+            store.rname.append(store.name_id(self.names[self.rname[i]]))
+            store.pos.append(self.pos[i])
+            store.mapq.append(self.mapq[i])
+            store.rnext.append(store.name_id(self.names[self.rnext[i]]))
+            store.pnext.append(self.pnext[i])
+            store.tlen.append(self.tlen[i])
+            store.mapped_len.append(self.mapped_len[i])
+
+            store.cigar.extend(self.cigar[self.cigar_offsets[i]:self.cigar_offsets[i+1]])
+            store.cigar_offsets.append(len(store.cigar))
+
+            store.seq += self.seq[self.seq_offsets[i]:self.seq_offsets[i+1]]
+            store.seq_offsets.append(len(store.seq))
+            store.seq_len.append(self.seq_len[i])
+            if i in self.seq_exceptions:
+                store.seq_exceptions[j] = self.seq_exceptions[i]
+
+            store.qual.append_raw(self.qual.raw(i))
+            store.tags.append_raw(self.tags.raw(i))
+        return store
+
+    def cigar_ops(self, i: int) -> tuple[tuple[int, str]]:
+        """Return (length, op) tuples of a record's CIGAR"""
+        return tuple((code >> 4, CIGAR_OPS[code & 15]) for code in self.cigar[self.cigar_offsets[i]:self.cigar_offsets[i+1]])
+
+    def cigar_str(self, i: int) -> str:
+        ops = self.cigar_ops(i)
+        if not ops:
+            return "*"
+        return "".join(f"{n}{op}" for n, op in ops)
+
+    def seq_str(self, i: int) -> str:
+        packed = self.seq[self.seq_offsets[i]:self.seq_offsets[i+1]]
+        return unpack_seq(packed, self.seq_len[i], self.seq_exceptions.get(i, ()))
+
+    def fields(self, i: int) -> list[str]:
+        """Return a record's SAM columns"""
+        fields = [
+            self.qname[i],
+            str(self.flag[i]),
+            self.names[self.rname[i]],
+            str(self.pos[i]),
+            str(self.mapq[i]),
+            self.cigar_str(i),
+            self.names[self.rnext[i]],
+            str(self.pnext[i]),
+            str(self.tlen[i]),
+            self.seq_str(i),
+            self.qual[i],
+        ]
+        tags = self.tags[i]
+        if tags:
+            fields += tags.split("\t")
+        return fields
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+
+import operator
+import re
+from array import array
+from bisect import bisect_right
+from itertools import compress, repeat
+
+from .store import ReadStore
+
+# array typecodes for B array subtypes, and for whole columns of numeric tags
+_B_TYPECODES = {"c": "b", "C": "B", "s": "h", "S": "H", "i": "i", "I": "I", "f": "f"}
+_COLUMN_TYPECODES = {"i": "q", "f": "d"}
+
+_COMPARISONS = {"<": operator.lt, "<=": operator.le, "==": operator.eq, "!=": operator.ne,
+                ">=": operator.ge, ">": operator.gt}
+_CONDITION_RE = re.compile(r"^\s*(\w\w)\s*(<=|>=|==|!=|<|>)\s*(\S+)\s*$")
+
+
+def parse_tag_value(tag_type: str, value: str) -> int|float|str|array:
+    """Convert the text value of a SAM tag to its type: int, float, str or array for B"""
+    if tag_type == "i":
+        return int(value)
+    if tag_type == "f":
+        return float(value)
+    if tag_type == "B":
+        sub_type, *values = value.split(",")
+        convert = float if sub_type == "f" else int
+        return array(_B_TYPECODES[sub_type], map(convert, values))
+    return value
+
+
+def parse_tags(tags: str) -> dict[str, int|float|str|array]:
+    """Return typed values of tab-joined SAM tags by tag name"""
+    parsed = {}
+    if tags:
+        for tag in tags.split("\t"):
+            name, tag_type, value = tag.split(":", 2)
+            parsed[name] = parse_tag_value(tag_type, value)
+    return parsed
+
+
+class TagColumn:
+    """Typed values of one optional tag across every record of a ReadStore
+
+    Integer and float tags are held in array('q') / array('d') values with a
+    present byte per record, so they can be compared in bulk; other types are
+    kept in a list with None for missing records.
+    """
+    def __init__(self, name: str):
+        self.name: str = name
+        self.tag_type: str = None
+        self.values: array|list = []
+        self.present: bytearray = bytearray()
+
+    def __len__(self) -> int:
+        return len(self.present)
+
+    def __getitem__(self, i: int) -> int|float|str|array|None:
+        return self.values[i] if self.present[i] else None
+
+    def update(self, store: ReadStore):
+        """Parse the tag for records added to the store since the column was last updated"""
+        first, count = len(self), len(store) - len(self)
+        if count <= 0:
+            return
+
+        # Find every occurrence of the tag in the records' tag buffer at once, keeping
+        # those that start a tag; records are not separated in the buffer, so each
+        # value ends at the next tab or the end of its record
+        data, offsets = store.tags.data, store.tags.offsets
+        start, end = offsets[first], offsets[first + count]
+        pattern = re.compile(re.escape(self.name.encode()) + rb":([AifZHB]):")
+        found = {}
+        for match in pattern.finditer(data, start, end):
+            record = bisect_right(offsets, match.start(), first, first + count) - 1
+            if match.start() != offsets[record] and data[match.start() - 1] != 9:
+                continue
+            tag_type = match.group(1).decode()
+            if self.tag_type is None:
+                self.tag_type = tag_type
+                if tag_type in _COLUMN_TYPECODES:
+                    self.values = array(_COLUMN_TYPECODES[tag_type], [0]) * len(self)
+                else:
+                    self.values = [None] * len(self)
+            elif tag_type != self.tag_type:
+                raise ValueError(f"tag {self.name} has both type {self.tag_type} and {tag_type}")
+            value_end = data.find(b"\t", match.end(), offsets[record + 1])
+            value = data[match.end():offsets[record + 1] if value_end < 0 else value_end].decode()
+            found[record - first] = parse_tag_value(tag_type, value)
+
+        if self.tag_type in _COLUMN_TYPECODES:
+            values = array(_COLUMN_TYPECODES[self.tag_type], [0]) * count
+        else:
+            values = [None] * count
+        present = bytearray(count)
+        for i, value in found.items():
+            values[i] = value
+            present[i] = 1
+        self.values += values
+        self.present += present
+
+    def mask(self, op: str, value: int|float|str) -> bytearray:
+        """Return a byte per record, 1 where the tag is present and compares true against value"""
+        compare = _COMPARISONS[op]
+        mask = bytearray(len(self))
+        if self.tag_type is None:  # no read has the tag
+            return mask
+        if self.tag_type == "B":
+            raise ValueError(f"tag {self.name} holds arrays, which can't be compared")
+        if self.tag_type in _COLUMN_TYPECODES:
+            # compared as numbers, so 'NM <= 2.5' works on an integer tag
+            try:
+                value = float(value)
+            except ValueError:
+                raise ValueError(f"tag {self.name} is numeric, can't compare it with {value!r}") from None
+        # missing values (0 or None) are never compared
+        present = list(compress(range(len(self)), self.present))
+        hits = map(compare, map(self.values.__getitem__, present), repeat(value, len(present)))
+        for i, hit in zip(present, hits):
+            mask[i] = hit
+        return mask
+
+
+def parse_condition(condition: str) -> tuple[str, str, str]:
+    """Split a condition such as 'NM <= 2' into (tag, operator, value)"""
+    match = _CONDITION_RE.match(condition)
+    if not match:
+        raise ValueError(f"Can't parse tag condition {condition!r}, expected e.g. 'NM <= 2'")
+    return match.groups()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+
+import re
+from typing import Iterable, Iterator
+
+from .pileup import Pileup, PILEUP_SYMBOLS, normalise_bases
+
+_N_SYMBOLS = len(PILEUP_SYMBOLS)
+_DELETION = PILEUP_SYMBOLS.index("-")
+# MD tag tokens: a run of matches, deleted reference bases, or a mismatched reference base
+_MD_RE = re.compile(r"(\d+)|\^([A-Z]+)|([A-Z])")
+
+
+class Variant:
+    """A SNV or indel against the reference, with VCF-style REF/ALT alleles
+
+    Indels carry the reference base before them as their first base, and pos is
+    the position of that base, as in VCF.
+    """
+    __slots__ = ("chrom", "pos", "ref", "alt", "depth", "alt_count")
+
+    def __init__(self, chrom: str, pos: int, ref: str, alt: str, depth: int, alt_count: int):
+        self.chrom: str = chrom
+        self.pos: int = pos
+        self.ref: str = ref
+        self.alt: str = alt
+        self.depth: int = depth
+        self.alt_count: int = alt_count
+
+    def __repr__(self) -> str:
+        return f"Variant({self.chrom}:{self.pos} {self.ref}>{self.alt} AF={self.allele_freq:.3f})"
+
+    @property
+    def allele_freq(self) -> float:
+        return self.alt_count / self.depth
+
+    @property
+    def kind(self) -> str:
+        if len(self.ref) == len(self.alt):
+            return "SNV"
+        return "INS" if len(self.alt) > len(self.ref) else "DEL"
+
+    def vcf_line(self) -> str:
+        info = f"DP={self.depth};AO={self.alt_count};AF={self.allele_freq:.4f};TYPE={self.kind}"
+        return "\t".join([self.chrom, str(self.pos), ".", self.ref, self.alt, ".", "PASS", info])
+
+
+def vcf_header(ref_lengths: dict[str, int]) -> str:
+    """Return VCF header lines for variants on the given references"""
+    lines = ["##fileformat=VCFv4.2", "##source=magnumopus"]
+    lines += [f"##contig=<ID={name},length={length}>" for name, length in ref_lengths.items()]
+    lines += ['##INFO=<ID=DP,Number=1,Type=Integer,Description="Read depth">',
+              '##INFO=<ID=AO,Number=A,Type=Integer,Description="Reads supporting the alternate allele">',
+              '##INFO=<ID=AF,Number=A,Type=Float,Description="Alternate allele frequency">',
+              '##INFO=<ID=TYPE,Number=A,Type=String,Description="SNV, INS or DEL">',
+              "#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO"]
+    return "\n".join(lines)
+
+
+def md_reference(reads: Iterable['Read'], start: int, end: int) -> str:
+    """Return reference bases from start to end (exclusive) rebuilt from reads' MD tags,
+    'N' where no read with an MD tag covers a position
+
+    Raises ValueError if none of the reads has an MD tag.
+    """
+    ref = bytearray(b"N") * max(0, end - start)
+    has_md = False
+    for read in reads:
+        md = read.tag("MD")
+        if not md or not read.is_mapped:
+            continue
+        has_md = True
+        seq = normalise_bases(read.seq).encode()
+        # reference position and read index of each aligned base, in alignment order
+        aligned = [(ref_pos + k, read_idx + k)
+                   for ref_pos, read_idx, length, _ in read.aligned_blocks() for k in range(length)]
+        k, last = 0, read.pos - 1
+        for matches, deleted, mismatch in _MD_RE.findall(md):
+            if matches:
+                for ref_pos, read_idx in aligned[k:k + int(matches)]:
+                    if start <= ref_pos < end:
+                        ref[ref_pos - start] = seq[read_idx]
+                k += int(matches)
+                if 0 < k <= len(aligned):
+                    last = aligned[k - 1][0]
+            elif deleted:
+                for ref_pos, base in enumerate(deleted.encode(), last + 1):
+                    if start <= ref_pos < end:
+                        ref[ref_pos - start] = base
+                last += len(deleted)
+            elif k < len(aligned):
+                ref_pos = aligned[k][0]
+                if start <= ref_pos < end:
+                    ref[ref_pos - start] = ord(mismatch)
+                k += 1
+                last = ref_pos
+    if not has_md:
+        raise ValueError("no read has an MD tag (e.g. minimap2 --MD), a reference FASTA is needed")
+    return ref.decode()
+
+
+def call_variants(pileup: Pileup, chrom: str, ref_seq: str, min_depth: int = 1, min_af: float = 0.2) -> Iterator[Variant]:
+    """Yield SNVs and indels in position order from one pass over a pileup's counts
+
+    ref_seq holds the reference bases from the position before the pileup window to
+    its end, so deletions at the window start still have a base to anchor on. Sites
+    with fewer than min_depth reads (deletions included) are skipped, as are alleles
+    seen in less than min_af of them. Adjacent positions where deletions pass these
+    limits are reported as one deletion. Nothing is reported where the reference
+    base (or any deleted one) is unknown ('N').
+    """
+    counts, start = pileup.counts, pileup.start
+
+    def deletion_passes(row: int) -> bool:
+        cells = counts[row * _N_SYMBOLS:(row + 1) * _N_SYMBOLS]
+        depth = sum(cells)
+        return depth >= min_depth and cells[_DELETION] and cells[_DELETION] >= min_af * depth
+
+    in_deletion = False
+    for row in range(len(pileup)):
+        cells = counts[row * _N_SYMBOLS:(row + 1) * _N_SYMBOLS]
+        depth = sum(cells)
+        if depth < min_depth:
+            in_deletion = False
+            continue
+        pos, ref = start + row, ref_seq[row + 1]
+
+        # a deletion run is reported from its anchor base as soon as it starts
+        if cells[_DELETION] and cells[_DELETION] >= min_af * depth:
+            if not in_deletion:
+                last = row
+                while last + 1 < len(pileup) and deletion_passes(last + 1):
+                    last += 1
+                deleted = ref_seq[row:last + 2]
+                if "N" not in deleted:
+                    yield Variant(chrom, pos - 1, deleted, ref_seq[row], depth, cells[_DELETION])
+            in_deletion = True
+        else:
+            in_deletion = False
+
+        if ref not in "ACGT":
+            continue
+        for i, base in enumerate("ACGT"):
+            if base != ref and cells[i] and cells[i] >= min_af * depth:
+                yield Variant(chrom, pos, ref, base, depth, cells[i])
+
+        # insertions after this base, merged by inserted bases whatever the read's base
+        inserted: dict[str, int] = {}
+        for bases, (count, _, _) in pileup.insertions.get(row, {}).items():
+            inserted[bases[1:]] = inserted.get(bases[1:], 0) + count
+        for bases, count in sorted(inserted.items()):
+            if count >= min_af * depth:
+                yield Variant(chrom, pos, ref, ref + bases, depth, count)
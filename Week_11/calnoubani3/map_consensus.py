@@ -1,84 +1,371 @@
-#!/usr/bin/env python3
-
-import argparse
-import subprocess
-import sys
-from pathlib import Path
-from magnumopus.sam import SAM
-
-def parse_args():
-    """Parse command line arguments"""
-    parser = argparse.ArgumentParser(description="Map reads and generate consensus sequence")
-    parser.add_argument('-1', '--read1', required=True, help='Path to first read file (FASTQ)')
-    parser.add_argument('-2', '--read2', required=True, help='Path to second read file (FASTQ)')
-    parser.add_argument('-r', '--ref', required=True, help='Path to reference sequences (FASTA)')
-    parser.add_argument('-s', '--seq_name', help='Optional: specific sequence name to get consensus for')
-    return parser.parse_args()
-
-def run_minimap2(ref_path: str, read1_path: str, read2_path: str) -> str:
-    """Run minimap2 and return path to SAM output"""
-    # Create SAM filename based on input
-    sam_path = Path(read1_path).stem + '_vs_' + Path(ref_path).stem + '.sam'
-    
-    # Build minimap2 command with required settings
-    cmd = [
-        'minimap2',
-        '-ax', 'sr',        # Short-read mode
-        '-B', '0',          # Mismatch penalty 0
-        '-k', '10',         # K-mer size 10
-        str(ref_path),      # Reference path
-        str(read1_path),    # Read1 path
-        str(read2_path)     # Read2 path
-    ]
-    
-    # Run minimap2 and get output
-    with open(sam_path, 'w') as sam_file:
-        try:
-            subprocess.run(cmd, stdout=sam_file, stderr=subprocess.PIPE, check=True)
-        except subprocess.CalledProcessError as e:
-            print(f"Error running minimap2: {e.stderr.decode()}", file=sys.stderr)
-            sys.exit(1)
-        except FileNotFoundError:
-            print("Error: minimap2 not found. Please ensure it's installed and in your PATH.", file=sys.stderr)
-            sys.exit(1)
-            
-    return sam_path
-
-def print_fasta(header: str, sequence: str):
-    """Print sequence in FASTA format"""
-    print(f">{header}")
-    # Print sequence in lines of 80 characters
-    for i in range(0, len(sequence), 80):
-        print(sequence[i:i+80])
-
-def main():
-    # Parse command line arguments
-    args = parse_args()
-    
-    # Run minimap2 to align reads to reference
-    sam_path = run_minimap2(args.ref, args.read1, args.read2)
-    
-    # Parse SAM file
-    sam = SAM.from_sam(sam_path)
-    
-    # Get consensus sequence
-    if args.seq_name:
-        # Get consensus for specified sequence
-        consensus = sam.consensus(args.seq_name)
-        if not consensus:
-            print(f"Error: No consensus found for sequence {args.seq_name}", file=sys.stderr)
-            sys.exit(1)
-        header = f"{args.seq_name}_consensus"
-    else:
-        # Get consensus for best mapping
-        consensus = sam.best_consensus()
-        if not consensus:
-            print("Error: No consensus sequence found", file=sys.stderr)
-            sys.exit(1)
-        header = "best_mapping_consensus"
-    
-    # Print consensus in FASTA format
-    print_fasta(header, consensus)
-
-if __name__ == '__main__':
+#!/usr/bin/env python3
+
+import argparse
+import hashlib
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Iterable, Iterator
+from magnumopus.sam import SAM
+
+# minimap2 settings baked into an index, part of the index cache key
+INDEX_PARAMS = ['-x', 'sr', '-k', '10']
+# Cached indexes unused for this long are evicted
+INDEX_MAX_AGE = 30 * 24 * 60 * 60
+# Older versions of a reference's index used this recently may still be mapped against
+INDEX_GRACE = 60 * 60
+
+def parse_args():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description="Map reads and generate consensus sequence")
+    parser.add_argument('-1', '--read1', help='Path to first read file (FASTQ)')
+    parser.add_argument('-2', '--read2', help='Path to second read file (FASTQ)')
+    parser.add_argument('-r', '--ref', required=True, help='Path to reference sequences (FASTA)')
+    parser.add_argument('-s', '--seq_name', help='Optional: specific sequence name to get consensus for')
+    parser.add_argument('--keep-sam', nargs='?', const='', default=None, metavar='SAM',
+                        help='Also write minimap2 output to SAM (default name: <read1>_vs_<ref>.sam)')
+    parser.add_argument('--minimap2', default='minimap2', help='minimap2 executable to run')
+    parser.add_argument('--index_cache', default=default_index_cache(), help='Directory of cached minimap2 reference indexes')
+    parser.add_argument('--no_index_cache', action='store_true', help='Index the reference on every run instead of caching')
+
+    quality = parser.add_argument_group('quality-weighted consensus')
+    quality.add_argument('--weighted', action='store_true', help='Vote on consensus bases by summed base quality instead of read count')
+    quality.add_argument('--fastq', action='store_true', help='Write consensus as FASTQ with per-base consensus quality (implies --weighted)')
+    quality.add_argument('--min_base_qual', type=int, default=0, help='Ignore bases with lower quality')
+    quality.add_argument('--min_mapq', type=int, default=0, help='Ignore reads with lower mapping quality')
+
+    batch = parser.add_argument_group('batch mode')
+    batch.add_argument('--reads_dir', help='Directory of <sample>_1/<sample>_2 FASTQ pairs to process')
+    batch.add_argument('--samples', help='Sample sheet with sample name, read1 and read2 on each line')
+    batch.add_argument('-w', '--workers', type=int, default=os.cpu_count(), help='Number of samples to process at once')
+    batch.add_argument('--status', help='Write per-sample status table here instead of stderr')
+    args = parser.parse_args()
+
+    # Exactly one way of giving reads
+    modes = [bool(args.read1 or args.read2), bool(args.reads_dir), bool(args.samples)]
+    if sum(modes) != 1:
+        parser.error("give either -1/-2, --reads_dir or --samples")
+    if args.read1 and not args.read2 or args.read2 and not args.read1:
+        parser.error("-1 and -2 must be given together")
+    if args.keep_sam and not args.read1:
+        parser.error("--keep-sam can't take a path in batch mode")
+    args.weighted = args.weighted or args.fastq
+    if (args.min_base_qual or args.min_mapq) and not args.weighted:
+        parser.error("--min_base_qual and --min_mapq need --weighted or --fastq")
+    return args
+
+def default_index_cache() -> str:
+    """Return default minimap2 index cache directory"""
+    cache_home = os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache'
+    return str(Path(cache_home) / 'magnumopus' / 'minimap2')
+
+def index_key(ref_path: str) -> str:
+    """Return cache key from reference file contents and index parameters"""
+    digest = hashlib.sha256()
+    with open(ref_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    digest.update(' '.join(INDEX_PARAMS).encode())
+    return digest.hexdigest()[:16]
+
+def source_key(ref_path: str) -> str:
+    """Return key of the reference file's resolved path, so same-named references don't share entries"""
+    return hashlib.sha256(str(Path(ref_path).resolve()).encode()).hexdigest()[:8]
+
+def evict_stale_indexes(cache_dir: Path, source_prefix: str, keep: Path):
+    """Remove other versions of this reference file's index, long unused indexes and abandoned builds
+
+    source_prefix is '<stem>.<source_key>', so only indexes built from the same
+    reference path count as older versions of it. Those are kept while used within
+    INDEX_GRACE, or while a build of this reference is in progress, as a concurrent
+    run may be mapping against them or about to replace the current one.
+    """
+    now = time.time()
+    entries = list(cache_dir.glob('*.mmi*'))
+    building = any(entry.suffix == '.tmp' and entry.name.startswith(f'{source_prefix}.') for entry in entries)
+    for entry in entries:
+        if entry == keep:
+            continue
+        try:
+            age = now - entry.stat().st_mtime
+            if entry.suffix == '.tmp':
+                stale = age > 60 * 60 # a build that never finished
+            elif entry.name.rsplit('.', 2)[0] == source_prefix:
+                stale = not building and age > INDEX_GRACE
+            else:
+                stale = age > INDEX_MAX_AGE
+            if stale:
+                entry.unlink()
+        except FileNotFoundError: # removed by a concurrent run
+            continue
+
+def minimap2_index(ref_path: str, cache_dir: str, minimap2: str = 'minimap2') -> str:
+    """Return path to a cached minimap2 index of ref_path, building it on first use
+
+    Raises RuntimeError if minimap2 can't be run or fails.
+    """
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    source_prefix = f"{Path(ref_path).stem}.{source_key(ref_path)}"
+    index_path = cache_dir / f"{source_prefix}.{index_key(ref_path)}.mmi"
+    evict_stale_indexes(cache_dir, source_prefix, keep=index_path)
+
+    if index_path.exists():
+        index_path.touch() # mark as recently used
+        return str(index_path)
+
+    # Build under a temporary name and rename into place so concurrent runs never read a partial index
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, prefix=index_path.name, suffix='.tmp')
+    os.close(fd)
+    try:
+        cmd = [minimap2, *INDEX_PARAMS, '-d', tmp_path, str(ref_path)]
+        try:
+            result = subprocess.run(cmd, capture_output=True, text=True)
+        except FileNotFoundError:
+            raise RuntimeError(f"{minimap2} not found. Please ensure it's installed and in your PATH.")
+        if result.returncode != 0:
+            raise RuntimeError(f"minimap2 index build failed: {result.stderr}")
+        os.replace(tmp_path, index_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    return str(index_path)
+
+def default_sam_path(ref_path: str, read1_path: str) -> str:
+    """Return SAM filename based on input"""
+    return Path(read1_path).stem + '_vs_' + Path(ref_path).stem + '.sam'
+
+def tee_lines(lines: Iterable[str], out_file) -> Iterator[str]:
+    """Yield lines while also writing them to out_file"""
+    for line in lines:
+        out_file.write(line)
+        yield line
+
+def run_minimap2(ref_path: str, read1_path: str, read2_path: str, keep_sam: str = None,
+                 minimap2: str = 'minimap2', index_path: str = None) -> SAM:
+    """Run minimap2 and parse its SAM output from a pipe as it is produced
+
+    A prebuilt index_path of ref_path is mapped against instead of the FASTA if given.
+    Raises RuntimeError if minimap2 can't be run or fails.
+    """
+    # Build minimap2 command with required settings
+    cmd = [
+        minimap2,
+        '-ax', 'sr',        # Short-read mode
+        '-B', '0',          # Mismatch penalty 0
+        '-k', '10',         # K-mer size 10
+        '--MD',             # MD tags, so variants can be called without the FASTA
+        str(index_path or ref_path),  # Reference index or FASTA path
+        str(read1_path),    # Read1 path
+        str(read2_path)     # Read2 path
+    ]
+    
+    # stderr goes to a temp file so a chatty minimap2 can't block on a full pipe
+    with tempfile.TemporaryFile(mode='w+') as stderr:
+        try:
+            proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=stderr, text=True)
+        except FileNotFoundError:
+            raise RuntimeError(f"{minimap2} not found. Please ensure it's installed and in your PATH.")
+
+        # Parse alignments while minimap2 is still running
+        with proc:
+            if keep_sam is None:
+                sam = SAM.from_stream(proc.stdout)
+            else:
+                with open(keep_sam or default_sam_path(ref_path, read1_path), 'w') as sam_file:
+                    sam = SAM.from_stream(tee_lines(proc.stdout, sam_file))
+
+        if proc.returncode != 0:
+            stderr.seek(0)
+            raise RuntimeError(f"minimap2 failed: {stderr.read()}")
+            
+    return sam
+
+def get_consensus(sam: SAM, seq_name: str = None, weighted: bool = False,
+                  min_base_qual: int = 0, min_mapq: int = 0) -> tuple[str, str, str]:
+    """Return FASTA header, consensus and its quality string ('' unless weighted) for
+    seq_name, or for the best mapping if not given"""
+    if seq_name:
+        header, error = f"{seq_name}_consensus", f"No consensus found for sequence {seq_name}"
+    else:
+        # Get consensus for best mapping
+        seq_name = sam.best_reference()
+        header, error = "best_mapping_consensus", "No consensus sequence found"
+
+    if seq_name is None:
+        consensus, qual = '', ''
+    elif weighted:
+        consensus, qual = sam.weighted_consensus(seq_name, min_base_qual, min_mapq)
+    else:
+        consensus, qual = sam.consensus(seq_name), ''
+    if not consensus:
+        raise ValueError(error)
+    return header, consensus, qual
+
+def discover_pairs(reads_dir: str) -> list[tuple[str, str, str]]:
+    """Return (sample, read1, read2) for each <sample>_1/<sample>_2 FASTQ pair in a directory"""
+    pairs = []
+    for read1 in sorted(Path(reads_dir).iterdir()):
+        name = read1.name
+        if "_1.f" not in name:
+            continue
+        sample = name[:name.rindex("_1.f")]
+        read2 = read1.with_name(sample + "_2" + name[len(sample)+2:])
+        if not read2.exists():
+            print(f"Warning: no read 2 file for {read1}, skipping", file=sys.stderr)
+            continue
+        pairs.append((sample, str(read1), str(read2)))
+    return pairs
+
+def read_sample_sheet(sheet_path: str) -> list[tuple[str, str, str]]:
+    """Return (sample, read1, read2) from a whitespace separated sample sheet
+
+    Blank lines and lines starting with # are skipped. Relative read paths are
+    taken relative to the sheet's directory. Raises ValueError naming any line
+    without exactly three fields.
+    """
+    sheet_dir = Path(sheet_path).parent
+    samples = []
+    with open(sheet_path) as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip() or line.startswith("#"):
+                continue
+            fields = line.split()
+            if len(fields) != 3:
+                raise ValueError(f"{sheet_path} line {line_number}: expected sample, read1 and read2, "
+                                 f"got {line.strip()!r}")
+            sample, read1, read2 = fields
+            samples.append((sample, str(sheet_dir / read1), str(sheet_dir / read2)))
+    return samples
+
+def process_sample(sample: str, read1: str, read2: str, ref: str, seq_name: str = None, keep_sam: bool = False,
+                   minimap2: str = 'minimap2', index_path: str = None,
+                   quality: tuple[bool, int, int] = (False, 0, 0)) -> tuple[str, str, str, str, str, float]:
+    """Map and call consensus for one sample, returning (sample, header, consensus, qual, status, seconds)
+
+    quality holds get_consensus's (weighted, min_base_qual, min_mapq) options.
+    """
+    start = time.perf_counter()
+    try:
+        sam = run_minimap2(ref, read1, read2, keep_sam='' if keep_sam else None, minimap2=minimap2, index_path=index_path)
+        header, consensus, qual = get_consensus(sam, seq_name, *quality)
+        status = "ok"
+    except (RuntimeError, ValueError, OSError) as e:
+        header, consensus, qual, status = "", "", "", f"error: {' '.join(str(e).split())}"
+    return sample, f"{sample}_{header}" if header else "", consensus, qual, status, time.perf_counter() - start
+
+def run_batch(samples: list[tuple[str, str, str]], args, index_path: str = None) -> list[tuple[str, str, str, str, str, float]]:
+    """Process samples across a pool of worker processes, returning results in sample order"""
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = [
+            executor.submit(process_sample, sample, read1, read2, args.ref, args.seq_name,
+                            args.keep_sam is not None, args.minimap2, index_path,
+                            (args.weighted, args.min_base_qual, args.min_mapq))
+            for sample, read1, read2 in samples
+        ]
+        return [future.result() for future in futures]
+
+def write_status(results: list[tuple[str, str, str, str, str, float]], out_file):
+    """Write per-sample status table"""
+    print("sample\tstatus\tconsensus_length\tseconds", file=out_file)
+    for sample, _, consensus, _, status, seconds in results:
+        print(f"{sample}\t{status}\t{len(consensus)}\t{seconds:.2f}", file=out_file)
+
+def print_fasta(header: str, sequence: str):
+    """Print sequence in FASTA format"""
+    print(f">{header}")
+    # Print sequence in lines of 80 characters
+    for i in range(0, len(sequence), 80):
+        print(sequence[i:i+80])
+
+def print_fastq(header: str, sequence: str, qual: str):
+    """Print sequence and its quality string in FASTQ format"""
+    print(f"@{header}")
+    print(sequence)
+    print("+")
+    print(qual)
+
+def print_consensus(header: str, sequence: str, qual: str, fastq: bool = False):
+    """Print consensus as FASTQ if requested, otherwise FASTA"""
+    if fastq:
+        print_fastq(header, sequence, qual)
+    else:
+        print_fasta(header, sequence)
+
+def get_index(args) -> str:
+    """Return cached index path for the reference, or None if caching is disabled"""
+    if args.no_index_cache:
+        return None
+    try:
+        return minimap2_index(args.ref, args.index_cache, args.minimap2)
+    except OSError as e:
+        raise RuntimeError(f"can't index reference {args.ref}: {e}")
+
+def main():
+    # Parse command line arguments
+    args = parse_args()
+
+    if not args.read1:
+        batch_main(args)
+        return
+    
+    try:
+        index_path = get_index(args)
+
+        # Run minimap2 to align reads to reference, parsing its output as it streams
+        sam = run_minimap2(args.ref, args.read1, args.read2, keep_sam=args.keep_sam,
+                           minimap2=args.minimap2, index_path=index_path)
+    
+        # Get consensus sequence
+        header, consensus, qual = get_consensus(sam, args.seq_name, args.weighted, args.min_base_qual, args.min_mapq)
+    except (RuntimeError, ValueError, OSError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+    
+    # Print consensus in FASTA (or FASTQ) format
+    print_consensus(header, consensus, qual, args.fastq)
+
+def batch_main(args):
+    # Find samples to process
+    if args.reads_dir:
+        samples = discover_pairs(args.reads_dir)
+    else:
+        try:
+            samples = read_sample_sheet(args.samples)
+        except (OSError, ValueError) as e:
+            print(f"Error: {e}", file=sys.stderr)
+            sys.exit(1)
+    if not samples:
+        print("Error: No samples found", file=sys.stderr)
+        sys.exit(1)
+
+    # Index the reference once up front so workers share it
+    try:
+        index_path = get_index(args)
+    except RuntimeError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    results = run_batch(samples, args, index_path)
+
+    # Print all consensus sequences as one multi-FASTA (or FASTQ)
+    for _, header, consensus, qual, _, _ in results:
+        if consensus:
+            print_consensus(header, consensus, qual, args.fastq)
+
+    if args.status:
+        with open(args.status, 'w') as status_file:
+            write_status(results, status_file)
+    else:
+        write_status(results, sys.stderr)
+
+    if not any(status == "ok" for _, _, _, _, status, _ in results):
+        sys.exit(1)
+
+if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,17 @@
+import pytest
+
+from . import test_data
+
+from magnumopus.sam import SAM
+
+
+@pytest.fixture
+def test_sam(tmp_path) -> SAM:
+    sam_path = tmp_path / "test.sam"
+    sam_path.write_text(test_data.TEST_SAM)
+    return SAM.from_sam(sam_path)
+
+
+@pytest.fixture(scope="module")
+def example_sam() -> SAM:
+    return SAM.from_sam(test_data.EXAMPLE_SAM)
@@ -0,0 +1,64 @@
+import gzip
+
+from . import test_data
+
+from magnumopus.bam import BgzfReader, BgzfWriter, _decode_tags, _encode_tags
+from magnumopus.sam import SAM
+
+
+def normalised(read) -> list:
+    """SAM columns with float tags as floats, since BAM does not keep their text form"""
+    fields = str(read).split("\t")
+    return fields[:11] + [float(tag[5:]) if tag[3:5] == "f:" else tag for tag in fields[11:]]
+
+
+def round_trip(sam: SAM, tmp_path) -> SAM:
+    bam_file = tmp_path / "reads.bam"
+    sam.to_bam(bam_file)
+    return SAM.from_bam(bam_file)
+
+
+class TestBgzf:
+    def test_blocks_are_gzip(self, tmp_path):
+        """Is a multi-block BGZF file readable as plain gzip and ended by the EOF block"""
+        data = bytes(range(256)) * 1000
+        with BgzfWriter(tmp_path / "data.gz", threads=2) as bgzf:
+            bgzf.write(data)
+        raw = (tmp_path / "data.gz").read_bytes()
+        assert gzip.decompress(raw) == data
+        assert raw.endswith(bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000"))
+
+    def test_seek_virtual_offset(self, tmp_path):
+        """Does seeking to a told virtual offset resume reading at the same byte"""
+        data = bytes(range(256)) * 1000
+        with BgzfWriter(tmp_path / "data.gz") as bgzf:
+            bgzf.write(data)
+        with BgzfReader(tmp_path / "data.gz") as bgzf:
+            bgzf.read(100_000)
+            offset = bgzf.tell()
+            expected = bgzf.read(50)
+            bgzf.seek(offset)
+            assert bgzf.read(50) == expected == data[100_000:100_050]
+
+
+class TestBam:
+    def test_tags_round_trip(self):
+        """Do SAM tags of each type survive binary encoding"""
+        tags = ["NM:i:0", "AS:i:-300", "XL:i:70000", "tp:A:P", "cs:Z::4*ag", "de:f:0.5", "ML:B:C,1,255", "XB:B:f,1.5,-2"]
+        assert _decode_tags(_encode_tags(tags)) == "\t".join(tags)
+
+    def test_example_round_trip(self, tmp_path):
+        """Do the example SAM reads and consensus survive writing and reading BAM"""
+        sam = SAM.from_sam(test_data.EXAMPLE_SAM)
+        bam = round_trip(sam, tmp_path)
+        assert bam.ref_lengths == sam.ref_lengths
+        assert list(map(normalised, bam.reads)) == list(map(normalised, sam.reads))
+        assert bam.best_consensus() == sam.best_consensus()
+
+    def test_only_primary_mapped(self, tmp_path):
+        """Are unmapped and secondary records left out, as in from_sam"""
+        sam_file = tmp_path / "test.sam"
+        sam_file.write_text(test_data.TEST_SAM)
+        bam = round_trip(SAM.from_sam(sam_file), tmp_path)
+        assert [read.qname for read in bam.reads] == ["read_1", "read_2", "read_3", "read_4"]
+        assert bam.consensus("Ref_seq_ID") == "ACGTTTACGTACNN"
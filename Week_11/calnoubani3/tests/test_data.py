@@ -0,0 +1,25 @@
+from pathlib import Path
+
+EXAMPLE_SAM = Path(__file__).parent.parent / "ERR11767307_1_vs_16S.sam"
+
+HEADER = "\n".join([
+    "@SQ\tSN:Ref_seq_ID\tLN:40",
+    "@SQ\tSN:Other_ref\tLN:40",
+])
+
+def sam_line(qname: str, flag: int, pos: int, cigar: str, seq: str, rname: str = "Ref_seq_ID") -> str:
+    """Build a minimal SAM entry with a constant quality string"""
+    return "\t".join([qname, str(flag), rname, str(pos), "60", cigar, "=", "0", "0", seq, "F" * len(seq), "NM:i:0"])
+
+# Three reads over Ref_seq_ID positions 1-12: two agree on an insertion after position 4,
+# one has a deletion at positions 5-6 and ties are forced at positions 11-12
+TEST_READS = [
+    sam_line("read_1", 99, 1, "4M2I6M", "ACGTTTACGTAC"),
+    sam_line("read_2", 163, 1, "2S4M2I6M", "GGACGTTTACGTCC"),
+    sam_line("read_3", 83, 3, "2M2D6M", "GTGTACGT"),
+    sam_line("read_4", 147, 10, "3M", "GAC"),
+    sam_line("unmapped", 69, 1, "*", "ACGT"),
+    sam_line("secondary", 355, 1, "4M", "TTTT"),
+]
+
+TEST_SAM = HEADER + "\n" + "\n".join(TEST_READS) + "\n"
@@ -0,0 +1,114 @@
+import pytest
+
+from . import test_data
+
+from magnumopus.pileup import Pileup
+from magnumopus.sam import SAM
+
+
+@pytest.fixture(scope="module")
+def runs() -> tuple[list[str], list[str]]:
+    """Example SAM split into two sequencing runs, each with the header"""
+    with open(test_data.EXAMPLE_SAM) as f:
+        lines = f.readlines()
+    header = [line for line in lines if line.startswith("@")]
+    records = [line for line in lines if not line.startswith("@")]
+    return header + records[::2], header + records[1::2]
+
+
+class TestIncrementalConsensus:
+    def test_add_reads_matches_full(self, runs, example_sam):
+        """Does topping up live pileups give the consensus of all reads"""
+        sam = SAM.from_stream(runs[0])
+        for ref in sam.references:
+            sam.pileup(ref)
+        sam.add_reads(SAM.from_stream(runs[1]).reads)
+        for ref in example_sam.references:
+            assert sam.consensus(ref) == example_sam.consensus(ref)
+
+    def test_only_touched_positions_recalled(self, runs, monkeypatch):
+        """Are only the positions a new read aligns to called again"""
+        sam = SAM.from_stream(runs[0])
+        read = SAM.from_stream(runs[1]).reads[0]
+        pileup = sam.pileup(read.rname)
+        before = sam.consensus(read.rname)
+
+        recalled = []
+        original = Pileup._majority_call
+        monkeypatch.setattr(Pileup, "_majority_call", lambda self, row: recalled.append(row) or original(self, row))
+        sam.add_reads([read])
+        after = sam.consensus(read.rname)
+        assert 0 < len(recalled) <= read.mapped_len
+        assert all(read.pos <= pileup.start + row < read.pos + read.mapped_len for row in recalled)
+        assert len(after) >= len(before)
+
+    def test_saved_pileups_topped_up(self, runs, example_sam, tmp_path):
+        """Does a saved pileup merged with a later run give the consensus of both runs"""
+        SAM.from_stream(runs[0]).save_pileups(tmp_path / "sample.pileups")
+        sam = SAM.from_pileups(tmp_path / "sample.pileups")
+        assert not sam.reads
+        sam.merge(SAM.from_stream(runs[1]))
+        for ref in example_sam.references:
+            assert sam.consensus(ref) == example_sam.consensus(ref)
+        assert sam.ref_lengths == example_sam.ref_lengths
+
+    def test_merge_live_pileups(self, runs, example_sam):
+        """Are another SAM's live pileups merged rather than its reads counted twice"""
+        first, second = SAM.from_stream(runs[0]), SAM.from_stream(runs[1])
+        for ref in second.references:
+            second.pileup(ref)
+        first.merge(second)
+        assert len(first.reads) == len(example_sam.reads)
+        for ref in example_sam.references:
+            assert first.consensus(ref) == example_sam.consensus(ref)
+
+    def test_appended_reads_counted(self, runs, example_sam):
+        """Do reads appended to sam.reads update pileups built before them"""
+        sam = SAM.from_stream(runs[0])
+        for ref in sam.references:
+            sam.pileup(ref)
+        sam.reads.extend(SAM.from_stream(runs[1]).reads)
+        for ref in example_sam.references:
+            assert sam.consensus(ref) == example_sam.consensus(ref)
+
+
+class TestSavedPileups:
+    def test_from_pileups_matches_reads(self, example_sam, tmp_path):
+        """Do coverage and consensus queries on saved pileups match the reads they count"""
+        SAM.from_sam(test_data.EXAMPLE_SAM).save_pileups(tmp_path / "sample.pileups")
+        sam = SAM.from_pileups(tmp_path / "sample.pileups")
+        best = example_sam.best_reference()
+        assert sam.best_reference() == best
+        assert sam.best_consensus() == example_sam.best_consensus() != ''
+        assert sam.consensus_all() == example_sam.consensus_all()
+        for ref in example_sam.references:
+            assert sam.coverage(ref) == example_sam.coverage(ref)
+            assert sam.weighted_consensus(ref) == example_sam.weighted_consensus(ref)
+        assert sam.region_consensus(best, 50, 300) == example_sam.region_consensus(best, 50, 300)
+        assert sam.consensus_at_pos(best, 100) == example_sam.consensus_at_pos(best, 100)
+        with pytest.raises(ValueError):
+            sam.reads_at_pos(best, 100)
+
+    def test_topped_up_coverage(self, runs, example_sam, tmp_path):
+        """Is the best reference of topped-up pileups ranked on every run's reads"""
+        SAM.from_stream(runs[0]).save_pileups(tmp_path / "sample.pileups")
+        sam = SAM.from_pileups(tmp_path / "sample.pileups")
+        sam.merge(SAM.from_stream(runs[1]))
+        assert sam.best_reference() == example_sam.best_reference()
+        for ref in example_sam.references:
+            assert sam.breadth(ref) == example_sam.breadth(ref)
+
+
+class TestPileupGrowth:
+    def test_expand_keeps_counts(self, example_sam):
+        """Are counts kept in place when the window grows on both sides"""
+        pileup = example_sam.pileup_matrix("Bacillus_subtilis")
+        row = pileup.row(pileup.start + 5)
+        pileup.expand(pileup.start - 10, pileup.end + 10)
+        assert pileup.row(pileup.start + 15) == row
+        assert pileup.row(pileup.start) == (0,) * 6
+
+    def test_merge_filters_must_match(self):
+        """Are pileups with different quality filters refused"""
+        with pytest.raises(ValueError):
+            Pileup(1, 5).merge(Pileup(1, 5, min_base_qual=20))
@@ -0,0 +1,82 @@
+import pytest
+
+from . import test_data
+
+from magnumopus import index
+from magnumopus.sam import SAM
+
+
+@pytest.fixture
+def sorted_sam(tmp_path, monkeypatch):
+    """Coordinate-sorted copy of the example SAM, indexed in small windows"""
+    monkeypatch.setattr(index, "WINDOW_SHIFT", 6)
+    sam = SAM.from_sam(test_data.EXAMPLE_SAM)
+    refs = list(sam.ref_lengths)
+    with open(test_data.EXAMPLE_SAM) as f:
+        header = [line for line in f if line.startswith("@")]
+    reads = sorted(sam.reads, key=lambda read: (refs.index(read.rname), read.pos))
+    sam_file = tmp_path / "sorted.sam"
+    sam_file.write_text("".join(header) + "".join(f"{read}\n" for read in reads))
+    return sam_file
+
+
+def regions(sam: SAM) -> list[tuple[str, int, int]]:
+    return [(read.rname, read.pos + offset, read.pos + offset + size)
+            for read in sam.reads[::7] for offset, size in ((-40, 10), (0, 0), (60, 200))]
+
+
+class TestFetch:
+    def test_in_memory(self):
+        """Does fetch return position-sorted reads overlapping the region"""
+        sam = SAM.from_sam(test_data.EXAMPLE_SAM)
+        rname, start, end = regions(sam)[0]
+        reads = sam.fetch(rname, start, end)
+        assert reads
+        assert [read.pos for read in reads] == sorted(read.pos for read in reads)
+        assert all(read.pos <= end and read.pos + read.mapped_len > start for read in reads)
+
+    @pytest.mark.parametrize("bam", [False, True])
+    def test_indexed_matches_in_memory(self, sorted_sam, bam):
+        """Do indexed SAM and BAM queries return the same reads as the loaded file"""
+        sam = SAM.from_sam(sorted_sam)
+        path = sorted_sam
+        if bam:
+            path = sorted_sam.with_suffix(".bam")
+            sam.to_bam(path)
+            sam = SAM.from_bam(path)
+        indexed = SAM.open_indexed(path)
+        assert not indexed.reads
+        assert indexed.ref_lengths == sam.ref_lengths
+        for rname, start, end in regions(sam):
+            expected = [str(read) for read in sam.fetch(rname, start, end)]
+            assert [str(read) for read in indexed.fetch(rname, start, end)] == expected
+            assert indexed.region_consensus(rname, start, end) == sam.region_consensus(rname, start, end)
+
+    def test_sidecar_reused_until_stale(self, sorted_sam):
+        """Is the sidecar index written once and rebuilt when the file changes"""
+        SAM.open_indexed(sorted_sam)
+        index_file = sorted_sam.with_name(sorted_sam.name + index.INDEX_SUFFIX)
+        assert index_file.exists()
+        built = index.LinearIndex.load(index_file)
+        assert index.LinearIndex.for_file(sorted_sam).offsets == built.offsets
+
+        sorted_sam.write_text(test_data.HEADER + "\n" + "\n".join(test_data.TEST_READS[:4]) + "\n")
+        assert SAM.open_indexed(sorted_sam).fetch("Ref_seq_ID", 10, 10)[-1].qname == "read_4"
+
+    def test_unsorted_rejected(self, tmp_path):
+        """Is an unsorted file refused rather than indexed wrongly"""
+        sam_file = tmp_path / "unsorted.sam"
+        sam_file.write_text(test_data.HEADER + "\n" + "\n".join(reversed(test_data.TEST_READS[:4])) + "\n")
+        with pytest.raises(ValueError):
+            SAM.open_indexed(sam_file)
+
+
+class TestRegionConsensus:
+    def test_matches_full_consensus(self):
+        """Is region consensus the matching slice of the reference consensus, N outside reads"""
+        sam = SAM.from_sam(test_data.EXAMPLE_SAM)
+        rname = sam.reads[0].rname
+        consensus = sam.consensus(rname)
+        first = min(read.pos for read in sam.reads if read.rname == rname)
+        assert sam.region_consensus(rname, first + 10, first + 40) == consensus[10:41]
+        assert sam.region_consensus(rname, first - 3, first - 1) == "NNN"
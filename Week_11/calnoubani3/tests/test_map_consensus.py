@@ -0,0 +1,204 @@
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+from . import test_data
+
+import map_consensus
+from magnumopus.sam import SAM
+
+SCRIPT = Path(__file__).parent.parent / "map_consensus.py"
+
+
+@pytest.fixture
+def fake_minimap2(tmp_path) -> Path:
+    """Stand-in for minimap2 that logs its arguments, writes a dummy index for -d
+    and otherwise prints the example SAM to stdout"""
+    (tmp_path / "16S.fna").write_text(">ref\nACGT\n")
+    script = tmp_path / "fake_minimap2"
+    script.write_text("\n".join([
+        f"#!{sys.executable}",
+        "import sys",
+        f"open({str(tmp_path / 'calls.log')!r}, 'a').write(' '.join(sys.argv[1:]) + '\\n')",
+        "if '-d' in sys.argv:",
+        "    open(sys.argv[sys.argv.index('-d') + 1], 'w').write('index')",
+        "    sys.exit()",
+        "sys.stderr.write('[M::main] fake minimap2\\n')",
+        f"sys.stdout.write(open({str(test_data.EXAMPLE_SAM)!r}).read())",
+    ]))
+    script.chmod(0o755)
+    return script
+
+
+def minimap2_calls(tmp_path: Path) -> list[list[str]]:
+    return [line.split() for line in (tmp_path / "calls.log").read_text().splitlines()]
+
+
+def run_map_consensus(tmp_path: Path, *args: str) -> subprocess.CompletedProcess:
+    cmd = [sys.executable, str(SCRIPT), "-1", "sample_1.fastq", "-2", "sample_2.fastq", "-r", "16S.fna",
+           "--index_cache", "cache", *args]
+    return subprocess.run(cmd, cwd=tmp_path, capture_output=True, text=True)
+
+
+class TestMinimap2Pipe:
+    def test_consensus_from_pipe(self, tmp_path, fake_minimap2):
+        """Is the consensus built from minimap2's stdout without writing a SAM file"""
+        result = run_map_consensus(tmp_path, "--minimap2", str(fake_minimap2))
+        assert result.returncode == 0, result.stderr
+        header, *seq_lines = result.stdout.splitlines()
+        assert header == ">best_mapping_consensus"
+        assert "".join(seq_lines) == SAM.from_sam(test_data.EXAMPLE_SAM).best_consensus()
+        assert not list(tmp_path.glob("*.sam"))
+
+    def test_keep_sam(self, tmp_path, fake_minimap2):
+        """Is minimap2's output written to disk when --keep-sam is given"""
+        result = run_map_consensus(tmp_path, "--minimap2", str(fake_minimap2), "--keep-sam")
+        assert result.returncode == 0, result.stderr
+        assert (tmp_path / "sample_1_vs_16S.sam").read_text() == test_data.EXAMPLE_SAM.read_text()
+
+    def test_minimap2_failure(self, tmp_path):
+        """Does a failing minimap2 exit with an error"""
+        (tmp_path / "16S.fna").write_text(">ref\nACGT\n")
+        result = run_map_consensus(tmp_path, "--minimap2", "false", "--no_index_cache")
+        assert result.returncode == 1
+        assert "Error: minimap2 failed" in result.stderr
+
+
+class TestIndexCache:
+    def test_index_built_once(self, tmp_path, fake_minimap2):
+        """Is the reference indexed on the first run only and the index mapped against"""
+        for _ in range(2):
+            result = run_map_consensus(tmp_path, "--minimap2", str(fake_minimap2))
+            assert result.returncode == 0, result.stderr
+        calls = minimap2_calls(tmp_path)
+        index_path = str(next((tmp_path / "cache").glob("16S.*.mmi")).relative_to(tmp_path))
+        assert calls[0][:5] == ["-x", "sr", "-k", "10", "-d"]
+        assert [call[-3] for call in calls[1:]] == [index_path, index_path]
+        assert not [call for call in calls[1:] if "-d" in call]
+
+    def test_changed_reference_evicts_old_index(self, tmp_path, fake_minimap2):
+        """Is the index rebuilt and the old one removed once unused for the grace period"""
+        run_map_consensus(tmp_path, "--minimap2", str(fake_minimap2))
+        old_index = next((tmp_path / "cache").glob("16S.*.mmi"))
+        unused = time.time() - map_consensus.INDEX_GRACE - 60
+        os.utime(old_index, (unused, unused))
+        (tmp_path / "16S.fna").write_text(">ref\nTTTT\n")
+        run_map_consensus(tmp_path, "--minimap2", str(fake_minimap2))
+        indexes = list((tmp_path / "cache").glob("16S.*"))
+        assert len(indexes) == 1 and indexes[0] != old_index
+
+    def test_old_index_in_use_kept(self, tmp_path, fake_minimap2):
+        """Is an old version kept while recently used or while another run is building an index"""
+        cache = tmp_path / "cache"
+        old_index = Path(map_consensus.minimap2_index(tmp_path / "16S.fna", cache, str(fake_minimap2)))
+        (tmp_path / "16S.fna").write_text(">ref\nTTTT\n")
+        new_index = Path(map_consensus.minimap2_index(tmp_path / "16S.fna", cache, str(fake_minimap2)))
+        assert old_index.exists() and new_index.exists()
+
+        unused = time.time() - map_consensus.INDEX_GRACE - 60
+        os.utime(new_index, (unused, unused))
+        building = cache / f"{old_index.name}abc123.tmp"
+        building.write_text("")
+        (tmp_path / "16S.fna").write_text(">ref\nACGT\n")
+        map_consensus.minimap2_index(tmp_path / "16S.fna", cache, str(fake_minimap2))
+        assert new_index.exists()
+        building.unlink()
+        map_consensus.minimap2_index(tmp_path / "16S.fna", cache, str(fake_minimap2))
+        assert not new_index.exists()
+
+    def test_same_name_references_keep_indexes(self, tmp_path, fake_minimap2):
+        """Do references that only share a file name keep each other's indexes"""
+        for name in ("a", "b"):
+            (tmp_path / name).mkdir()
+            (tmp_path / name / "ref.fna").write_text(f">{name}\nACGT{name.upper()}\n")
+        first = map_consensus.minimap2_index(tmp_path / "a" / "ref.fna", tmp_path / "cache", str(fake_minimap2))
+        second = map_consensus.minimap2_index(tmp_path / "b" / "ref.fna", tmp_path / "cache", str(fake_minimap2))
+        assert first != second and Path(first).exists() and Path(second).exists()
+
+    def test_no_index_cache(self, tmp_path, fake_minimap2):
+        """Is the FASTA mapped against directly when caching is disabled"""
+        result = run_map_consensus(tmp_path, "--minimap2", str(fake_minimap2), "--no_index_cache")
+        assert result.returncode == 0, result.stderr
+        assert [call[-3] for call in minimap2_calls(tmp_path)] == ["16S.fna"]
+        assert not (tmp_path / "cache").exists()
+
+
+def run_batch(tmp_path: Path, *args: str) -> subprocess.CompletedProcess:
+    cmd = [sys.executable, str(SCRIPT), "-r", "16S.fna", "-w", "2", "--index_cache", "cache", *args]
+    return subprocess.run(cmd, cwd=tmp_path, capture_output=True, text=True)
+
+
+class TestBatchMode:
+    @pytest.fixture
+    def reads_dir(self, tmp_path) -> Path:
+        reads_dir = tmp_path / "reads"
+        reads_dir.mkdir()
+        for name in ["A_1.fastq", "A_2.fastq", "B_1.fastq", "B_2.fastq", "C_1.fastq"]:
+            (reads_dir / name).write_text("")
+        return reads_dir
+
+    def test_discover_pairs(self, reads_dir):
+        """Are _1/_2 pairs found and unpaired files skipped"""
+        sys.path.insert(0, str(SCRIPT.parent))
+        from map_consensus import discover_pairs
+        assert discover_pairs(reads_dir) == [
+            ("A", str(reads_dir / "A_1.fastq"), str(reads_dir / "A_2.fastq")),
+            ("B", str(reads_dir / "B_1.fastq"), str(reads_dir / "B_2.fastq")),
+        ]
+
+    def test_batch_reads_dir(self, tmp_path, reads_dir, fake_minimap2):
+        """Is one multi-FASTA and a status table written for a reads directory"""
+        result = run_batch(tmp_path, "--reads_dir", str(reads_dir), "--minimap2", str(fake_minimap2), "--status", "status.tsv")
+        assert result.returncode == 0, result.stderr
+        assert len([call for call in minimap2_calls(tmp_path) if "-d" in call]) == 1
+        headers = [line for line in result.stdout.splitlines() if line.startswith(">")]
+        assert headers == [">A_best_mapping_consensus", ">B_best_mapping_consensus"]
+
+        status = [line.split("\t") for line in (tmp_path / "status.tsv").read_text().splitlines()]
+        assert status[0] == ["sample", "status", "consensus_length", "seconds"]
+        assert [(row[0], row[1]) for row in status[1:]] == [("A", "ok"), ("B", "ok")]
+
+    def test_batch_sample_sheet(self, tmp_path, reads_dir, fake_minimap2):
+        """Are samples read from a sheet and failures reported per sample"""
+        (tmp_path / "samples.tsv").write_text("# sample\tread1\tread2\nA\treads/A_1.fastq\treads/A_2.fastq\n")
+        result = run_batch(tmp_path, "--samples", "samples.tsv", "--minimap2", str(fake_minimap2), "-s", "Missing_ref")
+        assert result.returncode == 1
+        assert result.stdout == ""
+        assert "A\terror: No consensus found for sequence Missing_ref" in result.stderr
+
+    def test_bad_sample_sheet(self, tmp_path, reads_dir, fake_minimap2):
+        """Is a sheet line without three fields reported by its line number"""
+        (tmp_path / "samples.tsv").write_text("A\treads/A_1.fastq\treads/A_2.fastq\nB\treads/B_1.fastq\n")
+        result = run_batch(tmp_path, "--samples", "samples.tsv", "--minimap2", str(fake_minimap2))
+        assert result.returncode == 1
+        assert "samples.tsv line 2" in result.stderr
+        assert "Traceback" not in result.stderr
+
+    def test_write_failure_per_sample(self, tmp_path, reads_dir, fake_minimap2):
+        """Does a SAM that can't be written fail only its own sample"""
+        (tmp_path / "A_1_vs_16S.sam").mkdir()
+        result = run_batch(tmp_path, "--reads_dir", str(reads_dir), "--minimap2", str(fake_minimap2), "--keep-sam")
+        assert result.returncode == 0, result.stderr
+        status = dict(line.split("\t")[:2] for line in result.stderr.splitlines()[1:])
+        assert status["A"].startswith("error:") and status["B"] == "ok"
+
+
+class TestWeightedConsensus:
+    def test_fastq_output(self, tmp_path, fake_minimap2):
+        """Is the quality-weighted consensus written as FASTQ"""
+        result = run_map_consensus(tmp_path, "--minimap2", str(fake_minimap2), "--fastq", "--min_base_qual", "10")
+        assert result.returncode == 0, result.stderr
+        header, seq, plus, qual = result.stdout.splitlines()
+        assert (header, plus) == ("@best_mapping_consensus", "+")
+        sam = SAM.from_sam(test_data.EXAMPLE_SAM)
+        assert (seq, qual) == sam.weighted_consensus(sam.best_reference(), min_base_qual=10)
+
+    def test_filters_need_weighted(self, tmp_path, fake_minimap2):
+        """Are quality filters refused for the plain majority consensus"""
+        result = run_map_consensus(tmp_path, "--minimap2", str(fake_minimap2), "--min_mapq", "20")
+        assert result.returncode == 2
+        assert "--weighted" in result.stderr
@@ -0,0 +1,123 @@
+from . import test_data
+
+from magnumopus.sam import SAM, Read
+from magnumopus.pileup import Pileup, PILEUP_SYMBOLS
+
+
+class TestPileupMatrix:
+    def test_span(self, test_sam):
+        """Does the matrix cover the span of the reference's reads"""
+        pileup = test_sam.pileup_matrix("Ref_seq_ID")
+        assert (pileup.start, pileup.end, len(pileup)) == (1, 13, 12)
+        assert len(pileup.counts) == len(pileup.quals) == 12 * len(PILEUP_SYMBOLS)
+
+    def test_rows(self, test_sam):
+        """Are bases, deletions and qualities counted per position"""
+        pileup = test_sam.pileup_matrix("Ref_seq_ID")
+        assert pileup.row(5) == (2, 0, 0, 0, 0, 1)
+        assert pileup.row(10) == (0, 3, 1, 0, 0, 0)
+        assert pileup.quals[9 * 6 + 1] == 3 * (ord("F") - 33)
+
+    def test_insertions(self, test_sam):
+        """Are reads with an insertion counted under the base plus inserted bases"""
+        pileup = test_sam.pileup_matrix("Ref_seq_ID")
+        assert pileup.row(4) == (0, 0, 0, 3, 0, 0)
+        assert pileup.base_counts(4) == {"T": 1, "TTT": 2}
+
+    def test_base_counts_match_pileup_at_pos(self, example_sam):
+        """Do matrix counts agree with pileup_at_pos"""
+        for ref in ["Fusibacter_paucivorans", "Bacillus_subtilis"]:
+            pileup = example_sam.pileup_matrix(ref)
+            for pos in range(pileup.start, pileup.end, 11):
+                bases, _ = example_sam.pileup_at_pos(ref, pos)
+                expected = {}
+                for base in bases:
+                    expected[base] = expected.get(base, 0) + 1
+                assert pileup.base_counts(pos) == expected
+
+    def test_consensus(self, example_sam):
+        """Does the matrix consensus match SAM.consensus"""
+        for ref in example_sam.references:
+            assert example_sam.pileup_matrix(ref).consensus() == example_sam.consensus(ref)
+
+    def test_depth_and_breadth(self, test_sam):
+        """Are deleted positions excluded from depth"""
+        pileup = test_sam.pileup_matrix("Ref_seq_ID")
+        assert list(pileup.depth()) == [2, 2, 3, 3, 2, 2, 3, 3, 3, 4, 2, 2]
+        assert pileup.breadth() == 12
+
+    def test_empty(self, test_sam):
+        """Is an empty matrix returned for a reference without reads"""
+        pileup = test_sam.pileup_matrix("Other_ref")
+        assert len(pileup) == 0
+        assert pileup.consensus() == ""
+
+    def test_window_clipping(self, test_sam):
+        """Are only bases inside the window counted"""
+        pileup = Pileup(4, 6)
+        pileup.add_reads(test_sam.reads)
+        assert [pileup.row(4), pileup.row(5)] == [(0, 0, 0, 3, 0, 0), (2, 0, 0, 0, 0, 1)]
+
+    def test_lowercase_bases(self):
+        """Are soft-masked bases counted as their uppercase base, and other codes as N, by every path"""
+        sam = SAM()
+        sam.add_reads(Read(test_data.sam_line(name, 0, 1, cigar, seq)) for name, cigar, seq in [
+            ("r1", "4M", "acgT"), ("r2", "4M", "ACGT"), ("r3", "4M", "AcYT"), ("r4", "2M1I2M", "acaGT")])
+        pileup = sam.pileup_matrix("Ref_seq_ID")
+        assert pileup.row(3) == (0, 0, 3, 0, 1, 0)
+        assert pileup.base_counts(2) == {"C": 3, "CA": 1}
+        assert sam.consensus("Ref_seq_ID") == pileup.consensus() == "ACGT"
+        assert sam.consensus_at_pos("Ref_seq_ID", 1) == "A"
+        sam.pileup("Ref_seq_ID")
+        assert sam.consensus("Ref_seq_ID") == "ACGT"
+
+
+def with_qual(line: str, qual: str, mapq: int = 60) -> Read:
+    fields = line.split("\t")
+    fields[4], fields[10] = str(mapq), qual
+    return Read("\t".join(fields))
+
+
+class TestWeightedConsensus:
+    def test_single_read_quality(self):
+        """Does one read give its own base qualities back"""
+        pileup = Pileup(1, 5)
+        pileup.add_reads([with_qual(test_data.sam_line("r", 0, 1, "4M", "ACGT"), "5?I+")])
+        assert pileup.weighted_consensus() == ("ACGT", "5?I+")
+
+    def test_quality_outvotes_count(self):
+        """Do two high quality bases beat three low quality ones that a majority vote picks"""
+        reads = [with_qual(test_data.sam_line(f"low{i}", 0, 1, "1M", "A"), "#") for i in range(3)]
+        reads += [with_qual(test_data.sam_line(f"high{i}", 0, 1, "1M", "C"), "I") for i in range(2)]
+        pileup = Pileup(1, 2)
+        pileup.add_reads(reads)
+        assert pileup.consensus() == "A"
+        seq, qual = pileup.weighted_consensus()
+        assert seq == "C" and 0 < ord(qual) - 33 < 93
+
+    def test_ties_and_gaps(self):
+        """Are equal weights and uncovered positions called N with quality 0"""
+        pileup = Pileup(1, 4)
+        pileup.add_reads([Read(test_data.sam_line("a", 0, 1, "1M", "A")), Read(test_data.sam_line("c", 0, 1, "1M", "C"))])
+        assert pileup.weighted_consensus() == ("NNN", "!!!")
+
+    def test_filters(self):
+        """Are low MAPQ reads and low quality bases left out of the pileup"""
+        reads = [with_qual(test_data.sam_line("low_base", 0, 1, "2M", "AC"), "#I"),
+                 with_qual(test_data.sam_line("low_mapq", 0, 1, "2M", "GG"), "II", mapq=3)]
+        pileup = Pileup(1, 3, min_base_qual=10, min_mapq=20)
+        pileup.add_reads(reads)
+        assert [pileup.row(1), pileup.row(2)] == [(0, 0, 0, 0, 0, 0), (0, 1, 0, 0, 0, 0)]
+        assert pileup.weighted_consensus() == ("NC", "!I")
+
+    def test_insertions(self, test_sam):
+        """Is an insertion supported by most of the quality called with its bases"""
+        seq, qual = test_sam.weighted_consensus("Ref_seq_ID")
+        assert seq.startswith("ACGTTTACGTAC")
+        assert len(seq) == len(qual)
+
+    def test_matches_majority_on_example(self, example_sam):
+        """Does the weighted consensus agree with the majority call wherever one base dominates"""
+        seq, qual = example_sam.weighted_consensus("Bacillus_subtilis")
+        assert seq == example_sam.consensus("Bacillus_subtilis")
+        assert len(qual) == len(seq)
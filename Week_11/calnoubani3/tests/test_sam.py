@@ -0,0 +1,187 @@
+import pytest
+
+from . import test_data
+
+from magnumopus.sam import SAM, Read
+
+
+def slow_consensus(sam: SAM, seq_name: str) -> str:
+    """Position-by-position consensus using consensus_at_pos"""
+    reads = [read for read in sam.reads if read.rname == seq_name]
+    if not reads:
+        return ''
+    start = min(read.pos for read in reads)
+    end = max(read.pos + read.mapped_len for read in reads)
+    return "".join(sam.consensus_at_pos(seq_name, pos) or 'N' for pos in range(start, end))
+
+
+class TestAlignedBlocks:
+    def test_blocks_with_insertion(self):
+        """Does aligned_blocks attach an insertion to the preceding M block"""
+        read = Read(test_data.sam_line("read", 0, 5, "2S4M2I6M", "GGACGTTTACGTCC"))
+        assert read.aligned_blocks() == ((5, 2, 4, 2), (9, 8, 6, 0))
+
+    def test_blocks_with_deletion(self):
+        """Does aligned_blocks skip reference positions in a deletion"""
+        read = Read(test_data.sam_line("read", 0, 3, "2M2D6M", "GTGTACGT"))
+        assert read.aligned_blocks() == ((3, 0, 2, 0), (7, 2, 6, 0))
+
+
+class TestReadIdxAtPos:
+    read = Read(test_data.sam_line("read", 0, 3, "2S2M2I2M2D2M", "GGACTTGTGT"))
+
+    def test_idx_in_block(self):
+        """Are soft clips and insertions skipped when mapping positions to read indices"""
+        assert [self.read.read_idx_at_pos(pos) for pos in (3, 5, 6, 9, 10)] == [[2], [6], [7], [8], [9]]
+
+    def test_idx_before_insertion(self):
+        """Does the base before an insertion include the inserted bases"""
+        assert self.read.read_idx_at_pos(4) == [3, 4, 5]
+        assert self.read.base_at_pos(4) == "CTT"
+
+    def test_idx_outside_read(self):
+        """Are deleted and unmapped positions empty"""
+        assert [self.read.read_idx_at_pos(pos) for pos in (2, 7, 8, 11)] == [[], [], [], []]
+
+
+class TestMappedSeq:
+    def test_mapped_seq(self):
+        """Are soft clips dropped, insertions kept and deletions gapped"""
+        read = Read(test_data.sam_line("read", 0, 3, "2S2M2I2M2D2M", "GGACTTGTGT"))
+        assert read.mapped_seq() == "ACTTGT--GT"
+
+    def test_derived_data_shared_and_bounded(self, tmp_path):
+        """Do views of a read share cached data, with the least recently used evicted"""
+        sam_path = tmp_path / "test.sam"
+        sam_path.write_text(test_data.TEST_SAM)
+        sam = SAM.from_sam(sam_path)
+        sam._store.derived.maxsize = 2
+        assert sam.reads[0].mapped_seq() is sam.reads[0].mapped_seq()
+        for read in sam.reads:
+            read.base_at_pos(read.pos)
+        assert len(sam._store.derived) == 2
+        assert sam._store.derived.get(0) is None
+        assert sam.reads[0].mapped_seq() == "ACGTTTACGTAC"
+
+
+class TestConsensus:
+    def test_consensus(self, test_sam):
+        """Does consensus handle insertions, deletions and ties"""
+        assert test_sam.consensus("Ref_seq_ID") == "ACGTTTACGTACNN"
+
+    def test_consensus_matches_per_position(self, test_sam):
+        """Does the sweep consensus match consensus_at_pos at every position"""
+        assert test_sam.consensus("Ref_seq_ID") == slow_consensus(test_sam, "Ref_seq_ID")
+
+    def test_consensus_no_reads(self, test_sam):
+        """Is an empty string returned for references without reads"""
+        assert test_sam.consensus("Other_ref") == ""
+        assert test_sam.consensus("Missing_ref") == ""
+
+    def test_example_consensus_matches_per_position(self, example_sam):
+        """Does the sweep consensus match consensus_at_pos for the example SAM"""
+        for ref in example_sam.references:
+            assert example_sam.consensus(ref) == slow_consensus(example_sam, ref)
+
+
+class TestReadsAtPos:
+    def test_reads_at_pos_matches_scan(self, example_sam):
+        """Does the indexed reads_at_pos match a linear scan over all reads"""
+        for ref in example_sam.references:
+            for pos in range(1, 1600, 37):
+                expected = [read for read in example_sam.reads if read.rname == ref and read.base_at_pos(pos)]
+                assert example_sam.reads_at_pos(ref, pos) == expected
+
+    def test_reads_at_pos_deletion(self, test_sam):
+        """Are reads with a deletion at the position excluded"""
+        assert [read.qname for read in test_sam.reads_at_pos("Ref_seq_ID", 5)] == ["read_1", "read_2"]
+
+    def test_index_rebuilt_after_append(self, test_sam):
+        """Are reads appended after the first query found by later queries"""
+        assert test_sam.reads_at_pos("Other_ref", 2) == []
+        read = Read(test_data.sam_line("late", 0, 1, "4M", "ACGT", rname="Other_ref"))
+        test_sam.reads.append(read)
+        assert test_sam.reads_at_pos("Other_ref", 2) == [read]
+
+
+class TestStreaming:
+    def test_iter_sam(self, tmp_path):
+        """Are only primary mapped reads yielded"""
+        sam_path = tmp_path / "test.sam"
+        sam_path.write_text(test_data.TEST_SAM)
+        assert [read.qname for read in SAM.iter_sam(sam_path)] == ["read_1", "read_2", "read_3", "read_4"]
+
+    def test_stream_consensus_matches_in_memory(self, tmp_path, example_sam):
+        """Does streaming a coordinate-sorted file give the in-memory consensus"""
+        lines = test_data.EXAMPLE_SAM.read_text().splitlines()
+        header = [line for line in lines if line.startswith("@")]
+        records = sorted((line for line in lines if not line.startswith("@")),
+                         key=lambda line: (line.split("\t")[2], int(line.split("\t")[3])))
+        sam_path = tmp_path / "sorted.sam"
+        sam_path.write_text("\n".join(header + records) + "\n")
+
+        streamed = dict(SAM.stream_consensus(sam_path))
+        assert streamed == {ref: example_sam.consensus(ref) for ref in streamed}
+        assert streamed.keys() == {read.rname for read in example_sam.reads}
+
+    def test_stream_unsorted(self, example_sam):
+        """Is an unsorted file rejected"""
+        with pytest.raises(ValueError):
+            dict(SAM.stream_consensus(test_data.EXAMPLE_SAM))
+
+
+class TestCoverage:
+    def test_coverage(self, test_sam):
+        """Is depth counted over the reference length with deletions uncovered"""
+        depth = test_sam.coverage("Ref_seq_ID")
+        assert len(depth) == 40
+        assert list(depth[:13]) == [2, 2, 3, 3, 2, 2, 3, 3, 3, 4, 2, 2, 0]
+
+    def test_breadth_matches_reads_at_pos(self, example_sam):
+        """Does breadth count the positions reads_at_pos finds reads at"""
+        for ref in example_sam.references:
+            covered = sum(1 for pos in range(1, 1600) if example_sam.reads_at_pos(ref, pos))
+            assert example_sam.breadth(ref) == covered
+
+    def test_no_reads(self, test_sam):
+        """Is coverage empty for a reference without reads"""
+        assert len(test_sam.coverage("Other_ref")) == 0
+        assert test_sam.breadth("Other_ref") == 0
+
+    def test_best_consensus(self, example_sam):
+        """Is the best covered reference's consensus returned"""
+        best = max(example_sam.references, key=example_sam.breadth)
+        assert example_sam.best_consensus() == example_sam.consensus(best)
+
+
+class TestConsensusAll:
+    def test_matches_serial(self, example_sam):
+        """Does parallel consensus_all match per-reference consensus and breadth"""
+        results = example_sam.consensus_all(workers=2)
+        assert results.keys() == example_sam.references
+        for ref, result in results.items():
+            assert result["consensus"] == example_sam.consensus(ref)
+            assert result["breadth"] == example_sam.breadth(ref)
+            assert result["reads"] == sum(1 for read in example_sam.reads if read.rname == ref)
+
+    def test_serial_and_parallel_agree(self, example_sam):
+        """Do one and several workers give the same results"""
+        assert example_sam.consensus_all(workers=1) == example_sam.consensus_all(workers=3)
+
+    def test_empty_reference(self, test_sam):
+        """Are references without reads reported empty"""
+        results = test_sam.consensus_all()
+        assert results["Other_ref"] == {"consensus": "", "reads": 0, "breadth": 0, "mean_depth": 0.0}
+        assert results["Ref_seq_ID"]["mean_depth"] == sum(test_sam.coverage("Ref_seq_ID")) / 40
+
+
+class TestTiledConsensus:
+    def test_tiles_match_serial(self, example_sam):
+        """Is tiled consensus identical to the serial consensus"""
+        for ref in ["Fusibacter_paucivorans", "Bacillus_subtilis", "Synechococcus_elongatus"]:
+            assert example_sam.consensus(ref, workers=2, tile_size=97) == example_sam.consensus(ref)
+
+    def test_insertion_at_tile_edge(self, test_sam):
+        """Are insertions anchored to a tile's last base kept when tiles are tiny"""
+        for tile_size in (1, 2, 3, 4):
+            assert test_sam.consensus("Ref_seq_ID", workers=2, tile_size=tile_size) == "ACGTTTACGTACNN"
@@ -0,0 +1,114 @@
+import pytest
+
+from . import test_data
+
+from magnumopus.sam import SAM, Read
+from magnumopus.store import LRUCache, ReadStore, pack_seq, pack_seqs, unpack_seq
+
+
+class TestPackedSeq:
+    def test_round_trip(self):
+        """Do sequences of every length survive 2-bit packing"""
+        for seq in ["", "A", "ACG", "ACGT", "TTGCA", "GATTACA" * 20]:
+            packed, exceptions = pack_seq(seq)
+            assert len(packed) == (len(seq) + 3) // 4
+            assert unpack_seq(packed, len(seq), exceptions) == seq
+
+    def test_non_acgt_exceptions(self):
+        """Are N and missing sequences restored from exceptions"""
+        for seq in ["ACNNGT", "N", "*"]:
+            packed, exceptions = pack_seq(seq)
+            assert exceptions
+            assert unpack_seq(packed, len(seq), exceptions) == seq
+
+
+    def test_pack_many(self):
+        """Does packing sequences together match packing each one"""
+        seqs = ["", "A", "ACGTN", "*", "GATTACA" * 3, "TTG"]
+        packed, sizes, exceptions = pack_seqs(seqs)
+        assert (packed, sizes, exceptions) == (
+            b"".join(pack_seq(seq)[0] for seq in seqs),
+            [len(pack_seq(seq)[0]) for seq in seqs],
+            [pack_seq(seq)[1] for seq in seqs],
+        )
+
+
+class TestReadStore:
+    def test_fields_round_trip(self):
+        """Does a stored record give back its SAM columns"""
+        store = ReadStore()
+        for line in test_data.TEST_READS:
+            store.append(line.split("\t"))
+        assert ["\t".join(store.fields(i)) for i in range(len(store))] == test_data.TEST_READS
+
+    def test_extend_lines_matches_append(self):
+        """Are records parsed in bulk stored exactly as when appended one by one"""
+        lines = [line for line in test_data.EXAMPLE_SAM.read_text().splitlines(True) if not line.startswith("@")]
+        one_by_one, bulk = ReadStore(), ReadStore()
+        for line in lines:
+            one_by_one.append_line(line)
+        bulk.extend_lines(lines)
+        assert [bulk.fields(i) for i in range(len(bulk))] == [one_by_one.fields(i) for i in range(len(one_by_one))]
+        assert bulk.mapped_len == one_by_one.mapped_len
+
+    def test_short_line_rejected(self):
+        """Is a record with missing columns an error rather than silently dropped"""
+        with pytest.raises(ValueError):
+            ReadStore().extend_lines([test_data.TEST_READS[0], "read\t0\tref"])
+
+    def test_read_view_attributes(self):
+        """Does a Read keep its attribute API when backed by a store"""
+        read = Read(test_data.TEST_READS[1])
+        assert (read.qname, read.flag, read.pos, read.cigar) == ("read_2", 163, 1, "2S4M2I6M")
+        assert read.cigar_bits == ((2, "S"), (4, "M"), (2, "I"), (6, "M"))
+        assert read.mapped_len == 10
+        assert read.seq == "GGACGTTTACGTCC"
+        assert read.tags == ["NM:i:0"]
+
+    def test_sam_reads_share_store(self, tmp_path):
+        """Are SAM reads views over the SAM's store rather than copies"""
+        sam_path = tmp_path / "test.sam"
+        sam_path.write_text(test_data.TEST_SAM)
+        sam = SAM.from_sam(sam_path)
+        assert len(sam.reads) == 4
+        assert all(read._store is sam._store for read in sam.reads)
+        assert [read.qname for read in sam.reads] == ["read_1", "read_2", "read_3", "read_4"]
+
+
+    def test_reads_extend(self, test_sam):
+        """Can reads be extended like a list, but not replaced"""
+        test_sam.reads.extend([Read(test_data.TEST_READS[0]), Read(test_data.TEST_READS[3])])
+        assert [read.qname for read in test_sam.reads[-2:]] == ["read_1", "read_4"]
+        with pytest.raises(AttributeError):
+            test_sam.reads = []
+
+    def test_filter_reads(self, test_sam):
+        """Does filter_reads give a SAM holding only the kept reads"""
+        kept = test_sam.filter_reads(lambda read: read.pos < 5)
+        assert [read.qname for read in kept.reads] == ["read_1", "read_2", "read_3"]
+        assert kept.ref_lengths == test_sam.ref_lengths
+        assert kept.consensus("Ref_seq_ID") == SAM.from_stream([*test_data.HEADER.splitlines(), *map(str, kept.reads)]).consensus("Ref_seq_ID")
+        assert len(test_sam.reads) == 4
+
+
+class TestTake:
+    def test_take_copies_records(self):
+        """Does take copy the selected records in order"""
+        store = ReadStore()
+        for line in test_data.TEST_READS:
+            store.append(line.split("\t"))
+        subset = store.take([3, 0])
+        assert len(subset) == 2
+        assert ["\t".join(subset.fields(i)) for i in range(2)] == [test_data.TEST_READS[3], test_data.TEST_READS[0]]
+
+
+class TestLRUCache:
+    def test_evicts_least_recently_used(self):
+        """Is the entry used longest ago dropped once full"""
+        cache = LRUCache(2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        assert cache.get("a") == 1
+        cache.put("c", 3)
+        assert (cache.get("a"), cache.get("b"), cache.get("c")) == (1, None, 3)
+        assert len(cache) == 2
@@ -0,0 +1,100 @@
+from array import array
+
+import pytest
+
+from . import test_data
+
+from magnumopus.sam import SAM, Read
+from magnumopus.tags import parse_tags
+
+
+def tagged_line(qname: str, pos: int, tags: str) -> str:
+    return test_data.sam_line(qname, 0, pos, "4M", "ACGT").replace("NM:i:0", tags)
+
+
+class TestParseTags:
+    def test_types(self):
+        """Are tags converted to int, float, str and typed arrays"""
+        tags = parse_tags("NM:i:2\tde:f:0.25\ttp:A:P\tcs:Z::4\tML:B:C,1,255\tXB:B:f,1.5,-2")
+        assert tags == {"NM": 2, "de": 0.25, "tp": "P", "cs": ":4",
+                        "ML": array("B", [1, 255]), "XB": array("f", [1.5, -2])}
+
+    def test_read_tag(self):
+        """Does Read.tag return the typed value, or the default when missing"""
+        read = Read(tagged_line("r", 1, "NM:i:3\tAS:i:-20"))
+        assert read.tag("AS") == -20
+        assert read.tag("MD") is None
+        assert read.tag("MD", "") == ""
+
+
+class TestTagColumn:
+    def test_example_nm(self, example_sam):
+        """Does the NM column agree with each read's own tags"""
+        column = example_sam.tag_column("NM")
+        assert column.tag_type == "i"
+        assert isinstance(column.values, array)
+        assert list(map(column.__getitem__, range(len(column)))) == [read.tag("NM") for read in example_sam.reads]
+
+    def test_missing_and_boundaries(self):
+        """Are reads lacking the tag None, and is a tag name inside another value not matched"""
+        sam = SAM()
+        sam.add_reads([Read(tagged_line("a", 1, "AS:i:5")),
+                       Read(tagged_line("b", 2, "XA:Z:AS:i:9")),
+                       Read(tagged_line("c", 3, "NM:i:1\tAS:i:7"))])
+        column = sam.tag_column("AS")
+        assert [column[i] for i in range(3)] == [5, None, 7]
+
+    def test_extends_with_new_reads(self):
+        """Is a cached column extended when reads are added"""
+        sam = SAM()
+        sam.add_reads([Read(tagged_line("a", 1, "NM:i:1"))])
+        assert len(sam.tag_column("NM")) == 1
+        sam.add_reads([Read(tagged_line("b", 2, "NM:i:4"))])
+        column = sam.tag_column("NM")
+        assert column is sam.tag_column("NM")
+        assert [column[0], column[1]] == [1, 4]
+
+    def test_mixed_types(self):
+        """Is a tag with conflicting types rejected"""
+        sam = SAM()
+        sam.add_reads([Read(tagged_line("a", 1, "XX:i:1")), Read(tagged_line("b", 2, "XX:Z:one"))])
+        with pytest.raises(ValueError):
+            sam.tag_column("XX")
+
+
+class TestTagFilter:
+    def test_conditions(self):
+        """Are reads kept only when every condition holds and the tags are present"""
+        sam = SAM()
+        sam.add_reads([Read(tagged_line("a", 1, "NM:i:0\tAS:i:120")),
+                       Read(tagged_line("b", 2, "NM:i:3\tAS:i:150")),
+                       Read(tagged_line("c", 3, "NM:i:1\tAS:i:90")),
+                       Read(tagged_line("d", 4, "NM:i:2"))])
+        assert [read.qname for read in sam.tag_filter("NM <= 2 and AS >= 100")] == ["a"]
+        assert [read.qname for read in sam.tag_filter("NM <= 2", "AS>=90")] == ["a", "c"]
+        assert [read.qname for read in sam.tag_filter("NM != 0")] == ["b", "c", "d"]
+
+    def test_missing_tags(self, example_sam):
+        """Do reads lacking a tag fail its conditions, even when no read has it"""
+        assert example_sam.tag_filter("XS <= 2") == []
+        sam = SAM()
+        sam.add_reads([Read(tagged_line("a", 1, "tp:A:P")),
+                       Read(tagged_line("b", 2, "NM:i:1")),
+                       Read(tagged_line("c", 3, "tp:A:S"))])
+        assert [read.qname for read in sam.tag_filter("tp < Q")] == ["a"]
+        assert [read.qname for read in sam.tag_filter("tp > A")] == ["a", "c"]
+
+    def test_value_types(self):
+        """Are integer tags compared numerically with any number, and array tags refused"""
+        sam = SAM()
+        sam.add_reads([Read(tagged_line("a", 1, "NM:i:2\tML:B:C,1,2")), Read(tagged_line("b", 2, "NM:i:3"))])
+        assert [read.qname for read in sam.tag_filter("NM <= 2.5")] == ["a"]
+        with pytest.raises(ValueError, match="NM"):
+            sam.tag_filter("NM <= two")
+        with pytest.raises(ValueError, match="ML"):
+            sam.tag_filter("ML > 1")
+
+    def test_bad_condition(self, example_sam):
+        """Is an unparseable condition rejected"""
+        with pytest.raises(ValueError):
+            example_sam.tag_filter("NM is small")
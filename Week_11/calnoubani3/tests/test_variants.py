@@ -0,0 +1,115 @@
+import pytest
+
+from . import test_data
+
+from magnumopus.reference import ReferenceFasta
+from magnumopus.sam import SAM, Read
+from magnumopus.variants import md_reference, vcf_header
+
+REFERENCE = "ACGTACGTACGTAC"
+# MD tags of the primary TEST_READS against REFERENCE
+MD_TAGS = ["MD:Z:10", "MD:Z:8A1", "MD:Z:2^AC6", "MD:Z:0C0G0T0"]
+EXPECTED = [(4, "T", "TTT"), (4, "TAC", "T"), (9, "A", "C"), (10, "C", "G"), (11, "G", "A"), (12, "T", "C")]
+
+
+@pytest.fixture
+def fasta_path(tmp_path):
+    path = tmp_path / "ref.fna"
+    path.write_text(f">Other\nTTTT\n>Ref_seq_ID test reference\n{REFERENCE[:6].lower()}\n{REFERENCE[6:12]}\n{REFERENCE[12:]}\n")
+    return path
+
+
+def md_sam() -> SAM:
+    sam = SAM()
+    sam.add_reads(Read(line.replace("NM:i:0", md)) for line, md in zip(test_data.TEST_READS, MD_TAGS))
+    return sam
+
+
+class TestReferenceFasta:
+    def test_fetch(self, fasta_path):
+        """Are bases sliced across wrapped lines, uppercased and clipped to the sequence"""
+        with ReferenceFasta(fasta_path) as fasta:
+            assert fasta.length("Ref_seq_ID") == len(REFERENCE)
+            assert fasta.fetch("Ref_seq_ID", 1, 14) == REFERENCE
+            assert fasta.fetch("Ref_seq_ID", 5, 8) == REFERENCE[4:8]
+            assert fasta.fetch("Ref_seq_ID", 0, 100) == REFERENCE
+            assert fasta.fetch("Other", 2, 3) == "TT"
+
+    def test_irregular_lines(self, tmp_path):
+        """Is a FASTA whose lines can't be indexed by offset rejected"""
+        path = tmp_path / "bad.fna"
+        path.write_text(">seq\nACG\nACGTA\nAC\n")
+        with pytest.raises(ValueError):
+            ReferenceFasta(path)
+
+    def test_missing(self, tmp_path, fasta_path):
+        """Are an unknown sequence and an empty file reported by name"""
+        with ReferenceFasta(fasta_path) as fasta:
+            with pytest.raises(ValueError, match="Missing not found"):
+                fasta.fetch("Missing", 1, 2)
+            with pytest.raises(ValueError, match="Missing not found"):
+                fasta.length("Missing")
+        path = tmp_path / "empty.fna"
+        path.write_text("")
+        with pytest.raises(ValueError, match="empty"):
+            ReferenceFasta(path)
+
+
+class TestVariants:
+    def test_from_fasta(self, test_sam, fasta_path):
+        """Are SNVs, an insertion and a deletion called against the FASTA in position order"""
+        variants = list(test_sam.variants("Ref_seq_ID", fasta_path))
+        assert [(v.pos, v.ref, v.alt) for v in variants] == EXPECTED
+        assert [v.kind for v in variants] == ["INS", "DEL", "SNV", "SNV", "SNV", "SNV"]
+        assert [(v.depth, v.alt_count) for v in variants] == [(3, 2), (3, 1), (3, 1), (4, 1), (2, 1), (2, 1)]
+
+    def test_thresholds(self, test_sam, fasta_path):
+        """Do min_af and min_depth drop minor alleles and shallow sites"""
+        with ReferenceFasta(fasta_path) as fasta:
+            assert [v.pos for v in test_sam.variants("Ref_seq_ID", fasta, min_af=0.5)] == [4, 11, 12]
+            assert [v.pos for v in test_sam.variants("Ref_seq_ID", fasta, min_depth=3)] == [4, 4, 9, 10]
+
+    def test_md_reference(self):
+        """Is the reference rebuilt from MD tags, including deleted bases"""
+        sam = md_sam()
+        assert md_reference(sam.reads, 1, 14) == REFERENCE[:12] + "N"
+
+    def test_from_md_tags(self):
+        """Without a FASTA, are the same variants called from MD tags"""
+        variants = md_sam().variants("Ref_seq_ID")
+        assert [(v.pos, v.ref, v.alt) for v in variants] == EXPECTED
+
+    def test_no_md_tags(self, example_sam):
+        """Without a FASTA or MD tags, is calling refused rather than reporting N alleles"""
+        with pytest.raises(ValueError):
+            list(example_sam.variants("Bacillus_subtilis"))
+
+    def test_saved_pileups_need_fasta(self, test_sam, fasta_path, tmp_path):
+        """Are variants of saved pileups called against a FASTA, and refused without one"""
+        pileup_file = tmp_path / "pileups.json"
+        test_sam.save_pileups(pileup_file)
+        saved = SAM.from_pileups(pileup_file)
+        assert [(v.pos, v.ref, v.alt) for v in saved.variants("Ref_seq_ID", fasta_path)] == EXPECTED
+        with pytest.raises(ValueError, match="reference FASTA"):
+            list(saved.variants("Ref_seq_ID"))
+
+    def test_unknown_reference_skipped(self):
+        """Are no records reported where the rebuilt reference is unknown"""
+        sam = md_sam()
+        sam.add_reads([Read(test_data.TEST_READS[2])])  # the deletion again, without MD
+        sam.add_reads([Read(test_data.sam_line("far", 0, 20, "2M3D2M", "ACGT"))])
+        variants = list(sam.variants("Ref_seq_ID"))
+        assert all("N" not in v.ref for v in variants)
+        assert not [v for v in variants if v.pos >= 14]
+
+    def test_live_pileup_left_alone(self, test_sam, fasta_path):
+        """Is no live pileup left behind, so later reads still count towards consensus"""
+        list(test_sam.variants("Ref_seq_ID", fasta_path))
+        assert not test_sam._pileups
+
+    def test_vcf(self, test_sam, fasta_path):
+        """Are records written as VCF lines under a matching header"""
+        header = vcf_header({"Ref_seq_ID": len(REFERENCE)})
+        assert header.splitlines()[-1].startswith("#CHROM\tPOS")
+        line = next(test_sam.variants("Ref_seq_ID", fasta_path)).vcf_line()
+        assert line == "Ref_seq_ID\t4\t.\tT\tTTT\t.\tPASS\tDP=3;AO=2;AF=0.6667;TYPE=INS"
@@ -1,51 +1,207 @@
-#!/usr/bin/env python3
-
-import argparse
-from magnumopus import ispcr, needleman_wunsch
-
-# Compute reverse complement
-def reverse_complement(sequence: str) -> str:
-    complement = {'A': 'T', 'T': 'A', 'C': 'G', 'G': 'C'}
-    return ''.join(complement.get(base, base) for base in reversed(sequence))
-
-# Clean sequence of headers
-def clean_sequence(sequence: str) -> str:
-    return "".join(line for line in sequence.splitlines() if not line.startswith(">"))
-
-def main():
-    # Set up command-line arguments
-    parser = argparse.ArgumentParser(description="Perform in-silico PCR on two assemblies and align the amplicons.")
-    parser.add_argument("-1", "--assembly1", required=True, help="Path to the first assembly file")
-    parser.add_argument("-2", "--assembly2", required=True, help="Path to the second assembly file")
-    parser.add_argument("-p", "--primers", required=True, help="Path to the primer file")
-    parser.add_argument("-m", "--max_amplicon_size", type=int, required=True, help="Maximum amplicon size for isPCR")
-    parser.add_argument("--match", type=int, required=True, help="Match score to use in alignment")
-    parser.add_argument("--mismatch", type=int, required=True, help="Mismatch penalty to use in alignment")
-    parser.add_argument("--gap", type=int, required=True, help="Gap penalty to use in alignment")
-    args = parser.parse_args()
-
-    # Perform isPCR on both assemblies
-    amplicon1 = clean_sequence(ispcr(args.primers, args.assembly1, args.max_amplicon_size))
-    amplicon2 = clean_sequence(ispcr(args.primers, args.assembly2, args.max_amplicon_size))
-    
-    # Check both orientations for the best alignment
-    forward_aln, forward_score = needleman_wunsch(amplicon1, amplicon2, args.match, args.mismatch, args.gap)
-    rev_comp_amplicon2 = reverse_complement(amplicon2)
-    reverse_aln, reverse_score = needleman_wunsch(amplicon1, rev_comp_amplicon2, args.match, args.mismatch, args.gap)
-
-    # Choose best alignment based on score
-    if forward_score >= reverse_score:
-        best_alignment, best_score = forward_aln, forward_score
-    else:
-        best_alignment, best_score = reverse_aln, reverse_score
-
-    # Print alignment & score
-    print(">Assembly 1 Amplicon Alignment")
-    print(best_alignment[0])
-    print("\n>Assembly 2 Amplicon Alignment (or Reverse Complement)")
-    print(best_alignment[1])
-    print(f"\nAlignment Score: {best_score}")
-
-if __name__ == "__main__":
-    main()
-
+#!/usr/bin/env python3
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import combinations
+from pathlib import Path
+from magnumopus import ispcr, needleman_wunsch, needleman_wunsch_score
+
+# Compute reverse complement
+def reverse_complement(sequence: str) -> str:
+    complement = {'A': 'T', 'T': 'A', 'C': 'G', 'G': 'C'}
+    return ''.join(complement.get(base, base) for base in reversed(sequence))
+
+# Clean sequence of headers
+def clean_sequence(sequence: str) -> str:
+    return "".join(line for line in sequence.splitlines() if not line.startswith(">"))
+
+def parse_args(args: list[str] = None) -> argparse.Namespace:
+    # Set up command-line arguments
+    parser = argparse.ArgumentParser(description="Perform in-silico PCR on two assemblies and align the amplicons, "
+                                                 "or on many assemblies and compute all pairwise distances.")
+    parser.add_argument("-1", "--assembly1", help="Path to the first assembly file")
+    parser.add_argument("-2", "--assembly2", help="Path to the second assembly file")
+    parser.add_argument("-p", "--primers", required=True, help="Path to the primer file")
+    parser.add_argument("-m", "--max_amplicon_size", type=int, required=True, help="Maximum amplicon size for isPCR")
+    parser.add_argument("--match", type=int, required=True, help="Match score to use in alignment")
+    parser.add_argument("--mismatch", type=int, required=True, help="Mismatch penalty to use in alignment")
+    parser.add_argument("--gap", type=int, required=True, help="Gap penalty to use in alignment")
+    parser.add_argument("--band", type=int, default=None, help="Only align within this many positions of the diagonal (faster for similar amplicons)")
+
+    batch = parser.add_argument_group("batch mode", "Score every pair of many assemblies instead of aligning two")
+    batch.add_argument("-a", "--assemblies", nargs="+", help="Paths to the assembly files to compare all-vs-all")
+    batch.add_argument("-w", "--workers", type=int, default=os.cpu_count(), help="Number of pairs to score at once")
+    batch.add_argument("-f", "--format", choices=["phylip", "tsv"], default="phylip", help="Distance matrix format")
+    batch.add_argument("-o", "--output", default=None, help="File to write the distance matrix to (default: stdout)")
+    batch.add_argument("--cache", default=".amplicon_cache", help="Directory caching pair scores by sequence hash")
+    batch.add_argument("--no_cache", action="store_true", help="Don't read or write the pair score cache")
+    args = parser.parse_args(args)
+
+    if args.assemblies is None and (args.assembly1 is None or args.assembly2 is None):
+        parser.error("either --assembly1 and --assembly2, or --assemblies, are required")
+    if args.assemblies is not None and (args.assembly1 or args.assembly2):
+        parser.error("--assemblies can't be combined with --assembly1/--assembly2")
+    if args.assemblies is not None and len(args.assemblies) < 2:
+        parser.error("--assemblies needs at least two assemblies")
+    return args
+
+# Band covering at least the difference in amplicon lengths, None for no band
+def pair_band(band: int|None, amplicon1: str, amplicon2: str) -> int|None:
+    if band is None:
+        return None
+    return max(band, abs(len(amplicon1) - len(amplicon2)))
+
+# Score both orientations of a pair without traceback
+def score_pair(job: tuple[str, str, int, int, int, int|None]) -> tuple[int, int]:
+    amplicon1, amplicon2, match, mismatch, gap, band = job
+    band = pair_band(band, amplicon1, amplicon2)
+    forward_score = needleman_wunsch_score(amplicon1, amplicon2, match, mismatch, gap, band=band)
+    reverse_score = needleman_wunsch_score(amplicon1, reverse_complement(amplicon2), match, mismatch, gap, band=band)
+    return forward_score, reverse_score
+
+# Cache key of a pair: the best of both orientations doesn't depend on the order of the pair
+def pair_key(amplicon1: str, amplicon2: str, match: int, mismatch: int, gap: int, band: int|None) -> str:
+    hashes = sorted(hashlib.sha256(amplicon.encode()).hexdigest() for amplicon in (amplicon1, amplicon2))
+    return hashlib.sha256(json.dumps([*hashes, match, mismatch, gap, band]).encode()).hexdigest()
+
+def read_cached(cache_dir: Path, key: str) -> int|None:
+    try:
+        with open(cache_dir / key[:2] / f"{key}.json") as f:
+            return json.load(f)["score"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+def write_cached(cache_dir: Path, key: str, score: int):
+    path = cache_dir / key[:2] / f"{key}.json"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # write then rename, so concurrent runs never read a partial file
+    tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+    tmp_path.write_text(json.dumps({"score": score}))
+    os.replace(tmp_path, path)
+
+# Best score of each pair of amplicons, scored in a pool of processes unless cached
+def pairwise_scores(amplicons: list[str], match: int, mismatch: int, gap: int, band: int|None = None,
+                    workers: int = 1, cache_dir: str|None = None) -> dict[tuple[int, int], int]:
+    scores = {}
+    todo = {}
+    cache_path = Path(cache_dir) if cache_dir is not None else None
+    for i, j in combinations(range(len(amplicons)), 2):
+        key = pair_key(amplicons[i], amplicons[j], match, mismatch, gap, band)
+        cached = read_cached(cache_path, key) if cache_path is not None else None
+        if cached is not None:
+            scores[i, j] = cached
+        else:
+            # identical pairs (e.g. duplicate amplicons) are only scored once
+            todo.setdefault(key, []).append((i, j))
+
+    jobs = [(amplicons[pairs[0][0]], amplicons[pairs[0][1]], match, mismatch, gap, band) for pairs in todo.values()]
+    if workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(score_pair, jobs, chunksize=max(1, len(jobs) // (workers * 4))))
+    else:
+        results = list(map(score_pair, jobs))
+
+    for (key, pairs), (forward_score, reverse_score) in zip(todo.items(), results):
+        score = max(forward_score, reverse_score)
+        if cache_path is not None:
+            write_cached(cache_path, key, score)
+        for pair in pairs:
+            scores[pair] = score
+    return scores
+
+# Distance from a score: 1 - score / (score of the longer amplicon against itself), at least 0
+def score_distance(score: int, amplicon1: str, amplicon2: str, match: int) -> float:
+    best_possible = match * max(len(amplicon1), len(amplicon2))
+    if best_possible <= 0:
+        return 0.0
+    return max(0.0, 1 - score / best_possible)
+
+def distance_matrix(amplicons: list[str], scores: dict[tuple[int, int], int], match: int) -> list[list[float]]:
+    matrix = [[0.0] * len(amplicons) for _ in amplicons]
+    for (i, j), score in scores.items():
+        matrix[i][j] = matrix[j][i] = score_distance(score, amplicons[i], amplicons[j], match)
+    return matrix
+
+# Name not in taken, numbering repeats (a_2, a_3, ...) and cutting it to width characters if given
+def unique_name(name: str, taken: list[str], width: int|None = None) -> str:
+    label, n = name[:width], 1
+    while label in taken:
+        n += 1
+        suffix = f"_{n}"
+        label = (name[:width - len(suffix)] if width else name) + suffix
+    return label
+
+# Write distances as a strict PHYLIP square matrix: names cut to 10 characters (numbered
+# if that makes them clash) and padded to fill the 10 columns, full names are in the TSV
+def write_phylip(names: list[str], matrix: list[list[float]], out_file):
+    labels = []
+    for name in names:
+        labels.append(unique_name(name, labels, width=10))
+    print(f"{len(names):>5}", file=out_file)
+    for label, row in zip(labels, matrix):
+        print(f"{label:<10} " + " ".join(f"{distance:.6f}" for distance in row), file=out_file)
+
+# Write distances as a tab-separated matrix with a header row
+def write_tsv(names: list[str], matrix: list[list[float]], out_file):
+    print("\t".join(["", *names]), file=out_file)
+    for name, row in zip(names, matrix):
+        print("\t".join([name, *(f"{distance:.6f}" for distance in row)]), file=out_file)
+
+def run_batch(args: argparse.Namespace):
+    # Perform isPCR once per assembly; blastn runs in its own process, so threads suffice
+    with ThreadPoolExecutor(max_workers=max(1, args.workers)) as executor:
+        results = list(executor.map(lambda assembly: ispcr(args.primers, assembly, args.max_amplicon_size),
+                                    args.assemblies))
+    names, amplicons = [], []
+    for assembly, result in zip(args.assemblies, results):
+        amplicon = clean_sequence(result)
+        if not amplicon:
+            print(f"No amplicon found in {assembly}, leaving it out", file=sys.stderr)
+            continue
+        # assemblies with the same file name in different directories get numbered
+        names.append(unique_name(Path(assembly).stem, names))
+        amplicons.append(amplicon)
+
+    cache_dir = None if args.no_cache else args.cache
+    scores = pairwise_scores(amplicons, args.match, args.mismatch, args.gap, args.band, args.workers, cache_dir)
+    matrix = distance_matrix(amplicons, scores, args.match)
+
+    write = write_phylip if args.format == "phylip" else write_tsv
+    if args.output is None:
+        write(names, matrix, sys.stdout)
+    else:
+        with open(args.output, "w") as out_file:
+            write(names, matrix, out_file)
+
+def main():
+    args = parse_args()
+    if args.assemblies is not None:
+        run_batch(args)
+        return
+
+    # Perform isPCR on both assemblies
+    amplicon1 = clean_sequence(ispcr(args.primers, args.assembly1, args.max_amplicon_size))
+    amplicon2 = clean_sequence(ispcr(args.primers, args.assembly2, args.max_amplicon_size))
+
+    # The band must at least cover the difference in amplicon lengths
+    band = pair_band(args.band, amplicon1, amplicon2)
+
+    # Score both orientations without traceback, then align only the best one
+    rev_comp_amplicon2 = reverse_complement(amplicon2)
+    forward_score, reverse_score = score_pair((amplicon1, amplicon2, args.match, args.mismatch, args.gap, band))
+    best_amplicon2 = amplicon2 if forward_score >= reverse_score else rev_comp_amplicon2
+    best_alignment, best_score = needleman_wunsch(amplicon1, best_amplicon2, args.match, args.mismatch, args.gap, band=band)
+
+    # Print alignment & score
+    print(">Assembly 1 Amplicon Alignment")
+    print(best_alignment[0])
+    print("\n>Assembly 2 Amplicon Alignment (or Reverse Complement)")
+    print(best_alignment[1])
+    print(f"\nAlignment Score: {best_score}")
+
+if __name__ == "__main__":
+    main()
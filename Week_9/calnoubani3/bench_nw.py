@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+
+import argparse
+import random
+import time
+
+from magnumopus.nw import ENGINES, needleman_wunsch
+
+
+def parse_args():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description="Benchmark needleman_wunsch engines on random related sequences")
+    parser.add_argument('-l', '--length', type=int, default=1500, help='Length of the first sequence')
+    parser.add_argument('-d', '--divergence', type=float, default=0.1, help='Share of positions mutated in the second sequence')
+    parser.add_argument('-e', '--engines', nargs='+', default=["rows", "loop", "hirschberg"], choices=ENGINES, help='Engines to time')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed')
+    return parser.parse_args()
+
+
+def related_sequences(length: int, divergence: float, rng: random.Random) -> tuple[str, str]:
+    """Return a random sequence and a copy with substitutions, insertions and deletions"""
+    seq_a = "".join(rng.choice("ACGT") for _ in range(length))
+    seq_b = []
+    for base in seq_a:
+        roll = rng.random()
+        if roll < divergence / 3:
+            seq_b.append(rng.choice("ACGT"))
+        elif roll < divergence * 2 / 3:
+            seq_b.append(base + rng.choice("ACGT"))
+        elif roll >= divergence:
+            seq_b.append(base)
+    return seq_a, "".join(seq_b)
+
+
+def main():
+    args = parse_args()
+    seq_a, seq_b = related_sequences(args.length, args.divergence, random.Random(args.seed))
+    print(f"{len(seq_a)} x {len(seq_b)} bp")
+    print("engine\tseconds\tscore")
+    results = {}
+    for engine in args.engines:
+        start = time.perf_counter()
+        results[engine] = needleman_wunsch(seq_a, seq_b, 1, -1, -1, engine=engine)
+        print(f"{engine}\t{time.perf_counter() - start:.2f}\t{results[engine][1]}")
+    if len({score for _, score in results.values()}) > 1:
+        print("engines disagree on the score")
+
+
+if __name__ == '__main__':
+    main()
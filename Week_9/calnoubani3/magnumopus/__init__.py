@@ -6,4 +6,4 @@ from .ispcr import (
     step_two,
     step_three
 )
-from .nw import needleman_wunsch
+from .nw import gotoh, needleman_wunsch, needleman_wunsch_score
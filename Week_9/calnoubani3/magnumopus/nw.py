@@ -1,50 +1,603 @@
-#!/usr/bin/env python3
-
-def needleman_wunsch(seq_a: str, seq_b: str, match: int, mismatch: int, gap: int) -> tuple[tuple[str, str], int]:
-    # Initialize the scoring matrix
-    n = len(seq_a) + 1
-    m = len(seq_b) + 1
-    score_matrix = [[0] * m for _ in range(n)]
-    
-    # Initialize gap penalties for first row & column
-    for i in range(n):
-        score_matrix[i][0] = i * gap
-    for j in range(m):
-        score_matrix[0][j] = j * gap
-
-    # Fill in the scoring matrix
-    for i in range(1, n):
-        for j in range(1, m):
-            if seq_a[i - 1] == seq_b[j - 1]:
-                diag_score = score_matrix[i - 1][j - 1] + match
-            else:
-                diag_score = score_matrix[i - 1][j - 1] + mismatch
-            up_score = score_matrix[i - 1][j] + gap
-            left_score = score_matrix[i][j - 1] + gap
-            score_matrix[i][j] = max(diag_score, up_score, left_score)
-
-    # Traceback to get the aligned sequences
-    aligned_a, aligned_b = "", ""
-    i, j = len(seq_a), len(seq_b)
-    while i > 0 or j > 0:
-        current_score = score_matrix[i][j]
-        if i > 0 and j > 0 and (
-            (seq_a[i - 1] == seq_b[j - 1] and current_score == score_matrix[i - 1][j - 1] + match) or
-            (seq_a[i - 1] != seq_b[j - 1] and current_score == score_matrix[i - 1][j - 1] + mismatch)
-        ):
-            aligned_a = seq_a[i - 1] + aligned_a
-            aligned_b = seq_b[j - 1] + aligned_b
-            i -= 1
-            j -= 1
-        elif i > 0 and current_score == score_matrix[i - 1][j] + gap:
-            aligned_a = seq_a[i - 1] + aligned_a
-            aligned_b = "-" + aligned_b
-            i -= 1
-        else:
-            aligned_a = "-" + aligned_a
-            aligned_b = seq_b[j - 1] + aligned_b
-            j -= 1
-
-    # Alignment score is the bottom-right cell in the scoring matrix
-    score = score_matrix[-1][-1]
-    return (aligned_a, aligned_b), score
+#!/usr/bin/env python3
+
+import sys
+from array import array
+from collections import deque
+from operator import add
+from typing import Iterator
+
+# Ways to fill the scoring matrix. "rows" and "loop" fill the same full matrix and so
+# give the same alignment; "hirschberg" keeps only a few rows and may pick a different
+# alignment of the same (optimal) score among ties
+ENGINES = ("auto", "rows", "loop", "hirschberg")
+
+# Largest matrix "auto" fills in full, about 4 kb x 4 kb (64 MB of 32-bit cells)
+HIRSCHBERG_CELLS = 1 << 24
+# Hirschberg subproblems at most this size are aligned with a full matrix
+_HIRSCHBERG_BASE_CELLS = 1 << 14
+
+# Lane widths the rows engine packs scores into, with the array typecode to unpack them
+_LANE_TYPECODES = {32: "I", 64: "Q"}
+
+
+def needleman_wunsch(seq_a: str, seq_b: str, match: int, mismatch: int, gap: int,
+                     engine: str = "auto", band: int = None) -> tuple[tuple[str, str], int]:
+    """Globally align two sequences with linear gap penalties
+
+    engine picks how the scoring matrix is filled: "rows" computes a whole row at a
+    time on packed integers, "loop" visits one cell at a time and "hirschberg"
+    divides and conquers in memory linear in the sequence lengths. "auto" uses
+    "rows", or "hirschberg" for matrices over HIRSCHBERG_CELLS cells.
+
+    With band, only cells with |i - j| <= band are filled (by "rows" packed along
+    the diagonal), giving the best alignment that stays within band of it.
+    """
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown engine {engine!r}, expected one of {', '.join(ENGINES)}")
+    if band is not None:
+        if engine not in ("auto", "rows"):
+            raise ValueError(f"band can't be used with the {engine} engine")
+        score_matrix, bias = _score_band(seq_a, seq_b, match, mismatch, gap, band)
+        aligned = _traceback(score_matrix, seq_a, seq_b, match, mismatch, gap)
+        return aligned, score_matrix[len(seq_a)][len(seq_b)] - bias
+
+    if engine == "auto":
+        too_big = (len(seq_a) + 1) * (len(seq_b) + 1) > HIRSCHBERG_CELLS
+        engine = "hirschberg" if too_big else "rows"
+
+    if engine == "hirschberg":
+        aligned = _hirschberg(seq_a, seq_b, match, mismatch, gap)
+        return aligned, _alignment_score(aligned, match, mismatch, gap)
+
+    if engine == "rows":
+        score_matrix, bias = _score_rows(seq_a, seq_b, match, mismatch, gap)
+    else:
+        score_matrix, bias = _score_loop(seq_a, seq_b, match, mismatch, gap), 0
+
+    aligned = _traceback(score_matrix, seq_a, seq_b, match, mismatch, gap)
+
+    # Alignment score is the bottom-right cell in the scoring matrix
+    score = score_matrix[-1][-1] - bias
+    return aligned, score
+
+
+def needleman_wunsch_score(seq_a: str, seq_b: str, match: int, mismatch: int, gap: int, band: int = None) -> int:
+    """Return the global alignment score only, keeping one row of the matrix at a time
+
+    As needleman_wunsch without traceback, so e.g. orientations can be compared before
+    aligning only the best one. With band, only cells with |i - j| <= band count.
+    """
+    if band is None:
+        row, bias = _last_row(seq_a, seq_b, match, mismatch, gap)
+        return row[-1] - bias
+
+    _check_band(seq_a, seq_b, band)
+    width, bias, low = _band_layout(len(seq_a), len(seq_b), match, mismatch, gap)
+    if width is None:
+        row = deque(_loop_band_rows(seq_a, seq_b, match, mismatch, gap, band), maxlen=1)[0]
+        return row[len(seq_b) - len(seq_a) + band]
+    packed = deque(_packed_band_rows(seq_a, seq_b, match, mismatch, gap, band, width, bias, low), maxlen=1)[0]
+    lane = len(seq_b) - len(seq_a) + band
+    return (packed >> lane * width) % (1 << width) - bias
+
+
+def _score_loop(seq_a: str, seq_b: str, match: int, mismatch: int, gap: int) -> list[list[int]]:
+    # Initialize the scoring matrix
+    n = len(seq_a) + 1
+    m = len(seq_b) + 1
+    score_matrix = [[0] * m for _ in range(n)]
+
+    # Initialize gap penalties for first row & column
+    for i in range(n):
+        score_matrix[i][0] = i * gap
+    for j in range(m):
+        score_matrix[0][j] = j * gap
+
+    # Fill in the scoring matrix
+    for i in range(1, n):
+        for j in range(1, m):
+            if seq_a[i - 1] == seq_b[j - 1]:
+                diag_score = score_matrix[i - 1][j - 1] + match
+            else:
+                diag_score = score_matrix[i - 1][j - 1] + mismatch
+            up_score = score_matrix[i - 1][j] + gap
+            left_score = score_matrix[i][j - 1] + gap
+            score_matrix[i][j] = max(diag_score, up_score, left_score)
+
+    return score_matrix
+
+
+def _lanes(values: list[int], width: int) -> int:
+    """Pack non-negative values into one int, value j in bits j*width to (j+1)*width"""
+    lanes = array(_LANE_TYPECODES[width], values)
+    if sys.byteorder == "big":
+        lanes.byteswap()
+    return int.from_bytes(lanes.tobytes(), "little")
+
+
+def _unpack_lanes(packed: int, n_lanes: int, width: int) -> array:
+    lanes = array(_LANE_TYPECODES[width])
+    lanes.frombytes(packed.to_bytes(n_lanes * width // 8, "little"))
+    if sys.byteorder == "big":
+        lanes.byteswap()
+    return lanes
+
+
+def _lane_masks(n_lanes: int, width: int) -> tuple[int, int, int]:
+    """Return (full, guard, top) for rows of n_lanes lanes: a mask of every lane's
+    bits, a mask of each lane's top (guard) bit, and that bit's index in a lane
+
+    Values are kept below the guard bit, so comparisons can borrow from it.
+    """
+    return (1 << n_lanes * width) - 1, _lanes([1 << (width - 1)] * n_lanes, width), width - 1
+
+
+def _lane_ge(x: int, y: int, guard: int, top: int) -> int:
+    """Return lanes of 1 where x >= y, else 0"""
+    return (((x | guard) - y) & guard) >> top  # guard bit stays set in lanes where x >= y
+
+
+def _lane_select(flags: int, x: int, y: int, top: int) -> int:
+    """Return lanes of x where flags is 1, else of y"""
+    mask = (flags << top) - flags
+    return y ^ ((x ^ y) & mask)
+
+
+def _lane_max(x: int, y: int, guard: int, top: int) -> int:
+    """Return the lane-wise maximum of x and y (_lane_select of _lane_ge, inlined)"""
+    over = ((x | guard) - y) & guard
+    mask = over - (over >> top)
+    return y ^ ((x ^ y) & mask)
+
+
+def _lane_offsets(score: int, n_lanes: int, width: int) -> tuple[int, int]:
+    """Return lanes of max(score, 0) and of max(-score, 0), to add a signed score to
+    every lane as (x + up) - down without a lane going negative"""
+    return _lanes([max(score, 0)] * n_lanes, width), _lanes([max(-score, 0)] * n_lanes, width)
+
+
+def _gap_ramp(gap: int, n_lanes: int, width: int) -> int:
+    """Return the lanes _left_max adds so that best[k] - k * gap stays non-negative"""
+    return _lanes([(n_lanes - 1 - j) * max(gap, 0) + j * max(-gap, 0) for j in range(n_lanes)], width)
+
+
+def _left_max(best: int, ramp: int, full: int, width: int, guard: int, top: int) -> int:
+    """Return lanes of max(best[k] + (j - k) * gap for k <= j), the best of a chain of
+    left moves, as a running maximum of best[k] - k * gap computed by doubling shifts"""
+    running = best + ramp
+    shift = width
+    while shift < full.bit_length():
+        running = _lane_max(running, (running << shift) & full, guard, top)
+        shift <<= 1
+    return running - ramp
+
+
+def _lane_layout(n: int, m: int, match: int, mismatch: int, gap: int) -> tuple[int, int]:
+    """Return (lane width, bias) to pack rows of an n x m alignment, width None if
+    the scores aren't integers or can't fit in 64-bit lanes"""
+    if not all(isinstance(score, int) for score in (match, mismatch, gap)):
+        return None, 0
+    # |score| <= (n + m) * step, and intermediate values are at most four times that
+    step = max(abs(match), abs(mismatch), abs(gap), 1)
+    bias = (n + m + 1) * step
+    width = next((width for width in _LANE_TYPECODES if 4 * bias < 1 << (width - 1)), None)
+    return width, bias
+
+
+def _packed_rows(seq_a: str, seq_b: str, match: int, mismatch: int, gap: int, width: int, bias: int) -> Iterator[int]:
+    """Yield each row of the scoring matrix packed into an int, offset by bias
+
+    Each row is packed into one Python int with a fixed-width lane per cell, so the
+    additions and maxima of a whole row are a handful of big-int operations (SWAR):
+    a lane-wise max compares lanes through a guard bit kept clear above each value.
+    Cell (i, j) takes the best of the diagonal and up moves, then the left moves:
+    a chain of left moves from cell k adds (j - k) * gap (see _left_max).
+    """
+    m = len(seq_b)
+    n_lanes = m + 1
+    step = max(abs(match), abs(mismatch), abs(gap), 1)
+    full, guard, top = _lane_masks(n_lanes, width)
+
+    # substitution scores offset by step so they are non-negative, lane 0 unused
+    subst = {char: _lanes([0] + [(match if char == base else mismatch) + step for base in seq_b], width)
+             for char in set(seq_a)}
+    subst_bias = _lanes([0] + [step] * m, width)
+    gap_up, gap_down = _lane_offsets(gap, n_lanes, width)
+    ramp = _gap_ramp(gap, n_lanes, width)
+
+    # First row is gap penalties only, and each later row depends on the one before
+    row = _lanes([bias + j * gap for j in range(n_lanes)], width)
+    yield row
+    for i, char in enumerate(seq_a, 1):
+        diag = (((row << width) & full) + subst[char]) - subst_bias
+        up = (row + gap_up) - gap_down
+        best = _lane_max(diag, up, guard, top) >> width << width | (bias + i * gap)
+        row = _left_max(best, ramp, full, width, guard, top)
+        yield row
+
+
+def _score_rows(seq_a: str, seq_b: str, match: int, mismatch: int, gap: int) -> tuple[list[array], int]:
+    """Fill the scoring matrix a row at a time, returning the rows (all offset by
+    a bias so they are non-negative) and the bias"""
+    width, bias = _lane_layout(len(seq_a), len(seq_b), match, mismatch, gap)
+    if width is None:
+        return _score_loop(seq_a, seq_b, match, mismatch, gap), 0
+    n_lanes = len(seq_b) + 1
+    rows = _packed_rows(seq_a, seq_b, match, mismatch, gap, width, bias)
+    return [_unpack_lanes(row, n_lanes, width) for row in rows], bias
+
+
+def _last_row(seq_a: str, seq_b: str, match: int, mismatch: int, gap: int) -> tuple[list[int]|array, int]:
+    """Return the last row of the scoring matrix and the bias it is offset by,
+    keeping one row at a time"""
+    width, bias = _lane_layout(len(seq_a), len(seq_b), match, mismatch, gap)
+    if width is not None:
+        row, = deque(_packed_rows(seq_a, seq_b, match, mismatch, gap, width, bias), maxlen=1)
+        return _unpack_lanes(row, len(seq_b) + 1, width), bias
+
+    row = [j * gap for j in range(len(seq_b) + 1)]
+    for i, char in enumerate(seq_a, 1):
+        prev, row = row, [i * gap]
+        for j, base in enumerate(seq_b, 1):
+            diag_score = prev[j - 1] + (match if char == base else mismatch)
+            row.append(max(diag_score, prev[j] + gap, row[j - 1] + gap))
+    return row, 0
+
+
+class _BandMatrix:
+    """Scoring matrix rows stored along the band, indexed as score_matrix[i][j]
+
+    Row i holds columns i - band to i + band; cells outside the band or the matrix
+    read as low, which is below any score reachable inside it.
+    """
+    def __init__(self, rows: list, band: int, low: int|float):
+        self.rows: list = rows
+        self.band: int = band
+        self.low: int|float = low
+
+    def __getitem__(self, i: int) -> '_BandRow':
+        return _BandRow(self.rows[i], i - self.band, self.low)
+
+
+class _BandRow:
+    def __init__(self, row, first: int, low: int|float):
+        self.row = row
+        self.first: int = first
+        self.low: int|float = low
+
+    def __getitem__(self, j: int) -> int|float:
+        lane = j - self.first
+        return self.row[lane] if 0 <= lane < len(self.row) else self.low
+
+
+def _check_band(seq_a: str, seq_b: str, band: int):
+    if band < 0 or abs(len(seq_a) - len(seq_b)) > band:
+        raise ValueError(f"band {band} can't reach the end of a {len(seq_a)} x {len(seq_b)} alignment")
+
+
+def _band_layout(n: int, m: int, match: int, mismatch: int, gap: int) -> tuple[int, int, int]:
+    """Return (lane width, bias, low) to pack band rows of an n x m alignment, width
+    None if the scores aren't integers or can't fit in 64-bit lanes
+
+    Cells outside the band hold low, which stays non-negative after one move and
+    below every score inside the band after any number of moves within a row.
+    """
+    if not all(isinstance(score, int) for score in (match, mismatch, gap)):
+        return None, 0, 0
+    step = max(abs(match), abs(mismatch), abs(gap), 1)
+    bias = (2 * (n + m) + 8) * step
+    width = next((width for width in _LANE_TYPECODES if 4 * bias < 1 << (width - 1)), None)
+    return width, bias, step
+
+
+def _packed_band_rows(seq_a: str, seq_b: str, match: int, mismatch: int, gap: int, band: int,
+                      width: int, bias: int, low: int) -> Iterator[int]:
+    """Yield each row of the banded scoring matrix packed into an int, offset by bias
+
+    Lane d of row i is column j = i - band + d, so the diagonal move stays in lane d,
+    the up move comes from lane d + 1 and the left move from lane d - 1; each row
+    has 2 * band + 1 lanes however long the sequences are. See _packed_rows.
+    """
+    n, m = len(seq_a), len(seq_b)
+    n_lanes = 2 * band + 1
+    step = max(abs(match), abs(mismatch), abs(gap), 1)
+
+    lane_full = (1 << width) - 1
+    full, guard, top = _lane_masks(n_lanes, width)
+    lows = _lanes([low] * n_lanes, width)
+
+    def in_matrix(i: int) -> int:
+        """Mask of the lanes of row i that are columns 0 to m"""
+        first, last = max(0, band - i), min(n_lanes - 1, m - i + band)
+        return ((1 << (last - first + 1) * width) - 1) << first * width
+
+    # substitution scores of each character along seq_b, offset by step and padded so
+    # that lanes i to i + 2 * band are row i's band; 0 outside columns 1 to m
+    profile_lanes = max(n, m) + n_lanes
+    subst = {char: _lanes([(match if char == seq_b[t - band - 1] else mismatch) + step
+                           if 1 <= t - band <= m else 0 for t in range(profile_lanes)], width)
+             for char in set(seq_a)}
+    subst_bias = _lanes([step] * n_lanes, width)
+    gap_up, gap_down = _lane_offsets(gap, n_lanes, width)
+    ramp = _gap_ramp(gap, n_lanes, width)
+    low_top = low << (n_lanes - 1) * width
+
+    # First row is gap penalties only, and each later row depends on the one before
+    row = _lanes([bias + (d - band) * gap if 0 <= d - band <= m else low for d in range(n_lanes)], width)
+    yield row
+    for i, char in enumerate(seq_a, 1):
+        diag = (row + ((subst[char] >> i * width) & full)) - subst_bias
+        up = ((row >> width) | low_top) + gap_up - gap_down
+        best = _lane_max(diag, up, guard, top)
+
+        # column 0 is gap penalties only
+        if i <= band:
+            best ^= best & (lane_full << (band - i) * width)
+            best |= (bias + i * gap) << (band - i) * width
+
+        inside = in_matrix(i)
+        row = (_left_max(best, ramp, full, width, guard, top) & inside) | (lows & ~inside & full)
+        yield row
+
+
+def _loop_band_rows(seq_a: str, seq_b: str, match: int, mismatch: int, gap: int, band: int) -> Iterator[list]:
+    """Yield the rows of the banded scoring matrix one cell at a time, for scores that
+    can't be packed, with -inf outside the band or the matrix"""
+    m, n_lanes = len(seq_b), 2 * band + 1
+    low = float("-inf")
+    row = [(d - band) * gap if 0 <= d - band <= m else low for d in range(n_lanes)]
+    yield row
+    for i, char in enumerate(seq_a, 1):
+        prev, row = row, [low] * n_lanes
+        for d in range(n_lanes):
+            j = i - band + d
+            if j == 0:
+                row[d] = i * gap
+            elif 0 < j <= m:
+                diag_score = prev[d] + (match if char == seq_b[j - 1] else mismatch)
+                up_score = prev[d + 1] + gap if d + 1 < n_lanes else low
+                left_score = row[d - 1] + gap if d > 0 else low
+                row[d] = max(diag_score, up_score, left_score)
+        yield row
+
+
+def _score_band(seq_a: str, seq_b: str, match: int, mismatch: int, gap: int, band: int) -> tuple[_BandMatrix, int]:
+    """Fill the banded scoring matrix, returning it (offset by a bias) and the bias"""
+    _check_band(seq_a, seq_b, band)
+    width, bias, low = _band_layout(len(seq_a), len(seq_b), match, mismatch, gap)
+    if width is None:
+        return _BandMatrix(list(_loop_band_rows(seq_a, seq_b, match, mismatch, gap, band)), band, float("-inf")), 0
+    rows = _packed_band_rows(seq_a, seq_b, match, mismatch, gap, band, width, bias, low)
+    return _BandMatrix([_unpack_lanes(row, 2 * band + 1, width) for row in rows], band, low), bias
+
+
+def _hirschberg(seq_a: str, seq_b: str, match: int, mismatch: int, gap: int) -> tuple[str, str]:
+    """Return an optimal alignment in memory linear in the sequence lengths
+
+    seq_a is halved, and seq_b split where the best alignment of the first half to a
+    prefix plus the reversed second half to the reversed suffix scores highest;
+    the two halves are then aligned independently.
+    """
+    if len(seq_a) <= 1 or len(seq_b) <= 1 or len(seq_a) * len(seq_b) <= _HIRSCHBERG_BASE_CELLS:
+        score_matrix, _ = _score_rows(seq_a, seq_b, match, mismatch, gap)
+        return _traceback(score_matrix, seq_a, seq_b, match, mismatch, gap)
+
+    mid = len(seq_a) // 2
+    forward, _ = _last_row(seq_a[:mid], seq_b, match, mismatch, gap)
+    backward, _ = _last_row(seq_a[mid:][::-1], seq_b[::-1], match, mismatch, gap)
+    totals = list(map(add, forward, reversed(backward)))
+    split = totals.index(max(totals))
+
+    left_a, left_b = _hirschberg(seq_a[:mid], seq_b[:split], match, mismatch, gap)
+    right_a, right_b = _hirschberg(seq_a[mid:], seq_b[split:], match, mismatch, gap)
+    return left_a + right_a, left_b + right_b
+
+
+def _alignment_score(aligned: tuple[str, str], match: int, mismatch: int, gap: int) -> int:
+    """Return the score of an alignment, column by column"""
+    score = 0
+    for base_a, base_b in zip(*aligned):
+        if base_a == "-" or base_b == "-":
+            score += gap
+        else:
+            score += match if base_a == base_b else mismatch
+    return score
+
+
+def _traceback(score_matrix: list[list[int]], seq_a: str, seq_b: str, match: int, mismatch: int, gap: int) -> tuple[str, str]:
+    # Traceback to get the aligned sequences
+    aligned_a, aligned_b = "", ""
+    i, j = len(seq_a), len(seq_b)
+    while i > 0 or j > 0:
+        current_score = score_matrix[i][j]
+        if i > 0 and j > 0 and (
+            (seq_a[i - 1] == seq_b[j - 1] and current_score == score_matrix[i - 1][j - 1] + match) or
+            (seq_a[i - 1] != seq_b[j - 1] and current_score == score_matrix[i - 1][j - 1] + mismatch)
+        ):
+            aligned_a = seq_a[i - 1] + aligned_a
+            aligned_b = seq_b[j - 1] + aligned_b
+            i -= 1
+            j -= 1
+        elif i > 0 and current_score == score_matrix[i - 1][j] + gap:
+            aligned_a = seq_a[i - 1] + aligned_a
+            aligned_b = "-" + aligned_b
+            i -= 1
+        else:
+            aligned_a = "-" + aligned_a
+            aligned_b = seq_b[j - 1] + aligned_b
+            j -= 1
+
+    return aligned_a, aligned_b
+
+
+# Gotoh states: last column a match/mismatch (M), a gap in seq_b (X, consuming seq_a)
+# or a gap in seq_a (Y, consuming seq_b). Each pointer byte holds the state each of
+# M, X and Y at that cell came from, two bits apiece at these shifts
+_STATE_M, _STATE_X, _STATE_Y = 0, 1, 2
+_POINTER_SHIFTS = (0, 2, 4)
+
+
+def gotoh(seq_a: str, seq_b: str, match: int, mismatch: int, gap_open: int, gap_extend: int) -> tuple[tuple[str, str], int]:
+    """Globally align two sequences with affine gap penalties (Gotoh's algorithm)
+
+    A gap of length L scores gap_open + (L - 1) * gap_extend, so gap_open == gap_extend
+    gives needleman_wunsch scores. While filling the three score matrices row by row,
+    the state each cell came from is kept in a bytearray of pointers, one byte per
+    cell, and the traceback follows them without recomputing any scores. Ties prefer
+    M, then X, then Y, and opening a gap over extending one.
+    """
+    width, bias, low = _affine_layout(len(seq_a), len(seq_b), match, mismatch, gap_open, gap_extend)
+    if width is None:
+        pointers, final, score = _gotoh_loop(seq_a, seq_b, match, mismatch, gap_open, gap_extend)
+    else:
+        pointers, final, score = _gotoh_rows(seq_a, seq_b, match, mismatch, gap_open, gap_extend, width, bias, low)
+    return _gotoh_traceback(pointers, final, seq_a, seq_b), score
+
+
+def _affine_layout(n: int, m: int, match: int, mismatch: int, gap_open: int, gap_extend: int) -> tuple[int, int, int]:
+    """Return (lane width, bias, low) to pack rows of Gotoh's matrices, as _band_layout"""
+    if not all(isinstance(score, int) for score in (gap_open, gap_extend)):
+        return None, 0, 0
+    gap = max(abs(gap_open), abs(gap_extend))
+    return _band_layout(n, m, match, mismatch, gap)
+
+
+def _gotoh_loop(seq_a: str, seq_b: str, match: int, mismatch: int, gap_open: int,
+                gap_extend: int) -> tuple[bytearray, int, int|float]:
+    """Fill Gotoh's matrices one cell at a time, returning (pointers, final state, score)"""
+    n, m = len(seq_a), len(seq_b)
+    low = float("-inf")
+    pointers = bytearray((n + 1) * (m + 1))
+
+    # First row: only gaps in seq_a (Y) reach it
+    mat = [0] + [low] * m
+    x_gap = [low] * (m + 1)
+    y_gap = [low] + [gap_open + (j - 1) * gap_extend for j in range(1, m + 1)]
+    for j in range(2, m + 1):
+        pointers[j] = _STATE_Y << _POINTER_SHIFTS[_STATE_Y]
+
+    for i in range(1, n + 1):
+        prev_mat, prev_x, prev_y = mat, x_gap, y_gap
+        # First column: only gaps in seq_b (X) reach it
+        mat, x_gap, y_gap = [low], [gap_open + (i - 1) * gap_extend], [low]
+        row = i * (m + 1)
+        if i > 1:
+            pointers[row] = _STATE_X << _POINTER_SHIFTS[_STATE_X]
+        for j in range(1, m + 1):
+            candidates = (prev_mat[j - 1], prev_x[j - 1], prev_y[j - 1])
+            from_m = candidates.index(max(candidates))
+            mat.append(candidates[from_m] + (match if seq_a[i - 1] == seq_b[j - 1] else mismatch))
+
+            candidates = (prev_mat[j] + gap_open, prev_x[j] + gap_extend, prev_y[j] + gap_open)
+            from_x = candidates.index(max(candidates))
+            x_gap.append(candidates[from_x])
+
+            opened = max(mat[j - 1], x_gap[j - 1])
+            if y_gap[j - 1] + gap_extend > opened + gap_open:
+                from_y = _STATE_Y
+                y_gap.append(y_gap[j - 1] + gap_extend)
+            else:
+                from_y = _STATE_M if mat[j - 1] >= x_gap[j - 1] else _STATE_X
+                y_gap.append(opened + gap_open)
+            pointers[row + j] = from_m | from_x << 2 | from_y << 4
+
+    final = (mat[m], x_gap[m], y_gap[m])
+    state = final.index(max(final))
+    return pointers, state, final[state]
+
+
+def _gotoh_rows(seq_a: str, seq_b: str, match: int, mismatch: int, gap_open: int, gap_extend: int,
+                width: int, bias: int, low: int) -> tuple[bytearray, int, int]:
+    """Fill Gotoh's matrices a row at a time on packed ints (see _packed_rows),
+    returning (pointers, final state, score)
+
+    Comparisons leave a flag in each lane's guard bit, and the flags of the three
+    choices are combined into each lane's pointer byte, which is sliced out of the
+    packed row's bytes. Cells no alignment reaches hold low. Y[i][j] is the best of
+    opening from max(M, X)[i][j - k] plus (k - 1) extensions, a running maximum.
+    """
+    n, m = len(seq_a), len(seq_b)
+    n_lanes = m + 1
+    step = max(abs(match), abs(mismatch), abs(gap_open), abs(gap_extend), 1)
+    lane_bytes = width // 8
+
+    full, guard, top = _lane_masks(n_lanes, width)
+    lane_full = (1 << width) - 1
+    ones = _lanes([1] * n_lanes, width)
+
+    subst = {char: _lanes([0] + [(match if char == base else mismatch) + step for base in seq_b], width)
+             for char in set(seq_a)}
+    subst_bias = _lanes([0] + [step] * m, width)
+    opens_up, opens_down = _lane_offsets(gap_open, n_lanes, width)
+    extends_up, extends_down = _lane_offsets(gap_extend, n_lanes, width)
+    ramp = _gap_ramp(gap_extend, n_lanes, width)
+
+    # First row: only gaps in seq_a (Y) reach it
+    mat = _lanes([bias] + [low] * m, width)
+    x_gap = _lanes([low] * n_lanes, width)
+    y_gap = _lanes([low] + [bias + gap_open + (j - 1) * gap_extend for j in range(1, n_lanes)], width)
+    pointers = bytearray(_STATE_Y << _POINTER_SHIFTS[_STATE_Y] if j > 1 else 0 for j in range(n_lanes))
+
+    for i, char in enumerate(seq_a, 1):
+        # M: best state at the diagonal, plus the substitution score
+        m_over_x = _lane_ge(mat, x_gap, guard, top)
+        best = _lane_select(m_over_x, mat, x_gap, top)
+        best_over_y = _lane_ge(best, y_gap, guard, top)
+        best = _lane_select(best_over_y, best, y_gap, top)
+        from_m = _lane_select(best_over_y, ones ^ m_over_x, ones << 1, top)
+        new_mat = ((((best << width) & full) + subst[char]) - subst_bias) | low
+        from_m = (from_m << width) & full
+
+        # X: open from M or Y above, or extend X above
+        opened_m = (mat + opens_up) - opens_down
+        opened_y = (y_gap + opens_up) - opens_down
+        extended = (x_gap + extends_up) - extends_down
+        m_over_x = _lane_ge(opened_m, extended, guard, top)
+        best = _lane_select(m_over_x, opened_m, extended, top)
+        best_over_y = _lane_ge(best, opened_y, guard, top)
+        new_x = _lane_select(best_over_y, best, opened_y, top)
+        from_x = _lane_select(best_over_y, ones ^ m_over_x, ones << 1, top)
+        # first column is gap penalties only
+        new_x ^= new_x & lane_full
+        new_x |= bias + gap_open + (i - 1) * gap_extend
+        from_x ^= from_x & lane_full
+        from_x |= _STATE_X if i > 1 else _STATE_M
+
+        # Y: open from max(M, X) to the left, or extend Y to the left
+        m_over_x = _lane_ge(new_mat, new_x, guard, top)
+        opened = (((_lane_select(m_over_x, new_mat, new_x, top) + opens_up - opens_down) << width) & full) | low
+        new_y = _left_max(opened, ramp, full, width, guard, top)
+        extended = ((((new_y << width) & full) | low) + extends_up) - extends_down
+        opens = _lane_ge(opened, extended, guard, top)
+        from_y = _lane_select(opens, ((ones ^ m_over_x) << width) & full, ones << 1, top)
+
+        mat, x_gap, y_gap = new_mat, new_x, new_y
+        flags = from_m | from_x << 2 | from_y << 4
+        pointers += flags.to_bytes(n_lanes * lane_bytes, "little")[::lane_bytes]
+
+    final = [(packed >> m * width) & lane_full for packed in (mat, x_gap, y_gap)]
+    state = final.index(max(final))
+    return pointers, state, final[state] - bias
+
+
+def _gotoh_traceback(pointers: bytearray, state: int, seq_a: str, seq_b: str) -> tuple[str, str]:
+    """Follow pointers back from the last cell, one step per alignment column"""
+    aligned_a, aligned_b = [], []
+    i, j = len(seq_a), len(seq_b)
+    row_len = len(seq_b) + 1
+    while i > 0 or j > 0:
+        pointer = pointers[i * row_len + j]
+        if state == _STATE_M:
+            aligned_a.append(seq_a[i - 1])
+            aligned_b.append(seq_b[j - 1])
+            i, j = i - 1, j - 1
+        elif state == _STATE_X:
+            aligned_a.append(seq_a[i - 1])
+            aligned_b.append("-")
+            i -= 1
+        else:
+            aligned_a.append("-")
+            aligned_b.append(seq_b[j - 1])
+            j -= 1
+        state = (pointer >> _POINTER_SHIFTS[state]) & 3
+    return "".join(reversed(aligned_a)), "".join(reversed(aligned_b))
@@ -0,0 +1,97 @@
+import pytest
+
+import amplicon_align
+from magnumopus import needleman_wunsch_score
+
+AMPLICONS = {
+    "a.fna": "CTTCTCGTCGGTCTCGTGGTTCGGGAAC",
+    "b.fna": "CTTTCATCCACTTCGTTGCCCGGGAAC",
+    # reverse complement of a.fna with one substitution
+    "c.fna": "GTTCCCGAACCACGAGACCGACTAGAAG",
+    "empty.fna": "",
+}
+
+
+@pytest.fixture
+def fake_ispcr(monkeypatch):
+    def ispcr(primer_file, assembly_file, max_amplicon_size):
+        amplicon = AMPLICONS[assembly_file]
+        return f">{assembly_file}\n{amplicon}\n" if amplicon else ""
+    monkeypatch.setattr(amplicon_align, "ispcr", ispcr)
+
+
+def batch_args(tmp_path, *extra):
+    return amplicon_align.parse_args(["-a", "a.fna", "b.fna", "c.fna", "empty.fna", "-p", "primers.fna", "-m", "2000",
+                                      "--match", "1", "--mismatch=-1", "--gap=-1",
+                                      "--cache", str(tmp_path / "cache"), *extra])
+
+
+class TestPairwiseScores:
+    @pytest.mark.parametrize("workers", [1, 2])
+    def test_best_orientation(self, workers):
+        """Is each pair scored in its better orientation, with or without worker processes"""
+        amplicons = [AMPLICONS["a.fna"], AMPLICONS["b.fna"], AMPLICONS["c.fna"]]
+        scores = amplicon_align.pairwise_scores(amplicons, 1, -1, -1, workers=workers)
+        for (i, j), score in scores.items():
+            assert score == max(needleman_wunsch_score(amplicons[i], amplicons[j], 1, -1, -1),
+                                needleman_wunsch_score(amplicons[i], amplicon_align.reverse_complement(amplicons[j]),
+                                                       1, -1, -1))
+        assert sorted(scores) == [(0, 1), (0, 2), (1, 2)]
+        assert scores[0, 2] == len(AMPLICONS["a.fna"]) - 2
+
+    def test_cache(self, tmp_path, monkeypatch):
+        """Are cached pairs reused, whatever the order of the pair"""
+        amplicons = [AMPLICONS["a.fna"], AMPLICONS["b.fna"]]
+        scores = amplicon_align.pairwise_scores(amplicons, 1, -1, -1, cache_dir=tmp_path)
+        assert len(list(tmp_path.glob("*/*.json"))) == 1
+
+        def fail(job):
+            raise AssertionError("pair was scored again")
+        monkeypatch.setattr(amplicon_align, "score_pair", fail)
+        assert amplicon_align.pairwise_scores(amplicons[::-1], 1, -1, -1, cache_dir=tmp_path) == scores
+        with pytest.raises(AssertionError):
+            amplicon_align.pairwise_scores(amplicons, 1, -1, -2, cache_dir=tmp_path)
+
+
+class TestBatch:
+    def test_phylip(self, tmp_path, fake_ispcr, capsys):
+        """Is a PHYLIP matrix written without the assembly that has no amplicon"""
+        amplicon_align.run_batch(batch_args(tmp_path, "-w", "1"))
+        out, err = capsys.readouterr()
+        lines = out.splitlines()
+        assert lines[0] == "    3"
+        assert [line.split()[0] for line in lines[1:]] == ["a", "b", "c"]
+        matrix = [[float(x) for x in line.split()[1:]] for line in lines[1:]]
+        assert all(matrix[i][i] == 0 and matrix[i] == [row[i] for row in matrix] for i in range(3))
+        assert matrix[0][2] == pytest.approx(2 / 28, abs=1e-6)
+        assert "empty.fna" in err
+
+    def test_tsv(self, tmp_path, fake_ispcr):
+        """Does a TSV matrix written to a file match the PHYLIP one"""
+        phylip, tsv = tmp_path / "out.phy", tmp_path / "out.tsv"
+        amplicon_align.run_batch(batch_args(tmp_path, "-w", "2", "-o", str(phylip)))
+        amplicon_align.run_batch(batch_args(tmp_path, "-w", "2", "-o", str(tsv), "--format", "tsv"))
+        tsv_lines = tsv.read_text().splitlines()
+        assert tsv_lines[0].split("\t") == ["", "a", "b", "c"]
+        assert [line.split("\t") for line in tsv_lines[1:]] == [line.split() for line in
+                                                                phylip.read_text().splitlines()[1:]]
+
+    def test_unique_names(self, tmp_path, monkeypatch, capsys):
+        """Are repeated and long names made unique, and cut to 10 characters for PHYLIP"""
+        monkeypatch.setattr(amplicon_align, "ispcr", lambda primers, assembly, size: f">x\n{AMPLICONS['a.fna']}\n")
+        args = amplicon_align.parse_args(["-a", "x/a.fna", "y/a.fna", "long_assembly_1.fna", "long_assembly_2.fna",
+                                          "-p", "p", "-m", "1", "--match", "1", "--mismatch=-1", "--gap=-1",
+                                          "--no_cache", "-w", "1"])
+        amplicon_align.run_batch(args)
+        labels = [line[:10] for line in capsys.readouterr().out.splitlines()[1:]]
+        assert labels == ["a         ", "a_2       ", "long_assem", "long_ass_2"]
+        args.format = "tsv"
+        amplicon_align.run_batch(args)
+        assert capsys.readouterr().out.splitlines()[0].split("\t")[1:] == ["a", "a_2", "long_assembly_1",
+                                                                             "long_assembly_2"]
+
+    def test_exclusive_modes(self):
+        """Are pair and batch mode rejected together"""
+        with pytest.raises(SystemExit):
+            amplicon_align.parse_args(["-1", "a.fna", "-a", "b.fna", "c.fna", "-p", "p", "-m", "1",
+                                       "--match", "1", "--mismatch=-1", "--gap=-1"])
@@ -0,0 +1,164 @@
+import random
+
+import pytest
+
+from magnumopus import nw
+from magnumopus.nw import (ENGINES, _alignment_score, _gotoh_loop, _gotoh_traceback, _score_loop, _score_rows,
+                           gotoh, needleman_wunsch, needleman_wunsch_score)
+
+SEQ_1 = "CTTCTCGTCGGTCTCGTGGTTCGGGAAC"
+SEQ_2 = "CTTTCATCCACTTCGTTGCCCGGGAAC"
+
+
+def random_pairs(n: int, seed: int = 1):
+    rng = random.Random(seed)
+    for _ in range(n):
+        seq_a = "".join(rng.choice("ACGT") for _ in range(rng.randint(0, 40)))
+        seq_b = "".join(rng.choice("ACGTN") for _ in range(rng.randint(0, 40)))
+        yield seq_a, seq_b, rng.randint(-2, 5), rng.randint(-5, 2), rng.randint(-5, 1)
+
+
+class TestEngines:
+    @pytest.mark.parametrize("engine", ENGINES)
+    def test_example(self, engine):
+        """Does each engine give the expected score and a valid alignment"""
+        (aln_1, aln_2), score = needleman_wunsch(SEQ_1, SEQ_2, 1, -1, -1, engine=engine)
+        assert score == 11
+        assert aln_1.replace("-", "") == SEQ_1 and aln_2.replace("-", "") == SEQ_2
+
+    def test_same_matrix(self):
+        """Does the rows engine fill the same scoring matrix as the loop, bias aside"""
+        for seq_a, seq_b, match, mismatch, gap in random_pairs(200):
+            rows, bias = _score_rows(seq_a, seq_b, match, mismatch, gap)
+            expected = _score_loop(seq_a, seq_b, match, mismatch, gap)
+            assert [[cell - bias for cell in row] for row in rows] == expected
+
+    def test_same_alignment(self):
+        """Do both engines return the same alignment and score"""
+        for seq_a, seq_b, match, mismatch, gap in random_pairs(500, seed=2):
+            assert needleman_wunsch(seq_a, seq_b, match, mismatch, gap, engine="rows") == \
+                needleman_wunsch(seq_a, seq_b, match, mismatch, gap, engine="loop")
+
+    def test_unknown_engine(self):
+        """Is an unknown engine rejected"""
+        with pytest.raises(ValueError):
+            needleman_wunsch(SEQ_1, SEQ_2, 1, -1, -1, engine="numpy")
+
+
+class TestHirschberg:
+    def test_optimal(self):
+        """Does the linear-memory mode find a valid alignment with the optimal score"""
+        for seq_a, seq_b, match, mismatch, gap in random_pairs(300, seed=3):
+            (aln_a, aln_b), score = needleman_wunsch(seq_a, seq_b, match, mismatch, gap, engine="hirschberg")
+            assert score == needleman_wunsch(seq_a, seq_b, match, mismatch, gap, engine="loop")[1]
+            assert aln_a.replace("-", "") == seq_a and aln_b.replace("-", "") == seq_b
+            assert _alignment_score((aln_a, aln_b), match, mismatch, gap) == score
+
+    def test_divides(self, monkeypatch):
+        """Are sequences longer than the base case split and still optimally aligned"""
+        monkeypatch.setattr(nw, "_HIRSCHBERG_BASE_CELLS", 4)
+        seq_a, seq_b = SEQ_1 * 4, SEQ_2 * 5
+        (aln_a, aln_b), score = needleman_wunsch(seq_a, seq_b, 2, -1, -2, engine="hirschberg")
+        assert score == needleman_wunsch(seq_a, seq_b, 2, -1, -2, engine="loop")[1]
+        assert aln_a.replace("-", "") == seq_a and aln_b.replace("-", "") == seq_b
+
+    def test_auto(self, monkeypatch):
+        """Does auto switch to the linear-memory mode above the size threshold"""
+        calls = []
+        hirschberg = nw._hirschberg
+        monkeypatch.setattr(nw, "_hirschberg", lambda *args: calls.append(args) or hirschberg(*args))
+        needleman_wunsch(SEQ_1, SEQ_2, 1, -1, -1)
+        assert not calls
+        monkeypatch.setattr(nw, "HIRSCHBERG_CELLS", 100)
+        assert needleman_wunsch(SEQ_1, SEQ_2, 1, -1, -1)[1] == 11
+        assert calls
+
+
+def banded_score(seq_a: str, seq_b: str, match: int, mismatch: int, gap: int, band: int) -> float:
+    """Score of the best alignment within band of the diagonal, one cell at a time"""
+    n, m = len(seq_a), len(seq_b)
+    score = [[float("-inf")] * (m + 1) for _ in range(n + 1)]
+    for i in range(n + 1):
+        for j in range(max(0, i - band), min(m, i + band) + 1):
+            if i == 0 or j == 0:
+                score[i][j] = (i + j) * gap
+            else:
+                score[i][j] = max(score[i - 1][j - 1] + (match if seq_a[i - 1] == seq_b[j - 1] else mismatch),
+                                  score[i - 1][j] + gap, score[i][j - 1] + gap)
+    return score[n][m]
+
+
+class TestScoreOnly:
+    def test_same_score(self):
+        """Does the score-only pass agree with the full alignment"""
+        for seq_a, seq_b, match, mismatch, gap in random_pairs(300, seed=4):
+            assert needleman_wunsch_score(seq_a, seq_b, match, mismatch, gap) == \
+                needleman_wunsch(seq_a, seq_b, match, mismatch, gap, engine="loop")[1]
+
+    def test_banded(self):
+        """Do banded scores and alignments match a cell-by-cell banded fill, staying in the band"""
+        for n, (seq_a, seq_b, match, mismatch, gap) in enumerate(random_pairs(300, seed=5)):
+            band = abs(len(seq_a) - len(seq_b)) + n % 7
+            expected = banded_score(seq_a, seq_b, match, mismatch, gap, band)
+            assert needleman_wunsch_score(seq_a, seq_b, match, mismatch, gap, band=band) == expected
+            (aln_a, aln_b), score = needleman_wunsch(seq_a, seq_b, match, mismatch, gap, band=band)
+            assert score == expected == _alignment_score((aln_a, aln_b), match, mismatch, gap)
+            assert aln_a.replace("-", "") == seq_a and aln_b.replace("-", "") == seq_b
+            i = j = 0
+            for base_a, base_b in zip(aln_a, aln_b):
+                i, j = i + (base_a != "-"), j + (base_b != "-")
+                assert abs(i - j) <= band
+
+    def test_wide_band(self):
+        """Does a band covering the whole matrix give the unbanded alignment"""
+        assert needleman_wunsch(SEQ_1, SEQ_2, 1, -1, -1, band=len(SEQ_1)) == needleman_wunsch(SEQ_1, SEQ_2, 1, -1, -1)
+
+    def test_non_integer_scores(self):
+        """Are float scores banded cell by cell"""
+        assert needleman_wunsch_score(SEQ_1, SEQ_2, 1.5, -1, -1, band=3) == banded_score(SEQ_1, SEQ_2, 1.5, -1, -1, 3)
+
+    def test_band_too_narrow(self):
+        """Is a band that can't reach the last cell rejected"""
+        with pytest.raises(ValueError):
+            needleman_wunsch_score("ACGTACGT", "ACG", 1, -1, -1, band=2)
+
+
+def affine_score(aligned: tuple[str, str], match: int, mismatch: int, gap_open: int, gap_extend: int) -> int:
+    """Score an alignment column by column with affine gaps"""
+    score, prev_state = 0, None
+    for base_a, base_b in zip(*aligned):
+        state = "X" if base_b == "-" else "Y" if base_a == "-" else "M"
+        if state == "M":
+            score += match if base_a == base_b else mismatch
+        else:
+            score += gap_extend if state == prev_state else gap_open
+        prev_state = state
+    return score
+
+
+class TestGotoh:
+    def test_matches_loop(self):
+        """Does the packed fill give the same alignment and score as the cell-by-cell fill"""
+        for n, (seq_a, seq_b, match, mismatch, gap) in enumerate(random_pairs(300, seed=6)):
+            gap_open, gap_extend = gap - n % 4, gap
+            pointers, state, score = _gotoh_loop(seq_a, seq_b, match, mismatch, gap_open, gap_extend)
+            aligned = _gotoh_traceback(pointers, state, seq_a, seq_b)
+            assert gotoh(seq_a, seq_b, match, mismatch, gap_open, gap_extend) == (aligned, score)
+            assert affine_score(aligned, match, mismatch, gap_open, gap_extend) == score
+            assert aligned[0].replace("-", "") == seq_a and aligned[1].replace("-", "") == seq_b
+
+    def test_linear_gaps(self):
+        """With equal open and extend penalties, is the score that of needleman_wunsch"""
+        for seq_a, seq_b, match, mismatch, gap in random_pairs(200, seed=7):
+            assert gotoh(seq_a, seq_b, match, mismatch, gap, gap)[1] == needleman_wunsch(seq_a, seq_b, match, mismatch, gap)[1]
+
+    def test_one_long_gap(self):
+        """Does a costly gap open favour one long gap over several short ones"""
+        (aln_a, aln_b), score = gotoh("ACGTTTTTACGT", "ACGTACGT", 2, -2, -5, -1)
+        assert aln_b.count("-") == 4 and "----" in aln_b
+        assert score == 8 * 2 - 5 - 3
+
+    def test_pointers_are_bytes(self):
+        """Is one pointer byte kept per cell"""
+        pointers, _, _ = _gotoh_loop(SEQ_1, SEQ_2, 1, -1, -3, -1)
+        assert isinstance(pointers, bytearray) and len(pointers) == (len(SEQ_1) + 1) * (len(SEQ_2) + 1)